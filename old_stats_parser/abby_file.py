@@ -1,10 +1,15 @@
 #!C:\Python27
 # -*- coding: utf-8 -*-
 import sys
-from openpyxl import load_workbook, Workbook
-from utils import get_unicode, write_ws
-import parsers
-import stats_book_1
+import argparse
+from collections import OrderedDict
+from itertools import islice
+from timeit import default_timer
+from classifier import RowClassifier
+from readers import BaseReader, OpenpyxlReader, PeekedReader, get_reader
+from sinks import get_sink
+from utils import convert_to_floats
+from layouts import get_layout, detect_layout, DETECT_ROWS
 
 
 # INTERNAL CLASSES
@@ -13,32 +18,135 @@ class AbbyParser():
     """Parse rows of ABBY output and build records from them.
 
     AbbyParser object needs a list of parsers and a context to be built.
-    Iterates through list of parsers looking for one that accepts the row, then
-    parser modifies the context based on extracted information of row and
-    AbbyParser build records from the context and return them."""
+    Uses a RowClassifier, compiled once from the list of parsers, to find the
+    first parser that accepts the row, then parser modifies the context based
+    on extracted information of row and AbbyParser build records from the
+    context and return them.
 
-    def __init__(self, parsers, context, records_builder):
+    If a profiler is passed, rows are parsed by an instrumented version of
+    parse_row that records timings and parsers statistics in it."""
+
+    def __init__(self, parsers, context, records_builder, profiler=None):
         self.context = context()
         self.parsers = parsers
+        self.classifier = RowClassifier(parsers)
         self.records_builder = records_builder
+        self.profiler = profiler
+
+        if profiler:
+            self.parse_row = self._parse_row_profiled
 
     def parse_row(self, row):
         """Main method. Parse a row modifying context an build records."""
 
-        # iterate through parsers
-        for parser_class in self.parsers:
-            if parser_class(row).accepts():
+        # find the parser that accepts the row
+        parser_class = self.classifier.classify(row)
 
-                # parse row and modify context with results
-                parser = parser_class(row, self.context)
-                parser.parse()
-                break
+        if parser_class:
+
+            # parse row and modify context with results
+            parser = parser_class(row, self.context)
+            parser.parse()
 
         # TODO: What happens if no parser accepts the row???
 
         # yield any new records that can be built, after row was parsed
         return self.records_builder(self.context).build_records()
 
+    def parse_rows(self, rows):
+        """Parse a block of rows like parse_row does, yielding the records
+        built after each row."""
+
+        # profiled parsing goes row by row
+        if self.profiler:
+            for row in rows:
+                yield self.parse_row(row)
+            return
+
+        for row in self.parse_block(rows):
+            yield self.records_builder(self.context).build_records()
+
+    def parse_block(self, rows):
+        """Parse a block of rows modifying context, without building records.
+        Yields each row after it is parsed, when context holds its results.
+
+        Rows are classified first, and numeric cells of all rows in the block
+        are converted to floats in one batch, before parsers use them."""
+
+        # profiled parsing goes row by row
+        if self.profiler:
+            for row in rows:
+                self._parse_profiled(row)
+                yield row
+            return
+
+        parser_classes = [self.classifier.classify(row) for row in rows]
+        rows_numbers = self._convert_numbers(rows, parser_classes)
+
+        for row, parser_class, numbers in zip(rows, parser_classes,
+                                              rows_numbers):
+            if parser_class:
+                parser_class(row, self.context, numbers).parse()
+
+            yield row
+
+    def _convert_numbers(self, rows, parser_classes):
+        """Return the numbers of numeric cells of each row (None if its parser
+        has no numeric cells), converting all of them in one batch."""
+
+        cells = []
+        for row, parser_class in zip(rows, parser_classes):
+            if parser_class and parser_class.numeric_cells:
+                cells.extend(row[parser_class.numeric_cells])
+
+        numbers = convert_to_floats(cells)
+
+        RV = []
+        i = 0
+        for row, parser_class in zip(rows, parser_classes):
+            if parser_class and parser_class.numeric_cells:
+                count = len(row[parser_class.numeric_cells])
+                RV.append(numbers[i:i + count])
+                i += count
+            else:
+                RV.append(None)
+
+        return RV
+
+    def _parse_row_profiled(self, row):
+        """Same as parse_row, recording timings and statistics in profiler."""
+
+        self._parse_profiled(row)
+
+        # yield any new records that can be built, after row was parsed
+        start = default_timer()
+        RV = self.records_builder(self.context).build_records()
+        self.profiler.add_time("build", default_timer() - start)
+
+        return RV
+
+    def _parse_profiled(self, row):
+        """Classify and parse a row recording timings and statistics in
+        profiler."""
+        profiler = self.profiler
+
+        # find the parser that accepts the row
+        start = default_timer()
+        parser_class, checked = self.classifier.classify_checked(row)
+        profiler.add_time("classify", default_timer() - start)
+        profiler.add_checks(checked, parser_class)
+
+        if parser_class:
+
+            # parse row and modify context with results
+            start = default_timer()
+            parser = parser_class(row, self.context)
+            parser.parse()
+            profiler.add_parse(parser_class, default_timer() - start)
+
+        else:
+            profiler.add_unmatched(row)
+
 
 # USER CLASSES
 class AbbyFile():
@@ -46,134 +154,306 @@ class AbbyFile():
     """Takes a workbook with a single sheet that is ABBY ocr output from an old
     stats book. Parse all rows of the worksheet building database records.
 
+    The workbook can be an openpyxl workbook loaded with use_iterators=True or
+    any reader of rows from readers module.
+
     Uses AbbyParser class to handle parsing wich needs parsers, context and
-    record builder to do it."""
+    record builder to do it. An optional profiler records timings of reading
+    and parsing."""
 
-    def __init__(self, wb, parsers, context, record_builder, output_fields):
+    def __init__(self, wb, parsers, context, record_builder, output_fields,
+                 profiler=None):
         self.wb = wb
         self.parsers = parsers
         self.context = context
         self.record_builder = record_builder
         self.output_fields = output_fields
+        self.profiler = profiler
 
     # PUBLIC
+    def get_rows(self):
+        """Yield every not empty row of workbook as a list of cell values."""
+
+        if isinstance(self.wb, BaseReader):
+            reader = self.wb
+        else:
+            reader = OpenpyxlReader(self.wb)
+
+        # time reading of rows and decoding of values apart
+        if self.profiler:
+            self.profiler.decoder = reader.decoder
+            reader.decoder.decode = self.profiler.timer("decode",
+                                                        reader.decoder.decode)
+            return self.profiler.timed_iter("read", reader.iter_rows())
+
+        return reader.iter_rows()
+
     def get_records(self):
         """Read all rows of workbook and parse them looking to build database
         records from them. Yield records as soon as they are built."""
 
-        # load active sheet of wb
-        ws = self.wb.get_active_sheet()
+        for row_index, record_lines in self.iter_parsed_rows():
+
+            # yields any record built from row
+            for record in record_lines:
+                yield record
+
+    def iter_batches(self, batch_size=None):
+        """Read and parse all rows of workbook, yielding records in column
+        blocks of batch_size records (the last one can be smaller). Blocks are
+        ordered dicts with a list of values for every output field, in output
+        fields order.
+
+        Records builder writes values straight in preallocated columns,
+        without building a record object for each one."""
+
+        batch_size = batch_size or BATCH_SIZE
 
         # create AbbyParser instance
-        ap = AbbyParser(self.parsers, self.context, self.record_builder)
+        ap = AbbyParser(self.parsers, self.context, self.record_builder,
+                        self.profiler)
+        self.abby_parser = ap
+
+        build_columns = self._build_columns
+        if self.profiler:
+            build_columns = self.profiler.timer("build", build_columns)
+
+        columns = self._new_columns(batch_size)
+        size = 0
+
+        # iterate through abby_file wb rows in blocks
+        rows = self.get_rows()
+        while True:
+            block = list(islice(rows, BLOCK_ROWS))
+            if not block:
+                break
 
-        # iterate through all abby_file wb rows
-        for row in ws.iter_rows():
-            cells_values = []
+            for row in ap.parse_block(block):
+                size = build_columns(ap.context, columns, size)
 
-            # iterate through all cells in row
-            for cell in row:
-                # add cell value
-                cells_values.append(get_unicode(cell.internal_value))
+                # yield full blocks, keeping records left for the next one
+                while size >= batch_size:
+                    yield self._columns_block(columns, batch_size)
+                    columns = [column[batch_size:size] for column in columns]
+                    size -= batch_size
+                    for column in columns:
+                        column.extend([None] * (batch_size - size))
 
-            # checks if list of cell values not empty
-            if not self._empty(cells_values):
-                # remove any empty cell that might be at the end of row
-                cells_values = self._remove_lasts_none(cells_values)
+        if size:
+            yield self._columns_block(columns, size)
 
-                # parse all posible records from row (list of cell values)
-                record_lines = ap.parse_row(cells_values)
+    def iter_parsed_rows(self, start_row=0, context=None):
+        """Yield (row index, records built) for every row of workbook.
 
-                # yields any record built from row
-                for record in record_lines:
-                    yield record
+        Parsing can start at start_row with a context saved from a previous
+        run, skipping the rows before it. Parser used is kept in abby_parser
+        attribute, so its context can be saved while rows are parsed."""
 
-    # PRIVATE
-    def _empty(self, values_list):
-        """True if values_list is empty."""
-        RV = True
+        # create AbbyParser instance
+        ap = AbbyParser(self.parsers, self.context, self.record_builder,
+                        self.profiler)
+        if context is not None:
+            ap.context = context
+        self.abby_parser = ap
+
+        # iterate through abby_file wb rows in blocks, from start_row
+        rows = islice(self.get_rows(), start_row, None)
+        row_index = start_row
+        while True:
+            block = list(islice(rows, BLOCK_ROWS))
+            if not block:
+                break
 
-        for value in values_list:
-            if value is not None:
-                RV = False
+            # parse all posible records from each row (list of cell values)
+            for record_lines in ap.parse_rows(block):
+                yield row_index, record_lines
+                row_index += 1
 
-        return RV
 
-    def _remove_lasts_none(self, values_list):
-        """Delete None values at the end of a list."""
-        RV = values_list
+    # PRIVATE
+    def _build_columns(self, context, columns, size):
+        return self.record_builder(context).build_columns(columns, size)
+
+    def _new_columns(self, batch_size):
+        """Return empty columns preallocated for batch_size records."""
+        return [[None] * batch_size for field in self.output_fields]
 
-        while RV[-1] is None:
-            del RV[-1]
+    def _columns_block(self, columns, size):
+        """Return a block with the first size values of columns."""
 
-        return RV
+        return OrderedDict(zip(self.output_fields,
+                               [column[:size] for column in columns]))
 
 
 # DATA
 ABBY_FILE_NAME = "abby_file.xlsx"
 ABBY_PARSED_FILE_NAME = "abby_parsed.xlsx"
 
-PARSERS = [parsers.IgnoreRow, parsers.NoneImportParser, parsers.Head1Parser,
-           parsers.Head1IniPart, parsers.AgValuesParser,
-           parsers.Head1FinalPart, parsers.TblRowParser, parsers.Head2Parser,
-           parsers.TitleParser, parsers.Subt1Parser, parsers.Subt2Parser]
-
-FIELDS = ["id_title",
-          "desc_title",
-          "id_subt1",
-          "desc_subt1",
-          "id_subt2",
-          "desc_subt2",
-          "id_product",
-          "tariff_number",
-          "desc_product",
-          "product_units",
-          "id_country",
-          "desc_country",
-          "year",
-          "quantity",
-          "value"]
-
-
-def scrape_abby_file(wb_abby_name=None, wb_abby_parsed_name=None):
-    """Takes an abby output excel file and returns a database formatted excel
-    file with records built from it."""
+# rows parsed together, converting their numbers in one batch
+BLOCK_ROWS = 256
 
-    # if not wb names passed, defaults name are used
-    wb_abby_name = wb_abby_name or ABBY_FILE_NAME
-    wb_abby_parsed_name = wb_abby_parsed_name or ABBY_PARSED_FILE_NAME
+# records of every column block yielded by AbbyFile.iter_batches
+BATCH_SIZE = 10000
 
-    # loads abby file
-    wb_abby = load_workbook(filename=wb_abby_name, use_iterators=True)
-    abby_file = AbbyFile(wb_abby, PARSERS, stats_book_1.Context,
-                         stats_book_1.RecordsBuilder, FIELDS)
 
-    # creates new excel sheet to store new records
-    wb_parsed = Workbook(optimized_write=True)
-    ws_parsed = wb_parsed.create_sheet()
+def scrape_abby_file(wb_abby_name=None, wb_abby_parsed_name=None,
+                     output_format=None, reader=None, profile=None,
+                     profile_dump=None, checkpoint=None,
+                     checkpoint_every=1000, layout=None):
+    """Takes an abby output excel file and returns a database formatted file
+    with records built from it. Returns the number of records written.
 
-    # write field names
-    ws_parsed.append(FIELDS)
+    Output format is taken from output_format ("xlsx", "csv", "tsv", "parquet"
+    or "arrow") or, if not passed, from the extension of the output file name.
+    Rows are read with openpyxl, unless reader "xml" is passed to stream them
+    straight from the xlsx file.
 
-    # write every record parsed in the database formatted excel sheet
-    for record in abby_file.get_records():
-        write_ws(ws_parsed, record, FIELDS)
+    If profile is passed, a json report with timings of every stage and
+    statistics of every parser is written in that file. If profile_dump is
+    passed, the run is profiled with cProfile and stats are dumped there.
 
-    # save database formatted excel with parsed records
-    wb_parsed.save(wb_abby_parsed_name)
+    If checkpoint is passed (a file name, or True to use the output name with
+    ".checkpoint" extension), progress is saved every checkpoint_every rows and
+    an interrupted run resumes from the last checkpoint. Checkpoint files are
+    removed when the whole book is parsed.
 
+    Book layout (parsers, context, records builder and fields) is taken from
+    layouts registry by its name, or detected from the first rows of the book
+    if no layout is passed."""
 
-# executes main routine
-if __name__ == '__main__':
+    # if not wb names passed, defaults name are used
+    wb_abby_name = wb_abby_name or ABBY_FILE_NAME
+    wb_abby_parsed_name = wb_abby_parsed_name or ABBY_PARSED_FILE_NAME
 
-    # if parameters are passed, use them
-    input_file = None
-    output_file = None
+    c_profile = None
+    if profile_dump:
+        import cProfile
+        c_profile = cProfile.Profile()
+        c_profile.enable()
+
+    # cProfile stats of a failed run are dumped too
+    try:
+        # loads abby file
+        wb_abby = get_reader(wb_abby_name, reader)
+
+        # take layout by name, or detect it from first rows of the book, which
+        # are parsed afterwards without reading them again
+        if layout:
+            layout = get_layout(layout)
+        else:
+            wb_abby = PeekedReader(wb_abby, DETECT_ROWS)
+            layout = detect_layout(wb_abby.head)
+
+        profiler = None
+        if profile or profile_dump:
+            from profiling import Profiler
+            profiler = Profiler(layout.parsers)
+
+        abby_file = AbbyFile(wb_abby, layout.parsers, layout.context,
+                             layout.records_builder, layout.fields, profiler)
+
+        # creates output sink to store new records
+        sink = get_sink(wb_abby_parsed_name, layout.fields, output_format)
+
+        write = sink.write
+        write_batch = sink.write_batch
+        close = sink.close
+        if profiler:
+            write = profiler.timer("write", write)
+            write_batch = profiler.timer("write", write_batch)
+            close = profiler.timer("write", close)
+
+        # remove the unfinished output of a failed (or interrupted) run, the
+        # checkpoint keeps the records to write it again
+        try:
+            # resume an interrupted run from its last checkpoint
+            start_row = 0
+            context = None
+            records_count = 0
+            if checkpoint:
+                if checkpoint is True:
+                    checkpoint = wb_abby_parsed_name + ".checkpoint"
+                from checkpoint import Checkpoint
+                checkpoint = Checkpoint(checkpoint, wb_abby_name,
+                                        checkpoint_every, layout.name)
+                start_row, context, records = checkpoint.resume()
+                for record in records:
+                    write(record)
+                    records_count += 1
+
+            # write every record parsed in the database formatted output, row
+            # by row to save checkpoints, in column blocks otherwise
+            if checkpoint:
+                for row_index, records in abby_file.iter_parsed_rows(
+                        start_row, context):
+                    for record in records:
+                        write(record)
+                        records_count += 1
+
+                    checkpoint.add(row_index, records,
+                                   abby_file.abby_parser.context)
+
+            else:
+                for columns in abby_file.iter_batches():
+                    write_batch(columns)
+                    records_count += len(columns[layout.fields[0]])
+
+        except BaseException:
+            sink.abort()
+            raise
+
+        # finish database formatted output with parsed records
+        close()
+
+        if checkpoint:
+            checkpoint.remove()
+
+        if profiler:
+            profiler.records = records_count
+            profiler.stop()
+            if profile:
+                profiler.save(profile)
+
+    finally:
+        if c_profile:
+            c_profile.disable()
+            c_profile.dump_stats(profile_dump)
+
+    return records_count
+
+
+def main(args=None):
+    """Command line entry point to parse one book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse an ABBY file of an old stats book and write its "
+                    "records in a database formatted file.")
+    arg_parser.add_argument("input_file", nargs="?", default=None,
+                            help="ABBY file to parse (default: %s)" %
+                                 ABBY_FILE_NAME)
+    arg_parser.add_argument("output_file", nargs="?", default=None,
+                            help="file for parsed records (default: %s)" %
+                                 ABBY_PARSED_FILE_NAME)
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format (default: from extension)")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default), xml or "
+                                 "rowstore")
+    arg_parser.add_argument("-l", "--layout", default=None,
+                            help="book layout (default: detected)")
+    arg_parser.add_argument("-p", "--profile", default=None,
+                            help="write a json report of timings here")
+    arg_parser.add_argument("-c", "--checkpoint", action="store_true",
+                            help="save progress to resume interrupted runs")
+    args = arg_parser.parse_args(args)
+
+    scrape_abby_file(args.input_file, args.output_file, args.format,
+                     args.reader, args.profile, checkpoint=args.checkpoint,
+                     layout=args.layout)
+
+    return 0
 
-    if len(sys.argv) >= 2:
-        input_file = sys.argv[1]
-    if len(sys.argv) >= 3:
-        output_file = sys.argv[2]
 
-    # main call
-    scrape_abby_file(input_file, output_file)
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
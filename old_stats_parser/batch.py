@@ -0,0 +1,210 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+from abby_file import scrape_abby_file
+from result_cache import scrape_abby_file_cached
+from rowstore import ROW_STORE_EXTENSION, is_compiled
+
+
+# DATA
+ABBY_PARSED_DIR = "abby_parsed"
+PARSED_SUFFIX = "_parsed"
+SUMMARY_FILE_NAME = "run_summary.json"
+
+
+# INTERNAL FUNCTIONS
+def find_abby_files(path):
+    """Return a sorted list of ABBY files from a directory or a glob pattern.
+    Excel lock files (starting with "~$") are skipped.
+
+    A directory means all excel files and row stores inside it. A book with
+    a row store compiled from its current version is taken from the store,
+    row stores of older versions of a book are skipped."""
+
+    if not os.path.isdir(path):
+        return [file_name for file_name in sorted(glob.glob(path))
+                if not os.path.basename(file_name).startswith("~$")]
+
+    books = find_abby_files(os.path.join(path, "*.xlsx"))
+    RV = list(books)
+    for row_store_name in find_abby_files(os.path.join(
+            path, "*" + ROW_STORE_EXTENSION)):
+        book_name = os.path.splitext(row_store_name)[0] + ".xlsx"
+        if book_name not in books:
+            RV.append(row_store_name)
+        elif is_compiled(book_name, row_store_name):
+            RV[RV.index(book_name)] = row_store_name
+
+    return sorted(RV)
+
+
+def get_output_name(input_name, output_dir, extension=".xlsx"):
+    """Build the name of the output file of a book inside output_dir."""
+
+    base_name = os.path.splitext(os.path.basename(input_name))[0]
+
+    return os.path.join(output_dir, base_name + PARSED_SUFFIX + extension)
+
+
+def get_output_names(input_names, output_dir, extension=".xlsx"):
+    """Build names of output files of books inside output_dir, like
+    get_output_name, numbering outputs of books with the same name (from
+    different directories) so that each one gets its own file."""
+
+    RV = []
+    used = set()
+    for input_name in input_names:
+        output_name = get_output_name(input_name, output_dir, extension)
+        root, ext = os.path.splitext(output_name)
+        number = 1
+        while os.path.normcase(output_name) in used:
+            number += 1
+            output_name = "%s_%d%s" % (root, number, ext)
+
+        used.add(os.path.normcase(output_name))
+        RV.append(output_name)
+
+    return RV
+
+
+def get_book_reader(input_name, reader=None):
+    """Return the reader of a book: row stores are always read as such."""
+
+    if input_name.lower().endswith(ROW_STORE_EXTENSION):
+        return "rowstore"
+
+    return reader
+
+
+def scrape_book(input_name, output_name, output_format=None, reader=None,
+                cache_dir=None):
+    """Parse one book and return a dictionary with its results. Runs inside a
+    worker process, so any error is caught and reported in the results
+    instead of stopping the whole batch. If cache_dir is passed, outputs of
+    unchanged books are taken from the results cache in that directory."""
+
+    RV = {"input": input_name,
+          "output": output_name,
+          "records": None,
+          "cached": False,
+          "seconds": None,
+          "error": None}
+
+    start = time.time()
+    try:
+        if cache_dir:
+            results = scrape_abby_file_cached(input_name, output_name,
+                                              output_format, reader,
+                                              cache_dir=cache_dir)
+            RV["records"] = results["records"]
+            RV["cached"] = results["cached"]
+        else:
+            RV["records"] = scrape_abby_file(input_name, output_name,
+                                             output_format, reader)
+    except Exception:
+        RV["error"] = traceback.format_exc()
+    RV["seconds"] = round(time.time() - start, 3)
+
+    return RV
+
+
+# USER FUNCTIONS
+def scrape_abby_files(path, output_dir=None, max_workers=None,
+                      summary_name=None, output_format=None, reader=None,
+                      cache_dir=None):
+    """Parse every ABBY file found in path (a directory or a glob pattern)
+    using a pool of processes, one book per worker at a time.
+
+    Each book is written to its own output file in output_dir (books with
+    the same name get numbered outputs), and a summary of the whole run is
+    written as json in output_dir. Output files are written in output_format
+    ("xlsx" by default) and books are read with reader ("openpyxl" by
+    default, see readers module), row stores with their own reader. If
+    cache_dir is passed, books already parsed with the same code and
+    settings are not parsed again, their outputs are copied from the results
+    cache in that directory (see result_cache module). Returns the
+    summary."""
+
+    output_dir = output_dir or ABBY_PARSED_DIR
+    output_format = output_format or "xlsx"
+    summary_name = summary_name or os.path.join(output_dir, SUMMARY_FILE_NAME)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    input_names = find_abby_files(path)
+    output_names = get_output_names(input_names, output_dir,
+                                    "." + output_format)
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # farm out books to worker processes
+    start = time.time()
+    books = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(scrape_book, input_name, output_name,
+                                   output_format,
+                                   get_book_reader(input_name, reader),
+                                   cache_dir)
+                   for input_name, output_name in zip(input_names,
+                                                      output_names)]
+
+        for future in as_completed(futures):
+            books.append(future.result())
+
+    # merge results of all books, in the same order of input files
+    books.sort(key=lambda book: input_names.index(book["input"]))
+    summary = {"books": books,
+               "books_count": len(books),
+               "errors_count": len([book for book in books if book["error"]]),
+               "cached_count": len([book for book in books if book["cached"]]),
+               "records": sum([book["records"] or 0 for book in books]),
+               "seconds": round(time.time() - start, 3)}
+
+    with open(summary_name, "w") as summary_file:
+        json.dump(summary, summary_file, indent=4, sort_keys=True)
+
+    return summary
+
+
+def main(args=None):
+    """Command line entry point for batch processing."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse many ABBY files using a pool of processes.")
+    arg_parser.add_argument("path", help="directory or glob of ABBY files")
+    arg_parser.add_argument("output_dir", nargs="?", default=None,
+                            help="directory for parsed files and summary")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="number of worker processes (default: cpus)")
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format: xlsx (default), csv, tsv, "
+                                 "parquet or arrow")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("-c", "--cache-dir", default=None,
+                            help="results cache directory, to skip books "
+                                 "already parsed")
+    args = arg_parser.parse_args(args)
+
+    summary = scrape_abby_files(args.path, args.output_dir, args.jobs,
+                                output_format=args.format,
+                                reader=args.reader,
+                                cache_dir=args.cache_dir)
+
+    print "%d books (%d cached), %d errors, %d records in %.2f seconds" % (
+        summary["books_count"], summary["cached_count"],
+        summary["errors_count"], summary["records"], summary["seconds"])
+
+    return 1 if summary["errors_count"] else 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
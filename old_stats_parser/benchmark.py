@@ -0,0 +1,232 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from classifier import RowClassifier
+from layouts import get_layout, DEFAULT_LAYOUT
+from readers import get_reader
+from sinks import get_sink
+from synthetic_book import generate_book
+from memory import peak_rss_kb
+
+
+class Benchmark():
+
+    """Time every stage of parsing a book separately: read rows, classify
+    them, parse them into the context, build records and write them.
+
+    Each stage is run repeat times and the best time is kept. Results give
+    seconds and rows (or records) per second of every stage, and the peak
+    memory of the process. Books are parsed with the layout called layout,
+    the default one if no name is passed."""
+
+    def __init__(self, file_name, reader=None, output_format="csv",
+                 repeat=1, layout=None):
+        self.file_name = file_name
+        self.reader = reader
+        self.output_format = output_format
+        self.repeat = repeat
+        self.layout = get_layout(layout)
+        self.times = {}
+
+    # PUBLIC
+    def run(self):
+        """Run all stages and return a dict with results."""
+
+        rows = self._best("read", self._read)[1]
+        classes = self._best("classify", self._classify, rows)[1]
+        self._best("parse", self._parse, rows, classes)
+        records = self._best("build", self._build, rows, classes,
+                             timed=True)[1]
+        self._best("write", self._write, records)
+
+        stages = {}
+        for stage in STAGES:
+            count = len(records) if stage == "write" else len(rows)
+            seconds = self.times[stage]
+            stages[stage] = {"seconds": round(seconds, 6),
+                             "per_second": round(count / seconds, 1)
+                             if seconds else None}
+
+        return {"file_name": self.file_name,
+                "reader": self.reader or "openpyxl",
+                "output_format": self.output_format,
+                "rows": len(rows),
+                "records": len(records),
+                "stages": stages,
+                "peak_rss_kb": peak_rss_kb()}
+
+    # PRIVATE
+    def _best(self, stage, method, *args, **kwargs):
+        """Run a stage method repeat times, keeping its best time in
+        self.times. Returns best time and the result of the method.
+
+        If timed is True the method times itself (to leave out work that
+        belongs to other stages) and returns its seconds and its result."""
+
+        best = None
+        for i in xrange(self.repeat):
+            if kwargs.get("timed"):
+                seconds, result = method(*args)
+            else:
+                start = time.time()
+                result = method(*args)
+                seconds = time.time() - start
+            if best is None or seconds < best:
+                best = seconds
+
+        self.times[stage] = best
+
+        return best, result
+
+    def _read(self):
+        return list(get_reader(self.file_name, self.reader).iter_rows())
+
+    def _classify(self, rows):
+        classify = RowClassifier(self.layout.parsers).classify
+        return [classify(row) for row in rows]
+
+    def _parse(self, rows, classes):
+        context = self.layout.context()
+        for row, parser_class in zip(rows, classes):
+            if parser_class:
+                parser_class(row, context).parse()
+
+    def _build(self, rows, classes):
+        """Parse rows again, timing only the building of records after each
+        one. Returns seconds and records."""
+
+        records_builder = self.layout.records_builder
+        context = self.layout.context()
+        records = []
+        seconds = 0.0
+        for row, parser_class in zip(rows, classes):
+            if parser_class:
+                parser_class(row, context).parse()
+
+            start = time.time()
+            records.extend(records_builder(context).build_records())
+            seconds += time.time() - start
+
+        return seconds, records
+
+    def _write(self, records):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(temp_dir, "benchmark." +
+                                     self.output_format)
+            sink = get_sink(file_name, self.layout.fields,
+                            self.output_format)
+            for record in records:
+                sink.write(record)
+            sink.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+# DATA
+STAGES = ["read", "classify", "parse", "build", "write"]
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """Compare rows per second of every stage against baseline results.
+    Returns a list of (stage, ratio) for stages slower than baseline by more
+    than tolerance (ratio is current speed / baseline speed)."""
+
+    RV = []
+    for stage in STAGES:
+        current = results["stages"][stage]["per_second"]
+        reference = baseline["stages"].get(stage, {}).get("per_second")
+        if current and reference:
+            ratio = current / reference
+            if ratio < 1 - tolerance:
+                RV.append((stage, ratio))
+
+    return RV
+
+
+def print_results(results, baseline=None):
+    """Print a table with results of every stage."""
+
+    print "%d rows, %d records from %s" % (results["rows"], results["records"],
+                                           results["file_name"])
+    for stage in STAGES:
+        line = "%-10s %10.4f s %14s /s" % (
+            stage, results["stages"][stage]["seconds"],
+            results["stages"][stage]["per_second"])
+        if baseline and baseline["stages"].get(stage, {}).get("per_second"):
+            line += "  (%.2fx baseline)" % (
+                (results["stages"][stage]["per_second"] or 0) /
+                baseline["stages"][stage]["per_second"])
+        print line
+    print "peak memory: %s kB" % results["peak_rss_kb"]
+
+
+def main(args=None):
+    """Command line entry point for benchmarks."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Time the stages of parsing an ABBY book.")
+    arg_parser.add_argument("file_name", nargs="?", default=None,
+                            help="ABBY file (default: a synthetic book)")
+    arg_parser.add_argument("--titles", type=int, default=10,
+                            help="titles of the synthetic book")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("-l", "--layout", default=None,
+                            help="book layout (default: %s)" %
+                                 DEFAULT_LAYOUT)
+    arg_parser.add_argument("-f", "--format", default="csv",
+                            help="output format of the write stage")
+    arg_parser.add_argument("-n", "--repeat", type=int, default=3)
+    arg_parser.add_argument("--baseline", default=None,
+                            help="json results to compare with")
+    arg_parser.add_argument("--save", default=None,
+                            help="save results as json (e.g. a new baseline)")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="slowdown allowed against baseline")
+    args = arg_parser.parse_args(args)
+
+    temp_dir = None
+    file_name = args.file_name
+    if not file_name:
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, "synthetic_book.xlsx")
+        generate_book(file_name, titles=args.titles)
+
+    try:
+        results = Benchmark(file_name, args.reader, args.format,
+                            args.repeat, args.layout).run()
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if baseline:
+        regressions = compare_results(results, baseline, args.tolerance)
+        for stage, ratio in regressions:
+            print "REGRESSION: %s runs at %.2fx of baseline speed" % (stage,
+                                                                     ratio)
+        return 1 if regressions else 0
+
+    return 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
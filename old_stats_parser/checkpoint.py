@@ -0,0 +1,155 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import copy
+import cPickle as pickle
+
+
+class Checkpoint():
+
+    """Persist progress of parsing a book, to resume it after a failure instead
+    of parsing it again from the first row.
+
+    Records are appended to a records file as soon as they are emitted. Every
+    `every` rows a state file is saved with the index of the next row to
+    parse, a snapshot of the context (including last_row of splitted heads),
+    the number of records emitted and the size of the records file at that
+    point. State is bound to the input file by its size and modification
+    time, and to the name of the layout parsing it, so a checkpoint of a
+    changed file or of another layout is never resumed."""
+
+    def __init__(self, file_name, input_name, every=1000, layout_name=None):
+        self.file_name = file_name
+        self.records_name = file_name + ".records"
+        self.input_name = input_name
+        self.every = every
+        self.layout_name = layout_name
+        self.records_file = None
+        self.records_count = 0
+        self.rows_since_save = 0
+
+    # PUBLIC
+    def resume(self):
+        """Return (next row index, context snapshot, records emitted) from
+        last checkpoint, or (0, None, []) if there is nothing to resume.
+        Records are yielded one at a time from the records file, which is
+        opened to append records after the checkpoint."""
+
+        state = self._load_state()
+
+        if state is None:
+            self.records_file = open(self.records_name, "wb")
+            return 0, None, []
+
+        # drop records written after last saved state
+        self.records_file = open(self.records_name, "r+b")
+        self.records_file.truncate(state["records_offset"])
+        self.records_file.seek(state["records_offset"])
+        self.records_count = state["records_count"]
+
+        return (state["row_index"], state["context"],
+                self._iter_records(state["records_count"]))
+
+    def add(self, row_index, records, context):
+        """Append records emitted by a row to the records file, saving state
+        if `every` rows were parsed since last time."""
+
+        for record in records:
+            pickle.dump(record, self.records_file, pickle.HIGHEST_PROTOCOL)
+        self.records_count += len(records)
+
+        self.rows_since_save += 1
+        if self.rows_since_save >= self.every:
+            self.save(row_index + 1, context)
+
+    def save(self, row_index, context):
+        """Save state to resume parsing at row_index with context."""
+
+        self.records_file.flush()
+        os.fsync(self.records_file.fileno())
+
+        state = {"input": self._fingerprint(),
+                 "row_index": row_index,
+                 "context": copy.deepcopy(context),
+                 "records_count": self.records_count,
+                 "records_offset": self.records_file.tell()}
+
+        # write state in a temporary file and replace the old one at once
+        temp_name = self.file_name + ".tmp"
+        with open(temp_name, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_name, self.file_name)
+
+        self.rows_since_save = 0
+
+    def remove(self):
+        """Delete checkpoint files, once the book is completely parsed."""
+
+        if self.records_file:
+            self.records_file.close()
+
+        for file_name in [self.file_name, self.records_name]:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    # PRIVATE
+    def _iter_records(self, records_count):
+        """Yield the first records_count records of the records file, read
+        with their own handle (records after them are never read)."""
+
+        with open(self.records_name, "rb") as f:
+            for i in xrange(records_count):
+                yield pickle.load(f)
+
+    def _load_state(self):
+        """Return saved state if it exists and belongs to the input file."""
+
+        if not (os.path.exists(self.file_name) and
+                os.path.exists(self.records_name)):
+            return None
+
+        try:
+            with open(self.file_name, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            return None
+
+        if state.get("input") != self._fingerprint():
+            return None
+
+        return state
+
+    def _fingerprint(self):
+        """Identify the input file by its path, size and modification time,
+        and the layout parsing it."""
+
+        stat = os.stat(self.input_name)
+
+        return (os.path.abspath(self.input_name), stat.st_size, stat.st_mtime,
+                self.layout_name)
+
+
+# DATA
+# flags of MoveFileEx to replace an existing file and return once moved
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+
+def replace_file(source_name, target_name):
+    """Rename source_name to target_name replacing it in one step, so either
+    the old or the new file is always there. In windows rename fails if the
+    target exists, so MoveFileEx is used instead."""
+
+    if sys.platform != "win32":
+        os.rename(source_name, target_name)
+        return
+
+    import ctypes
+
+    if not ctypes.windll.kernel32.MoveFileExW(
+            unicode(source_name), unicode(target_name),
+            MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
@@ -0,0 +1,119 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import re
+
+
+class RowClassifier():
+
+    """Find the parser class that accepts a row, without building parsers.
+
+    Accepting conditions of every parser (row_substring, row_length and
+    row_pattern) are gathered once, when the classifier is built, and compiled
+    into a dispatch table keyed by row length. Each length bucket keeps only
+    the parsers that could accept a row of that length, in the same order of
+    the parsers list, so the first parser that matches is the same one that
+    would be picked trying parsers one by one.
+
+    Parsers that override BaseParser.accepts() can't be compiled, so their own
+    accepts() method is called in its turn."""
+
+    def __init__(self, parsers):
+        self.parsers = parsers
+
+        # compiled checks of every parser, in parsers order
+        checks = [self._compile(parser_class) for parser_class in parsers]
+
+        # build a bucket of checks for every row length declared by parsers
+        lengths = set([check[1] for check in checks if check[1]])
+        self.buckets = {}
+        for length in lengths:
+            self.buckets[length] = tuple([check for check in checks if
+                                          not check[1] or check[1] == length])
+
+        # rows of any other length only can be accepted by parsers without
+        # length condition
+        self.default_bucket = tuple([check for check in checks
+                                     if not check[1]])
+
+    # PUBLIC
+    def classify(self, row):
+        """Return first parser class accepting the row, or None if no parser
+        accepts it."""
+
+        bucket = self.buckets.get(len(row), self.default_bucket)
+
+        for parser_class, length, substring, match, custom in bucket:
+
+            # parsers with their own accepts method are checked as usual
+            if custom:
+                if parser_class(row).accepts():
+                    return parser_class
+                continue
+
+            # substring contained condition
+            if substring and substring not in row[0]:
+                continue
+
+            # pattern matching condition
+            if match and not match(row[0]):
+                continue
+
+            return parser_class
+
+        return None
+
+    def classify_checked(self, row):
+        """Same as classify, but return the parser class accepting the row (or
+        None) and the list of parser classes whose accepting conditions were
+        actually checked, in order. Used to profile the classifier."""
+
+        bucket = self.buckets.get(len(row), self.default_bucket)
+
+        checked = []
+        for parser_class, length, substring, match, custom in bucket:
+            checked.append(parser_class)
+
+            if custom:
+                if parser_class(row).accepts():
+                    return parser_class, checked
+                continue
+
+            if substring and substring not in row[0]:
+                continue
+
+            if match and not match(row[0]):
+                continue
+
+            return parser_class, checked
+
+        return None, checked
+
+    # PRIVATE
+    def _compile(self, parser_class):
+        """Return a tuple with the compiled accepting conditions of a parser
+        class: (parser_class, length, substring, match, custom)."""
+
+        # parsers overriding accepts method can't be compiled
+        if self._custom_accepts(parser_class):
+            return (parser_class, None, None, None, True)
+
+        # load conditions of parser in a blank instance
+        parser = parser_class()
+        parser.load_conditions()
+
+        # compile pattern with the same flags used by BaseParser._re_match
+        if parser.row_pattern:
+            match = re.compile(parser.row_pattern, re.U).match
+        else:
+            match = None
+
+        return (parser_class, parser.row_length, parser.row_substring, match,
+                False)
+
+    def _custom_accepts(self, parser_class):
+        """True if parser class overrides BaseParser.accepts method."""
+
+        # parsers module is imported with the layout that uses it
+        from parsers import BaseParser
+
+        return parser_class.accepts.__func__ is not BaseParser.accepts.__func__
@@ -0,0 +1,302 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+
+
+class Dictionary():
+
+    """Resolve names read from a book, with OCR errors and abbreviations, to
+    known entries: (id, name, aliases) tuples.
+
+    Names and aliases are indexed by a key without case, accents, spaces or
+    punctuation, so most spellings are found in the exact index. Keys not
+    found there are searched in a BK-tree of all keys, accepting the closest
+    one within a few edits if there is only one. Every text resolved is kept
+    in a memo, books repeat the same few spellings over and over."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.index = {}
+        self.tree = BKTree()
+        self.memo = {}
+
+        for entry in entries:
+            entry_id, name, aliases = entry
+            for text in [name] + list(aliases):
+                key = normalize_key(text)
+                if key not in self.index:
+                    self.index[key] = (entry_id, name)
+                    self.tree.add(key)
+
+    # PUBLIC
+    def resolve(self, text):
+        """Return (id, name) of the entry text refers to, or None if it
+        doesn't match any entry."""
+
+        try:
+            return self.memo[text]
+        except KeyError:
+            pass
+
+        if len(self.memo) >= MEMO_SIZE:
+            self.memo.clear()
+
+        RV = self.memo[text] = self._resolve(text)
+
+        return RV
+
+    # PRIVATE
+    def _resolve(self, text):
+        key = normalize_key(text)
+        if key in self.index:
+            return self.index[key]
+
+        # very short keys are too close to each other to guess them
+        if len(key) < MIN_FUZZY_LENGTH:
+            return None
+
+        max_distance = 1 if len(key) <= SHORT_KEY_LENGTH else 2
+        matches = self.tree.search(key, max_distance)
+        if not matches:
+            return None
+
+        # the closest entry is taken only if no other entry is as close, keys
+        # as close of the same entry (a name and its alias) agree
+        min_distance = min([distance for distance, match in matches])
+        closest = set([self.index[match] for distance, match in matches
+                       if distance == min_distance])
+        if len(closest) > 1:
+            return None
+
+        return closest.pop()
+
+
+class BKTree():
+
+    """Burkhard-Keller tree of keys, to find the keys within an edit
+    distance of a text without comparing it with all of them."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, key):
+        if self.root is None:
+            self.root = (key, {})
+            return
+
+        node = self.root
+        while True:
+            distance = edit_distance(key, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (key, {})
+                return
+            node = node[1][distance]
+
+    def search(self, key, max_distance):
+        """Return a list of (distance, key) of keys within max_distance."""
+
+        RV = []
+        if self.root is None:
+            return RV
+
+        nodes = [self.root]
+        while nodes:
+            node_key, children = nodes.pop()
+            distance = edit_distance(key, node_key)
+            if distance <= max_distance:
+                RV.append((distance, node_key))
+
+            # only children in this range can be close enough
+            for child_distance, child in children.iteritems():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+
+        return RV
+
+
+# DATA
+# texts resolved kept in the memo of every dictionary
+MEMO_SIZE = 100000
+
+# keys up to this length accept one edit, longer ones two
+SHORT_KEY_LENGTH = 8
+MIN_FUZZY_LENGTH = 4
+
+NOT_KEY_CHARS_RE = re.compile("[^a-z0-9]", re.U)
+
+# country names are taken as printed in the books, with modern and
+# abbreviated spellings as aliases. Ids are never reused or reordered, new
+# countries are added at the end. Id 0 is used for all countries ("Todos")
+COUNTRIES = [
+    (1, u"Afganist\xe1n", []),
+    (2, u"Albania", []),
+    (3, u"Alemania", []),
+    (4, u"Arabia", [u"Arabia Saudita"]),
+    (5, u"Argelia", []),
+    (6, u"Australia", []),
+    (7, u"Austria", []),
+    (8, u"B\xe9lgica", []),
+    (9, u"Birmania", []),
+    (10, u"Bolivia", []),
+    (11, u"Brasil", []),
+    (12, u"Bulgaria", []),
+    (13, u"Canad\xe1", []),
+    (14, u"Ceyl\xe1n", [u"Ceil\xe1n"]),
+    (15, u"Colombia", []),
+    (16, u"Costa Rica", []),
+    (17, u"Cuba", []),
+    (18, u"Checoeslovaquia", [u"Checoslovaquia"]),
+    (19, u"Chile", []),
+    (20, u"China", []),
+    (21, u"Dinamarca", []),
+    (22, u"Ecuador", []),
+    (23, u"Egipto", []),
+    (24, u"El Salvador", [u"Salvador"]),
+    (25, u"Espa\xf1a", []),
+    (26, u"Estados Unidos", [u"Estados Unidos de Am\xe9rica", u"EE UU"]),
+    (27, u"Filipinas", []),
+    (28, u"Finlandia", []),
+    (29, u"Francia", []),
+    (30, u"Grecia", []),
+    (31, u"Guatemala", []),
+    (32, u"Guayana Brit\xe1nica", []),
+    (33, u"Guayana Holandesa", []),
+    (34, u"Hait\xed", []),
+    (35, u"Honduras", []),
+    (36, u"Hungr\xeda", []),
+    (37, u"India", []),
+    (38, u"Indias Orientales Holandesas", [u"Indias orientales holand"]),
+    (39, u"Irak", []),
+    (40, u"Ir\xe1n", [u"Ir\xe1n (Persia)", u"Persia"]),
+    (41, u"Irlanda", []),
+    (42, u"Islandia", []),
+    (43, u"Italia", []),
+    (44, u"Jap\xf3n", []),
+    (45, u"Luxemburgo", []),
+    (46, u"Marruecos", []),
+    (47, u"M\xe9jico", [u"M\xe9xico"]),
+    (48, u"Nicaragua", []),
+    (49, u"Noruega", []),
+    (50, u"Nueva Zelandia", [u"Nueva Zelanda"]),
+    (51, u"Pa\xedses Bajos", [u"Holanda"]),
+    (52, u"Palestina", []),
+    (53, u"Panam\xe1", []),
+    (54, u"Paraguay", []),
+    (55, u"Per\xfa", []),
+    (56, u"Polonia", []),
+    (57, u"Portugal", []),
+    (58, u"Posesiones belgas en \xc1frica", [u"Pos belgas en Africa",
+                                            u"Congo Belga"]),
+    (59, u"Posesiones brit\xe1nicas en Am\xe9rica Central",
+     [u"Pos brit\xe1nicas en Am Central", u"Pos brit\xe1n Am Central"]),
+    (60, u"Posesiones brit\xe1nicas en \xc1frica",
+     [u"Pos brit\xe1nicas en Africa"]),
+    (61, u"Posesiones brit\xe1nicas en Asia", [u"Pos brit\xe1nicas en Asia"]),
+    (62, u"Posesiones brit\xe1nicas en Ocean\xeda",
+     [u"Pos brit\xe1nicas en Ocean\xeda", u"Pos brit\xe1nicas Ocean\xeda"]),
+    (63, u"Posesiones espa\xf1olas en \xc1frica",
+     [u"Pos espa\xf1olas en Africa"]),
+    (64, u"Posesiones francesas en \xc1frica",
+     [u"Pos francesas en Africa"]),
+    (65, u"Posesiones francesas en Asia", [u"Pos francesas en Asia"]),
+    (66, u"Posesiones francesas en Ocean\xeda",
+     [u"Pos francesas en Ocean\xeda", u"Pos francesas Ocean\xeda"]),
+    (67, u"Posesiones portuguesas en \xc1frica",
+     [u"Pos portuguesas en Africa"]),
+    (68, u"Puerto Rico", []),
+    (69, u"Reino Unido", [u"Gran Breta\xf1a"]),
+    (70, u"Libanesa, Rep\xfablica", [u"Rep\xfablica Libanesa",
+                                    u"L\xedbano"]),
+    (71, u"Dominicana, Rep\xfablica", [u"Rep\xfablica Dominicana"]),
+    (72, u"Rumania", []),
+    (73, u"Rusia", [u"URSS", u"Uni\xf3n Sovi\xe9tica"]),
+    (74, u"Siria", []),
+    (75, u"Suecia", []),
+    (76, u"Suiza", []),
+    (77, u"Tailandia", [u"Siam"]),
+    (78, u"Turqu\xeda", []),
+    (79, u"Uni\xf3n Sudafricana", []),
+    (80, u"Uruguay", []),
+    (81, u"Venezuela", []),
+    (82, u"Yugoeslavia", [u"Yugoslavia"]),
+    (83, u"Terranova", []),
+    (84, u"Estonia", []),
+    (85, u"Letonia", []),
+    (86, u"Lituania", []),
+]
+
+# units of products, with their abbreviations
+UNITS = [
+    (1, u"kilogramos", [u"Kg.", u"Kgs.", u"kilos", u"kilogramo"]),
+    (2, u"gramos", [u"grs.", u"gramo"]),
+    (3, u"toneladas", [u"ton.", u"tonelada"]),
+    (4, u"litros", [u"lts.", u"litro"]),
+    (5, u"hectolitros", [u"hl.", u"hectolitro"]),
+    (6, u"metros", [u"mts.", u"metro"]),
+    (7, u"metros cuadrados", [u"m2", u"mts2", u"metro cuadrado"]),
+    (8, u"metros c\xfabicos", [u"m3", u"mts3", u"metro c\xfabico"]),
+    (9, u"docenas", [u"docena", u"doc."]),
+    (10, u"unidades", [u"unidad"]),
+    (11, u"pares", [u"par"]),
+    (12, u"cachos", [u"cacho"]),
+    (13, u"gruesas", [u"gruesa"]),
+    (14, u"cabezas", [u"cabeza"]),
+    (15, u"quilates", [u"quilate"]),
+]
+
+countries = None
+units = None
+
+
+def normalize_key(text):
+    """Return text in lower case, without accents, spaces or punctuation."""
+
+    text = unicodedata.normalize("NFKD", unicode(text)).lower()
+    text = u"".join([char for char in text
+                     if not unicodedata.combining(char)])
+
+    return NOT_KEY_CHARS_RE.sub(u"", text)
+
+
+def edit_distance(text1, text2):
+    """Return Levenshtein distance between two texts."""
+
+    if len(text1) < len(text2):
+        text1, text2 = text2, text1
+
+    previous = range(len(text2) + 1)
+    for i, char1 in enumerate(text1):
+        current = [i + 1]
+        for j, char2 in enumerate(text2):
+            current.append(min(previous[j + 1] + 1, current[j] + 1,
+                               previous[j] + (char1 != char2)))
+        previous = current
+
+    return previous[-1]
+
+
+def get_countries():
+    """Return the dictionary of countries, built the first time it is
+    needed and shared by all parsers of the process."""
+
+    global countries
+
+    if countries is None:
+        countries = Dictionary(COUNTRIES)
+
+    return countries
+
+
+def get_units():
+    """Return the dictionary of product units, built the first time it is
+    needed and shared by all parsers of the process."""
+
+    global units
+
+    if units is None:
+        units = Dictionary(UNITS)
+
+    return units
@@ -0,0 +1,232 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import copy
+import hashlib
+import argparse
+import cPickle as pickle
+from abby_file import AbbyParser
+from checkpoint import replace_file
+from classifier import RowClassifier
+from layouts import get_layout, detect_layout, DETECT_ROWS
+from readers import PeekedReader, get_reader
+from sinks import get_sink
+from result_cache import get_code_version
+
+
+class SectionCache():
+
+    """Keep records of every section of a book between runs, in a sidecar
+    pickle file.
+
+    Entries are keyed by the layout of the book, the hash of the rows of a
+    section and the hash of the context the section starts with, and hold the
+    records built from the section and the context it leaves. Only entries
+    used in the last run are saved, so sections removed from the book don't
+    pile up in the file.
+
+    The file keeps the version of the code that built its records (the
+    fingerprint of the sources used by the results cache), so records are
+    never reused after the parsers change."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.entries = self._load()
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    # PUBLIC
+    def get(self, key):
+        """Return (records, context) of a section, or None if not cached."""
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.used[key] = entry
+
+        # context will be modified by next sections, cached one must not
+        records, context = entry
+        return records, copy.deepcopy(context)
+
+    def put(self, key, records, context):
+        """Add records and context left by a parsed section."""
+        self.used[key] = (records, copy.deepcopy(context))
+
+    def save(self):
+        """Write entries used in this run in the cache file."""
+
+        temp_name = self.file_name + ".tmp"
+        with open(temp_name, "wb") as f:
+            pickle.dump({"version": get_cache_version(),
+                         "entries": self.used}, f, pickle.HIGHEST_PROTOCOL)
+        replace_file(temp_name, self.file_name)
+
+    # PRIVATE
+    def _load(self):
+        """Return entries of cache file, or an empty dict if there is no file
+        or it was written by another version of the code."""
+
+        if not os.path.exists(self.file_name):
+            return {}
+
+        try:
+            with open(self.file_name, "rb") as f:
+                cache = pickle.load(f)
+        except Exception:
+            return {}
+
+        if cache.get("version") != get_cache_version():
+            return {}
+
+        return cache["entries"]
+
+
+# DATA
+# change it whenever the format of the cache file changes, changes of the
+# parsers are found by the fingerprint of their sources
+CACHE_VERSION = 4
+
+CACHE_SUFFIX = ".sections"
+
+
+# INTERNAL FUNCTIONS
+def split_sections(rows, parsers, section_parsers):
+    """Split rows in sections starting at rows of section_parsers (titles,
+    subtitles and "Tarifa" heads of tables in Stats Book 1). Returns a list
+    of lists of rows."""
+
+    classify = RowClassifier(parsers).classify
+    section_parsers = tuple(section_parsers)
+
+    RV = []
+    section = []
+    for row in rows:
+        if section and classify(row) in section_parsers:
+            RV.append(section)
+            section = []
+        section.append(row)
+
+    if section:
+        RV.append(section)
+
+    return RV
+
+
+def get_cache_version():
+    """Return the version of cache files written by this code."""
+    return "%d-%s" % (CACHE_VERSION, get_code_version())
+
+
+def hash_rows(rows):
+    """Return a fingerprint of the values of rows."""
+    return hashlib.sha1(repr(rows)).hexdigest()
+
+
+def hash_context(context):
+    """Return a fingerprint of context variables. Shared hierarchy tuple is
+    left out, it is just a copy of other variables."""
+
+    variables = sorted([(name, value) for name, value in
+                        vars(context).items() if name != "hierarchy"])
+
+    return hashlib.sha1(repr(variables)).hexdigest()
+
+
+# USER FUNCTIONS
+def scrape_abby_file_incremental(wb_abby_name, wb_abby_parsed_name,
+                                 output_format=None, reader=None,
+                                 cache_name=None, layout=None):
+    """Parse an ABBY file reusing records of sections that didn't change since
+    the last run, taken from a sidecar cache (by default next to the input
+    file). A section is parsed again only if its rows or the context it starts
+    with changed. Returns a dict with the number of records written and of
+    sections parsed and reused.
+
+    Book layout is taken by its name, or detected from the first rows of the
+    book like scrape_abby_file does."""
+
+    cache = SectionCache(cache_name or wb_abby_name + CACHE_SUFFIX)
+
+    wb_abby = get_reader(wb_abby_name, reader)
+    if layout:
+        layout = get_layout(layout)
+    else:
+        wb_abby = PeekedReader(wb_abby, DETECT_ROWS)
+        layout = detect_layout(wb_abby.head)
+
+    sections = split_sections(wb_abby.iter_rows(), layout.parsers,
+                              layout.section_parsers)
+
+    sink = get_sink(wb_abby_parsed_name, layout.fields, output_format)
+
+    ap = AbbyParser(layout.parsers, layout.context, layout.records_builder)
+
+    records_count = 0
+    try:
+        for section in sections:
+            key = (layout.name, hash_rows(section), hash_context(ap.context))
+
+            # take records from cache, or parse section and add them to it
+            cached = cache.get(key)
+            if cached:
+                records, ap.context = cached
+            else:
+                records = []
+                for row_records in ap.parse_rows(section):
+                    records.extend(row_records)
+                cache.put(key, records, ap.context)
+
+            for record in records:
+                sink.write(record)
+            records_count += len(records)
+
+    # remove the unfinished output when a section fails, the cache is only
+    # saved after a whole run
+    except BaseException:
+        sink.abort()
+        raise
+
+    sink.close()
+    cache.save()
+
+    return {"records": records_count,
+            "sections": len(sections),
+            "parsed_sections": cache.misses,
+            "cached_sections": cache.hits}
+
+
+def main(args=None):
+    """Command line entry point for incremental parsing of one book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse an ABBY file again, reusing unchanged sections.")
+    arg_parser.add_argument("input_file", help="ABBY file to parse")
+    arg_parser.add_argument("output_file", help="file for parsed records")
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format (default: from extension)")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("-c", "--cache", default=None,
+                            help="sections cache file (default: next to "
+                                 "input file)")
+    arg_parser.add_argument("-l", "--layout", default=None,
+                            help="book layout (default: detected)")
+    args = arg_parser.parse_args(args)
+
+    results = scrape_abby_file_incremental(args.input_file, args.output_file,
+                                           args.format, args.reader,
+                                           args.cache, args.layout)
+
+    print "%d records, %d sections parsed, %d taken from cache" % (
+        results["records"], results["parsed_sections"],
+        results["cached_sections"])
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
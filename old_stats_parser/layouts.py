@@ -0,0 +1,172 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import re
+import warnings
+from collections import OrderedDict
+from itertools import islice
+
+
+class Layout():
+
+    """Declare a layout of stats book: the module holding its parsers list
+    (PARSERS), Context, RecordsBuilder and output FIELDS, and the markers
+    used to recognize its books. The module can also declare the parsers of
+    rows where a book can be split (BOUNDARY_PARSERS) and where its sections
+    start (SECTION_PARSERS, the boundaries by default); without them books
+    are parsed as a whole by the engines that split them.
+
+    The module is given by an import string and is only imported the first
+    time the layout is loaded. Markers are regular expressions searched in
+    the first cell of rows, so a book can be recognized without importing any
+    layout module."""
+
+    def __init__(self, name, module_name, markers=(), description=None):
+        self.name = name
+        self.module_name = module_name
+        self.markers = [re.compile(marker, re.U).search for marker in markers]
+        self.description = description
+        self.module = None
+
+    # PUBLIC
+    def load(self):
+        """Import the module of the layout, if it wasn't imported yet, and
+        take its members. Returns the layout."""
+
+        if self.module is None:
+            module = __import__(self.module_name, globals(), {}, ["PARSERS"])
+            self.parsers = module.PARSERS
+            self.context = module.Context
+            self.records_builder = module.RecordsBuilder
+            self.fields = module.FIELDS
+            self.boundary_parsers = getattr(module, "BOUNDARY_PARSERS", [])
+            self.section_parsers = getattr(module, "SECTION_PARSERS",
+                                           self.boundary_parsers)
+            self.module = module
+
+        return self
+
+    def score(self, rows):
+        """Return how many rows have any marker of the layout."""
+
+        RV = 0
+        for row in rows:
+            if row and isinstance(row[0], basestring):
+                for search in self.markers:
+                    if search(row[0]):
+                        RV += 1
+                        break
+
+        return RV
+
+
+# DATA
+LAYOUTS = OrderedDict()
+
+DEFAULT_LAYOUT = "stats_book_1"
+
+# rows of a book read to detect its layout
+DETECT_ROWS = 200
+
+# setuptools entry points group of layouts declared in other packages, each
+# entry point loads a Layout object (not its module)
+ENTRY_POINTS_GROUP = "old_stats_parser.layouts"
+
+entry_points_registered = False
+
+
+def register_layout(layout):
+    """Add a layout to the registry. Returns the layout."""
+
+    LAYOUTS[layout.name] = layout
+
+    return layout
+
+
+register_layout(Layout(
+    "stats_book_1", "stats_book_1",
+    markers=[u"T\xcdTULO", u"Tarifa", u"Valor total:", u"Sin importaci\xf3n"],
+    description=u"Argentinian imports stats book, years 1945 and 1946"))
+
+
+def get_layouts():
+    """Return all registered layouts, including the ones declared by entry
+    points of installed packages. Layouts are not loaded."""
+
+    global entry_points_registered
+
+    # installed packages are scanned once per process, even if it fails
+    if not entry_points_registered:
+        entry_points_registered = True
+        _register_entry_points()
+
+    return list(LAYOUTS.values())
+
+
+def get_layout(name=None):
+    """Return the loaded layout called name, or the default layout if no
+    name is passed."""
+
+    name = name or DEFAULT_LAYOUT
+
+    # installed packages are only looked up for layouts not registered here
+    if name not in LAYOUTS:
+        get_layouts()
+
+    if name not in LAYOUTS:
+        raise ValueError("Unknown layout: %r. Valid layouts are %s" %
+                         (name, ", ".join(sorted(LAYOUTS))))
+
+    return LAYOUTS[name].load()
+
+
+def detect_layout(rows, detect_rows=DETECT_ROWS):
+    """Return the loaded layout with more markers in the first detect_rows
+    rows, or the default layout if no layout recognizes them.
+
+    Layouts of installed packages are only looked up if no layout registered
+    here recognizes the rows, so books of known layouts are detected without
+    scanning installed packages. Pass a layout by name to prefer one of
+    them."""
+
+    rows = list(islice(rows, detect_rows))
+
+    RV = _best_layout(LAYOUTS.values(), rows)
+    if RV is None and not entry_points_registered:
+        RV = _best_layout(get_layouts(), rows)
+
+    if RV is None:
+        return get_layout()
+
+    return RV.load()
+
+
+def _register_entry_points():
+    """Register layouts declared by entry points of installed packages.
+    pkg_resources is only imported here, building its working set of
+    installed distributions takes longer than parsing a short book."""
+
+    import pkg_resources
+
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINTS_GROUP):
+        if entry_point.name in LAYOUTS:
+            continue
+        try:
+            register_layout(entry_point.load())
+        except Exception as error:
+            warnings.warn("Layout %s could not be loaded: %s" %
+                          (entry_point.name, error))
+
+
+def _best_layout(layouts, rows):
+    """Return the layout with more markers in rows, or None if no layout
+    recognizes them."""
+
+    RV = None
+    best_score = 0
+    for layout in layouts:
+        score = layout.score(rows)
+        if score > best_score:
+            RV = layout
+            best_score = score
+
+    return RV
@@ -0,0 +1,328 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import cPickle as pickle
+from abby_file import AbbyFile
+from layouts import get_layout, detect_layout, DETECT_ROWS
+from readers import PeekedReader, get_reader
+from sinks import get_sink
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class MemoryLimitExceeded(Exception):
+    """Raised when memory of the process would go over the ceiling."""
+    pass
+
+
+class MemoryGuard():
+
+    """Watch resident memory of the process against a ceiling of limit_mb
+    megabytes, keeping its peak.
+
+    Every check measures resident memory and fails fast with
+    MemoryLimitExceeded if, growing as much as it did since the last check,
+    memory would go over the ceiling before the next one. Raises
+    RuntimeError when built if memory can't be measured in this platform, so
+    a ceiling is never silently ignored."""
+
+    def __init__(self, limit_mb):
+        self.limit_kb = int(limit_mb * 1024)
+        self.peak_kb = current_rss_kb()
+        if self.peak_kb is None:
+            raise RuntimeError("Memory of the process can't be measured in "
+                               "this platform, the ceiling can't be kept")
+        self.last_kb = self.peak_kb
+        self.check("at start")
+
+    # PUBLIC
+    def check(self, step=None):
+        """Measure memory, raising MemoryLimitExceeded if it would go over
+        the ceiling. Step describes the work done, for the error message."""
+
+        rss_kb = current_rss_kb()
+        self.peak_kb = max(self.peak_kb, rss_kb)
+        growth_kb = max(rss_kb - self.last_kb, 0)
+        self.last_kb = rss_kb
+
+        if rss_kb + growth_kb > self.limit_kb:
+            raise MemoryLimitExceeded(
+                "Memory would exceed the ceiling of %.1f MB %s: %.1f MB in "
+                "use, growing %.1f MB since last check" %
+                (self.limit_kb / 1024.0, step or "", rss_kb / 1024.0,
+                 growth_kb / 1024.0))
+
+
+class PartsSink():
+
+    """Write column blocks of records to temporary part files, each one
+    closed (and flushed to disk) after part_records records, and merge them
+    in the output sink at the end.
+
+    Parts are streams of pickled blocks, so values keep their types and
+    merging reads them back one block at a time. Columnar output sinks hold
+    no more than a part before writing a batch. What the output writer
+    itself keeps is not bounded by parts: openpyxl keeps the table of
+    distinct strings of the workbook until it is saved."""
+
+    def __init__(self, file_name, fields, output_format=None,
+                 part_records=100000, guard=None):
+        self.file_name = file_name
+        self.fields = fields
+        self.output_format = output_format
+        self.part_records = part_records
+        self.guard = guard
+        self.temp_dir = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(file_name)))
+        self.parts = []
+        self.part = None
+        self.part_size = 0
+
+    # PUBLIC
+    def write_batch(self, columns):
+        if self.part is None or self.part_size >= self.part_records:
+            self._new_part()
+
+        pickle.dump(columns, self.part, pickle.HIGHEST_PROTOCOL)
+        self.part_size += len(columns[self.fields[0]])
+
+    def close(self):
+        """Merge all parts in the output file, removing them."""
+
+        try:
+            if self.part:
+                self.part.close()
+
+            sink = get_sink(self.file_name, self.fields, self.output_format)
+
+            # columnar sinks collect blocks in batches (row groups) before
+            # writing them, never hold more records than a part
+            if hasattr(sink, "batch_size"):
+                sink.batch_size = min(sink.batch_size, self.part_records)
+
+            for i, part_name in enumerate(self.parts):
+                for columns in self._iter_part(part_name):
+                    sink.write_batch(columns)
+                if self.guard:
+                    self.guard.check("merging part %d" % (i + 1))
+            sink.close()
+
+        finally:
+            shutil.rmtree(self.temp_dir)
+
+    def abort(self):
+        """Remove all parts without writing the output file."""
+
+        if self.part:
+            self.part.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    # PRIVATE
+    def _new_part(self):
+        if self.part:
+            self.part.close()
+
+        part_name = os.path.join(self.temp_dir,
+                                 "part_%05d.pickle" % len(self.parts))
+        self.parts.append(part_name)
+        self.part = open(part_name, "wb")
+        self.part_size = 0
+
+    def _iter_part(self, part_name):
+        with open(part_name, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+
+# DATA
+# sinks writing straight to disk, that don't need temporary parts
+STREAMING_FORMATS = ["csv", "tsv", "sqlite", "db"]
+
+BATCH_SIZE = 2000
+PART_RECORDS = 100000
+
+# function giving memory counters of the process in windows
+windows_memory_info = None
+
+
+def get_windows_memory_info():
+    """Return a function giving PROCESS_MEMORY_COUNTERS of this process in
+    windows, built the first time it is needed."""
+
+    global windows_memory_info
+
+    if windows_memory_info is None:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        get_current_process = ctypes.WinDLL("kernel32").GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        get_process_memory_info = ctypes.WinDLL("psapi").GetProcessMemoryInfo
+        get_process_memory_info.argtypes = [
+            wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+            wintypes.DWORD]
+        get_process_memory_info.restype = wintypes.BOOL
+
+        def memory_info():
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            if not get_process_memory_info(get_current_process(),
+                                           ctypes.byref(counters),
+                                           counters.cb):
+                return None
+            return counters
+
+        windows_memory_info = memory_info
+
+    return windows_memory_info()
+
+
+def current_rss_kb():
+    """Return resident memory of the process in kilobytes, or the peak if
+    only that can be measured, or None if it can't be measured at all."""
+
+    if sys.platform == "win32":
+        counters = get_windows_memory_info()
+        return counters and counters.WorkingSetSize // 1024
+
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_kb()
+
+
+def peak_rss_kb():
+    """Return peak resident memory of the process in kilobytes, or None if
+    it can't be measured in this platform."""
+
+    if sys.platform == "win32":
+        counters = get_windows_memory_info()
+        return counters and counters.PeakWorkingSetSize // 1024
+
+    if resource is None:
+        return None
+
+    RV = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # mac os reports bytes instead of kilobytes
+    if sys.platform == "darwin":
+        RV = RV // 1024
+
+    return RV
+
+
+def scrape_abby_file_low_memory(wb_abby_name, wb_abby_parsed_name,
+                                memory_limit, output_format=None,
+                                reader="xml", layout=None, batch_size=None,
+                                part_records=None):
+    """Parse an ABBY file keeping memory of the process under memory_limit
+    megabytes, or failing fast with MemoryLimitExceeded.
+
+    Rows are streamed with the xml reader, records are built in small column
+    blocks (no record objects are kept) and, unless the output format is
+    written straight to disk, blocks go to temporary parts merged in the
+    output at the end. The ceiling covers parsing and merging, but memory
+    kept by the output writer while merging (the strings table of an xlsx
+    file) grows with the distinct values of the book. Returns a dict with the
+    number of records written and the peak resident memory of the process in
+    kilobytes. Raises RuntimeError if memory can't be measured in this
+    platform."""
+
+    guard = MemoryGuard(memory_limit)
+
+    wb_abby = get_reader(wb_abby_name, reader)
+    if layout:
+        layout = get_layout(layout)
+    else:
+        wb_abby = PeekedReader(wb_abby, DETECT_ROWS)
+        layout = detect_layout(wb_abby.head)
+
+    abby_file = AbbyFile(wb_abby, layout.parsers, layout.context,
+                         layout.records_builder, layout.fields)
+
+    output_format = output_format or \
+        os.path.splitext(wb_abby_parsed_name)[1].lstrip(".").lower()
+    if output_format in STREAMING_FORMATS:
+        sink = get_sink(wb_abby_parsed_name, layout.fields, output_format)
+    else:
+        sink = PartsSink(wb_abby_parsed_name, layout.fields, output_format,
+                         part_records or PART_RECORDS, guard)
+
+    records_count = 0
+    try:
+        for columns in abby_file.iter_batches(batch_size or BATCH_SIZE):
+            sink.write_batch(columns)
+            records_count += len(columns[layout.fields[0]])
+            guard.check("after %d records" % records_count)
+
+    # don't leave parts or unfinished outputs of a failed run
+    except BaseException:
+        sink.abort()
+        raise
+
+    sink.close()
+    guard.check("finishing output")
+
+    return {"records": records_count,
+            "peak_rss_kb": max(guard.peak_kb, peak_rss_kb() or 0),
+            "limit_kb": guard.limit_kb}
+
+
+def main(args=None):
+    """Command line entry point for low memory parsing of one book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse an ABBY file under a memory ceiling.")
+    arg_parser.add_argument("input_file", help="ABBY file to parse")
+    arg_parser.add_argument("output_file", help="file for parsed records")
+    arg_parser.add_argument("-m", "--memory-limit", type=float, required=True,
+                            help="memory ceiling in megabytes")
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format (default: from extension)")
+    arg_parser.add_argument("-r", "--reader", default="xml",
+                            help="rows reader: xml (default) or openpyxl")
+    args = arg_parser.parse_args(args)
+
+    try:
+        results = scrape_abby_file_low_memory(args.input_file,
+                                              args.output_file,
+                                              args.memory_limit, args.format,
+                                              args.reader)
+    except (MemoryLimitExceeded, RuntimeError) as error:
+        print "Error: %s" % error
+        return 1
+
+    print "%d records written, peak memory %.1f MB (ceiling %.1f MB)" % (
+        results["records"], results["peak_rss_kb"] / 1024.0,
+        results["limit_kb"] / 1024.0)
+
+    return 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
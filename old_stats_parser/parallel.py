@@ -0,0 +1,164 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import sys
+import copy
+import argparse
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from abby_file import AbbyParser
+from classifier import RowClassifier
+from layouts import get_layout, detect_layout
+from readers import get_reader
+from sinks import get_sink
+
+
+class ChunkScanner():
+
+    """Split the rows of a book in chunks that can be parsed independently.
+
+    A cheap pre-scan follows the context through all rows using scan() method
+    of parsers, which skips parsing of table values. Chunks only start at
+    rows of boundary parsers (titles and subtitles in Stats Book 1, a book
+    without boundaries is a single chunk) and each chunk carries a snapshot of
+    the context just before its first row, so parsing a chunk from its
+    snapshot gives the same records than the sequential run."""
+
+    def __init__(self, parsers, context, boundaries=(), chunk_rows=2000):
+        self.parsers = parsers
+        self.context = context
+        self.classifier = RowClassifier(parsers)
+        self.boundaries = tuple(boundaries)
+        self.chunk_rows = chunk_rows
+
+    # PUBLIC
+    def get_chunks(self, rows):
+        """Return a list of (context snapshot, rows) chunks, in order. First
+        chunk has no snapshot, it starts with a new context."""
+
+        RV = []
+        context = self.context()
+        chunk_context = None
+        chunk = []
+
+        for row in rows:
+            parser_class = self.classifier.classify(row)
+
+            # start a new chunk at a boundary, if current one is big enough
+            if (parser_class in self.boundaries and
+                    len(chunk) >= self.chunk_rows):
+                RV.append((chunk_context, chunk))
+                chunk_context = copy.deepcopy(context)
+                chunk = []
+
+            chunk.append(row)
+
+            if parser_class:
+                parser_class(row, context).scan()
+
+        if chunk:
+            RV.append((chunk_context, chunk))
+
+        return RV
+
+
+# DATA
+CHUNK_ROWS = 2000
+
+
+# INTERNAL FUNCTIONS
+def parse_chunk(chunk, layout_name):
+    """Parse rows of a chunk starting from its context snapshot, with the
+    layout called layout_name. Runs inside a worker process and returns the
+    list of records built."""
+
+    context, rows = chunk
+
+    layout = get_layout(layout_name)
+    ap = AbbyParser(layout.parsers, layout.context, layout.records_builder)
+    if context is not None:
+        ap.context = context
+
+    RV = []
+    for records in ap.parse_rows(rows):
+        RV.extend(records)
+
+    return RV
+
+
+# USER FUNCTIONS
+def scrape_abby_file_parallel(wb_abby_name, wb_abby_parsed_name,
+                              output_format=None, reader=None,
+                              max_workers=None, chunk_rows=None,
+                              layout=None):
+    """Parse one ABBY file using a pool of processes. Rows are read and split
+    in chunks of about chunk_rows rows at boundaries of its layout, each
+    chunk is parsed by a worker and records are written in the original
+    order, so output is the same of scrape_abby_file. Returns the number of
+    records written.
+
+    Book layout is taken by its name, or detected from the first rows of the
+    book like scrape_abby_file does. Workers get the layout by its name."""
+
+    rows = list(get_reader(wb_abby_name, reader).iter_rows())
+
+    if layout:
+        layout = get_layout(layout)
+    else:
+        layout = detect_layout(rows)
+
+    scanner = ChunkScanner(layout.parsers, layout.context,
+                           layout.boundary_parsers, chunk_rows or CHUNK_ROWS)
+    chunks = scanner.get_chunks(rows)
+    del rows
+
+    sink = get_sink(wb_abby_parsed_name, layout.fields, output_format)
+
+    # map keeps the order of chunks, whatever order workers finish in
+    records_count = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for records in executor.map(parse_chunk, chunks,
+                                        repeat(layout.name, len(chunks))):
+                for record in records:
+                    sink.write(record)
+                records_count += len(records)
+
+    # remove the unfinished output when a chunk fails
+    except BaseException:
+        sink.abort()
+        raise
+
+    sink.close()
+
+    return records_count
+
+
+def main(args=None):
+    """Command line entry point for parallel parsing of one book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse one ABBY file splitting it among processes.")
+    arg_parser.add_argument("input_file", help="ABBY file to parse")
+    arg_parser.add_argument("output_file", help="file for parsed records")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="number of worker processes (default: cpus)")
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format (default: from extension)")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                            help="minimum rows of each chunk")
+    arg_parser.add_argument("-l", "--layout", default=None,
+                            help="book layout (default: detected)")
+    args = arg_parser.parse_args(args)
+
+    records = scrape_abby_file_parallel(args.input_file, args.output_file,
+                                        args.format, args.reader, args.jobs,
+                                        args.chunk_rows, args.layout)
+
+    print "%d records written to %s" % (records, args.output_file)
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
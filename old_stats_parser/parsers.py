@@ -1,6 +1,7 @@
 #!C:\Python27
 # -*- coding: utf-8 -*-
 from utils import get_unicode, find_nth, convert_to_float
+from dictionaries import get_countries, get_units
 import re
 
 
@@ -9,11 +10,19 @@ class BaseParser():
     method accepts to check if a row can be parsed for a specific derived
     parser.
 
-    Derived parsers will parse row and modify context with the results."""
+    Derived parsers will parse row and modify context with the results.
 
-    def __init__(self, row=None, context=None):
+    Parsers declaring numeric_cells (a slice of the row) can get the numbers
+    of those cells already converted in a batch with other rows, in numbers
+    member, instead of converting them one by one."""
+
+    # cells of row holding numbers, that can be converted in batches
+    numeric_cells = None
+
+    def __init__(self, row=None, context=None, numbers=None):
         self.row = row
         self.context = context
+        self.numbers = numbers
 
     def accepts(self):
         """Check if a row can be parsed by the derived parser.
@@ -48,11 +57,17 @@ class BaseParser():
 
         return substring_cond and len_cond and pattern_cond
 
+    def scan(self):
+        """Modify context like parse() does, for pre-scans that only need to
+        follow context through rows without building records. Derived parsers
+        can override it to skip parsing values that no other row depends on."""
+        self.parse()
+
     def _re_match(self, pattern, string):
         """Checks if string matches pattern."""
         RV = False
 
-        match_obj = re.match(pattern, string, re.U)
+        match_obj = compile_pattern(pattern).match(string)
 
         if match_obj:
             RV = True
@@ -63,6 +78,8 @@ class BaseParser():
 class TitleParser(BaseParser):
     """Parse title rows getting id_title and desc_title."""
 
+    desc_title_re = re.compile("[A-Z][A-Z\s]{1,}", re.U)
+
     def load_conditions(self):
         """Load accepting conditions for BaseParser.accepts() method."""
         self.row_substring = u"T\xcdTULO"
@@ -96,12 +113,8 @@ class TitleParser(BaseParser):
         # find first dot
         i_dot = self.row[0].find(".")
 
-        # keeps substring from first dot to end
-        substring = self.row[0][i_dot + 1:]
-
-        # extract substring that matches pattern
-        pattern = "[A-Z][A-Z\s]{1,}"
-        RV = re.search(pattern, substring, re.U).group().strip()
+        # extract substring from first dot to end that matches pattern
+        RV = self.desc_title_re.search(self.row[0], i_dot + 1).group().strip()
 
         return RV
 
@@ -109,6 +122,8 @@ class TitleParser(BaseParser):
 class Subt1Parser(BaseParser):
     """Parse first level of subtitle rows getting id_subt1 and desc_subt1."""
 
+    desc_subt1_re = re.compile("[A-Z][A-Z\s]{1,}", re.U)
+
     def load_conditions(self):
         """Load accepting conditions for BaseParser.accepts() method."""
         self.row_substring = None
@@ -142,12 +157,9 @@ class Subt1Parser(BaseParser):
         # find first parenthesis
         i_parenthesis = self.row[0].find(")")
 
-        # keeps substring from first parenthesis to end
-        substring = self.row[0][i_parenthesis + 1:]
-
-        # extract substring that matches pattern
-        pattern = "[A-Z][A-Z\s]{1,}"
-        RV = re.search(pattern, substring, re.U).group().strip()
+        # extract substring from first parenthesis to end that matches pattern
+        RV = self.desc_subt1_re.search(self.row[0],
+                                       i_parenthesis + 1).group().strip()
 
         return RV
 
@@ -155,6 +167,8 @@ class Subt1Parser(BaseParser):
 class Subt2Parser(BaseParser):
     """Parse 2nd level of subtitle rows getting id_subt2 and desc_subt2."""
 
+    desc_subt2_re = re.compile("[A-Z].{1,}", re.U)
+
     def load_conditions(self):
         """Load accepting conditions for BaseParser.accepts() method."""
         self.row_substring = None
@@ -175,10 +189,11 @@ class Subt2Parser(BaseParser):
         """Parse id_subt2 from first substring before first dot position."""
 
         # find first dot
-        i_dot = self.row[0].strip().find(".")
+        stripped = self.row[0].strip()
+        i_dot = stripped.find(".")
 
         # take stripped substring up to first dot
-        RV = self.row[0].strip()[:i_dot]
+        RV = stripped[:i_dot]
 
         return RV
 
@@ -188,12 +203,8 @@ class Subt2Parser(BaseParser):
         # find first dot
         i_dot = self.row[0].find(".")
 
-        # keeps substring from first dot to end
-        substring = self.row[0][i_dot + 1:]
-
-        # extract substring that matches pattern
-        pattern = "[A-Z].{1,}"
-        RV = re.search(pattern, substring, re.U).group().strip()
+        # extract substring from first dot to end that matches pattern
+        RV = self.desc_subt2_re.search(self.row[0], i_dot + 1).group().strip()
 
         return RV
 
@@ -301,6 +312,8 @@ class Head1Parser(BaseParser):
     """Parse head of table with tariff number row getting id_product,
     tariff_number, desc_product and product_units."""
 
+    desc_product_re = re.compile("[A-Z].{1,}", re.U)
+
     def load_conditions(self):
         """Load accepting conditions for BaseParser.accepts() method."""
         self.row_substring = "Tarifa"
@@ -323,9 +336,10 @@ class Head1Parser(BaseParser):
         """Parse id_product from substring using min index of several possible
         delimiters."""
 
-        index_list = [self.row[0].strip().find("."),
-                      self.row[0].strip().find("-"),
-                      self.row[0].strip().find("(")]
+        stripped = self.row[0].strip()
+        index_list = [stripped.find("."),
+                      stripped.find("-"),
+                      stripped.find("(")]
 
         # remove -1, as could lead to error finding the minimum index
         try:
@@ -343,7 +357,7 @@ class Head1Parser(BaseParser):
         else:
             index = 1
 
-        return self.row[0].strip()[:index]
+        return stripped[:index]
 
     def _get_tariff_number(self):
         """Parse tariff_number from substring between "Tarifa" and ")"."""
@@ -396,12 +410,9 @@ class Head1Parser(BaseParser):
         ### take substring with indexes found before
         substring = self.row[0][i_start:i_end]
 
-        # regex pattern
-        pattern = "[A-Z].{1,}"
-
         # try match the pattern
         try:
-            RV = re.search(pattern, substring, re.U).group().strip()
+            RV = self.desc_product_re.search(substring).group().strip()
         # if not possible, returns parsing error
         except:
             RV = "Parsing error"
@@ -427,13 +438,15 @@ class Head1Parser(BaseParser):
         return RV
 
     def _normalize_product_units(self, product_units):
-        """Normalize string for "kilogramos" unit, if that is the product_unit
-        passed."""
+        """Normalize product_units to the long form of the unit, resolving it
+        with the dictionary of known units. Units not resolved are kept as
+        they were passed."""
         RV = product_units
 
         # uses the long form of the unit
-        if get_unicode(product_units.strip()) == u"Kg.":
-            RV = u"kilogramos"
+        unit = get_units().resolve(get_unicode(product_units.strip()))
+        if unit:
+            RV = unit[1]
 
         return RV
 
@@ -460,6 +473,8 @@ class TblRowParser(BaseParser):
         4. 1945 value
         5. 1946 value"""
 
+    numeric_cells = slice(1, 5)
+
     def load_conditions(self):
         """Load accepting conditions for BaseParser.accepts() method."""
         self.row_substring = None
@@ -470,8 +485,8 @@ class TblRowParser(BaseParser):
         """Parse data from row."""
 
         # modify context with parsing results
-        self.context.id_country = None  # TODO: there will be ids for countries
-        self.context.desc_country = self._get_desc_country()
+        self.context.id_country, self.context.desc_country = \
+            self._get_country()
         self.context.year = self._get_year()
         self.context.quantity = self._get_quantity()
         self.context.value = self._get_value()
@@ -479,6 +494,29 @@ class TblRowParser(BaseParser):
         # modify context with type of row parsed
         self.context.row_type = "tbl_row"
 
+    def scan(self):
+        """Values of a table row are only used by records built from it, just
+        declare the type of row."""
+
+        self.context.row_type = "tbl_row"
+
+    def _get_country(self):
+        """Parse id_country and desc_country, resolving the name of the
+        country with the dictionary of known countries. Names not resolved
+        are kept as they were parsed, with no id."""
+
+        desc_country = self._get_desc_country()
+
+        # all countries have a fixed id, like in aggregated values rows
+        if desc_country == u"Todos":
+            return 0, desc_country
+
+        RV = get_countries().resolve(desc_country)
+        if RV is None:
+            RV = (None, desc_country)
+
+        return RV
+
     def _get_desc_country(self):
         """Parse desc_country from first cell of row"""
 
@@ -506,6 +544,11 @@ class TblRowParser(BaseParser):
 
     def _get_quantity(self):
         """Parse quantities from tbl_row, first two cells after country name."""
+
+        # numbers converted in a batch with other rows
+        if self.numbers is not None:
+            return list(self.numbers[0:2])
+
         quantity_1945 = None
         quantity_1946 = None
 
@@ -525,6 +568,11 @@ class TblRowParser(BaseParser):
 
     def _get_value(self):
         """Parse values from tbl_row, last two cells in row."""
+
+        # numbers converted in a batch with other rows
+        if self.numbers is not None:
+            return list(self.numbers[2:4])
+
         value_1945 = None
         value_1946 = None
 
@@ -640,3 +688,17 @@ class Head1FinalPart(BaseParser):
         # declara cual fue el ultimo row type procesado
         self.context.row_type = "tbl_head1_final_part"
 
+
+# DATA
+COMPILED_PATTERNS = {}
+
+
+def compile_pattern(pattern):
+    """Return pattern compiled with unicode flag, compiling it only the first
+    time it is used."""
+
+    try:
+        return COMPILED_PATTERNS[pattern]
+    except KeyError:
+        RV = COMPILED_PATTERNS[pattern] = re.compile(pattern, re.U)
+        return RV
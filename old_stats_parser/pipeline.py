@@ -0,0 +1,216 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import sys
+import argparse
+import threading
+from Queue import Queue, Empty, Full
+from abby_file import AbbyParser
+from layouts import get_layout, detect_layout, DETECT_ROWS
+from readers import PeekedReader, get_reader
+from sinks import get_sink
+
+
+class Pipeline():
+
+    """Read, parse and write a book in three stages running at the same time.
+
+    Reader and parser stages run in their own threads, sink writes in the
+    calling thread. Stages hand batches of rows and records to each other
+    through bounded queues: when a stage falls behind, the previous one waits
+    for room in the queue, so no more than queue_size batches are held
+    between two stages whatever the size of the book.
+
+    An error in any stage stops the others, aborts the sink and is raised
+    again by run()."""
+
+    def __init__(self, reader, abby_parser, sink, batch_size=500,
+                 queue_size=8):
+        self.reader = reader
+        self.abby_parser = abby_parser
+        self.sink = sink
+        self.batch_size = batch_size
+        self.rows_queue = Queue(queue_size)
+        self.records_queue = Queue(queue_size)
+        self.stop = threading.Event()
+        self.error = None
+
+    # PUBLIC
+    def run(self):
+        """Run all stages until the book is written. Returns the number of
+        records written."""
+
+        threads = [threading.Thread(target=self._run_stage, args=(stage,))
+                   for stage in [self._read, self._parse]]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        RV = 0
+        try:
+            while True:
+                records = self._get(self.records_queue)
+                if records is END:
+                    break
+                for record in records:
+                    self.sink.write(record)
+                RV += len(records)
+
+        # remove the unfinished output when any stage fails
+        except BaseException:
+            self.sink.abort()
+            raise
+
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.sink.close()
+
+        return RV
+
+    # PRIVATE
+    def _read(self):
+        """Reader stage, put batches of rows in rows queue."""
+
+        batch = []
+        for row in self.reader.iter_rows():
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                self._put(self.rows_queue, batch)
+                batch = []
+
+        if batch:
+            self._put(self.rows_queue, batch)
+        self._put(self.rows_queue, END)
+
+    def _parse(self):
+        """Parser stage, put batches of records built from each batch of rows
+        in records queue."""
+
+        while True:
+            rows = self._get(self.rows_queue)
+            if rows is END:
+                break
+
+            records = []
+            for row_records in self.abby_parser.parse_rows(rows):
+                records.extend(row_records)
+            self._put(self.records_queue, records)
+
+        self._put(self.records_queue, END)
+
+    def _run_stage(self, stage):
+        """Run a stage in a thread, keeping any error to raise it in run()."""
+
+        try:
+            stage()
+        except StopPipeline:
+            pass
+        except Exception:
+            self.error = sys.exc_info()
+            self.stop.set()
+
+    def _put(self, queue, item):
+        """Put item in queue, waiting for room while pipeline runs."""
+
+        while True:
+            self._check()
+            try:
+                queue.put(item, timeout=WAIT_SECONDS)
+                return
+            except Full:
+                pass
+
+    def _get(self, queue):
+        """Get next item of queue, waiting for it while pipeline runs."""
+
+        while True:
+            self._check()
+            try:
+                return queue.get(timeout=WAIT_SECONDS)
+            except Empty:
+                pass
+
+    def _check(self):
+        """Raise the error of a failed stage, or stop if pipeline stopped."""
+
+        if self.error:
+            error_type, error, tb = self.error
+            raise error_type, error, tb
+
+        if self.stop.is_set():
+            raise StopPipeline()
+
+
+class StopPipeline(Exception):
+    """Raised inside stages when pipeline stops before they finish."""
+    pass
+
+
+# DATA
+END = object()
+WAIT_SECONDS = 0.1
+BATCH_SIZE = 500
+QUEUE_SIZE = 8
+
+
+# USER FUNCTIONS
+def scrape_abby_file_pipelined(wb_abby_name, wb_abby_parsed_name,
+                               output_format=None, reader=None,
+                               batch_size=None, queue_size=None,
+                               layout=None):
+    """Parse an ABBY file reading, parsing and writing at the same time in a
+    pipeline of stages. Output is the same of scrape_abby_file. Returns the
+    number of records written.
+
+    Book layout is taken by its name, or detected from the first rows of the
+    book like scrape_abby_file does."""
+
+    wb_abby = get_reader(wb_abby_name, reader)
+    if layout:
+        layout = get_layout(layout)
+    else:
+        wb_abby = PeekedReader(wb_abby, DETECT_ROWS)
+        layout = detect_layout(wb_abby.head)
+
+    abby_parser = AbbyParser(layout.parsers, layout.context,
+                             layout.records_builder)
+    sink = get_sink(wb_abby_parsed_name, layout.fields, output_format)
+
+    pipeline = Pipeline(wb_abby, abby_parser, sink, batch_size or BATCH_SIZE,
+                        queue_size or QUEUE_SIZE)
+
+    return pipeline.run()
+
+
+def main(args=None):
+    """Command line entry point for pipelined parsing of one book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse an ABBY file in a pipeline of stages.")
+    arg_parser.add_argument("input_file", help="ABBY file to parse")
+    arg_parser.add_argument("output_file", help="file for parsed records")
+    arg_parser.add_argument("-f", "--format", default=None,
+                            help="output format (default: from extension)")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE,
+                            help="rows of each batch")
+    arg_parser.add_argument("-q", "--queue-size", type=int, default=QUEUE_SIZE,
+                            help="batches held between two stages")
+    arg_parser.add_argument("-l", "--layout", default=None,
+                            help="book layout (default: detected)")
+    args = arg_parser.parse_args(args)
+
+    records = scrape_abby_file_pipelined(args.input_file, args.output_file,
+                                         args.format, args.reader,
+                                         args.batch_size, args.queue_size,
+                                         args.layout)
+
+    print "%d records written to %s" % (records, args.output_file)
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
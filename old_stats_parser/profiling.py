@@ -0,0 +1,137 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import json
+from collections import OrderedDict
+from timeit import default_timer
+
+
+class Profiler():
+
+    """Collect timings of the stages of a run (read, decode, classify, parse,
+    build and write) and statistics of every parser: how many times its
+    accepting conditions were checked, how many rows it matched and the time
+    spent in its parse() method. Rows that no parser accepts are counted, and
+    the first ones are kept as samples.
+
+    Instrumented code asks the profiler for timed versions of functions and
+    iterators, so nothing is measured when no profiler is passed."""
+
+    def __init__(self, parsers=(), unmatched_samples=20):
+        self.stages = OrderedDict([(stage, 0.0) for stage in STAGES])
+        self.parsers = OrderedDict()
+        for parser_class in parsers:
+            self._parser_stats(parser_class)
+        self.rows = 0
+        self.records = 0
+        self.unmatched_rows = 0
+        self.unmatched_samples = []
+        self.max_unmatched_samples = unmatched_samples
+        self.decoder = None
+        self.start = default_timer()
+        self.total = None
+
+    # PUBLIC
+    def add_time(self, stage, seconds):
+        """Add seconds to the time of a stage."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def timer(self, stage, function):
+        """Return function wrapped to add its running time to a stage."""
+
+        def timed_function(*args, **kwargs):
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add_time(stage, default_timer() - start)
+
+        return timed_function
+
+    def timed_iter(self, stage, iterator):
+        """Yield items of iterator adding the time to get them to a stage."""
+
+        iterator = iter(iterator)
+        while True:
+            start = default_timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, default_timer() - start)
+                return
+            self.add_time(stage, default_timer() - start)
+            self.rows += 1
+            yield item
+
+    def add_checks(self, checked, parser_class):
+        """Count accepting checks made by a classifier on the parser classes
+        checked to find parser_class (or None), and the parser match."""
+
+        for candidate in checked:
+            self._parser_stats(candidate)["accept_checks"] += 1
+
+        if parser_class:
+            self._parser_stats(parser_class)["matches"] += 1
+
+    def add_parse(self, parser_class, seconds):
+        """Add seconds spent by a parser in its parse() method."""
+        self._parser_stats(parser_class)["parse_seconds"] += seconds
+        self.add_time("parse", seconds)
+
+    def add_unmatched(self, row):
+        """Count a row that no parser accepts, keeping the first ones."""
+
+        self.unmatched_rows += 1
+        if len(self.unmatched_samples) < self.max_unmatched_samples:
+            self.unmatched_samples.append(repr(row)[:200])
+
+    def stop(self):
+        """Stop the clock of the whole run."""
+        self.total = default_timer() - self.start
+
+    def report(self):
+        """Return a dict with all collected statistics."""
+
+        stages = OrderedDict()
+        for stage, seconds in self.stages.items():
+            stages[stage] = round(seconds, 6)
+
+        # reading time includes decoding of values, keep them apart
+        stages["read"] = round(max(self.stages["read"] -
+                                   self.stages["decode"], 0.0), 6)
+
+        if self.total is not None:
+            stages["total"] = round(self.total, 6)
+
+        parsers = OrderedDict()
+        for name, stats in self.parsers.items():
+            parsers[name] = {"accept_checks": stats["accept_checks"],
+                             "matches": stats["matches"],
+                             "parse_seconds": round(stats["parse_seconds"], 6)}
+
+        return OrderedDict([
+            ("rows", self.rows),
+            ("records", self.records),
+            ("unmatched_rows", self.unmatched_rows),
+            ("unmatched_samples", self.unmatched_samples),
+            ("stages", stages),
+            ("parsers", parsers),
+            ("decoder", self.decoder.stats() if self.decoder else None)])
+
+    def save(self, file_name):
+        """Write report as json."""
+
+        with open(file_name, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    # PRIVATE
+    def _parser_stats(self, parser_class):
+        name = parser_class.__name__
+        if name not in self.parsers:
+            self.parsers[name] = {"accept_checks": 0,
+                                  "matches": 0,
+                                  "parse_seconds": 0.0}
+        return self.parsers[name]
+
+
+# DATA
+STAGES = ["read", "decode", "classify", "parse", "build", "write"]
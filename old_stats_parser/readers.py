@@ -0,0 +1,445 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import re
+import zipfile
+import datetime
+import posixpath
+from math import floor
+from itertools import chain, islice
+from xml.etree.cElementTree import iterparse
+from utils import TextDecoder
+
+
+class BaseReader():
+
+    """Read rows of the active sheet of an ABBY file as lists of cell values.
+
+    Rows are yielded ready to be parsed: values are converted to unicode (like
+    get_unicode does) by a TextDecoder of the workbook, empty rows are skipped
+    and empty cells at the end of rows are removed. Derived readers implement
+    _iter_values() yielding every row of the sheet as a list of values."""
+
+    def __init__(self):
+        self.decoder = TextDecoder()
+
+    def iter_rows(self):
+        """Yield every not empty row of the sheet as a list of cell values."""
+
+        for cells_values in self._iter_values():
+
+            # checks if list of cell values not empty
+            if not self._empty(cells_values):
+
+                # remove any empty cell that might be at the end of row
+                yield self._remove_lasts_none(cells_values)
+
+    # PRIVATE
+    def _iter_values(self):
+        raise NotImplementedError
+
+    def _empty(self, values_list):
+        """True if values_list is empty."""
+        RV = True
+
+        for value in values_list:
+            if value is not None:
+                RV = False
+
+        return RV
+
+    def _remove_lasts_none(self, values_list):
+        """Delete None values at the end of a list."""
+        RV = values_list
+
+        while RV[-1] is None:
+            del RV[-1]
+
+        return RV
+
+
+class OpenpyxlReader(BaseReader):
+    """Read rows from a workbook loaded by openpyxl with use_iterators=True."""
+
+    def __init__(self, wb):
+        BaseReader.__init__(self)
+        self.wb = wb
+
+    def _iter_values(self):
+
+        # load active sheet of wb
+        ws = self.wb.get_active_sheet()
+
+        # iterate through all cells in every row adding cell values
+        decode = self.decoder.decode
+        for row in ws.iter_rows():
+            yield [decode(cell.internal_value) for cell in row]
+
+
+class XmlReader(BaseReader):
+    """Read rows streaming the sheet xml straight out of the xlsx zip file,
+    without building openpyxl workbook or cell objects.
+
+    Values are the same openpyxl gives for cells: shared strings, floats for
+    numbers (or dates, for cells with a date number format), booleans and
+    formulas as "=formula" strings. Cells are only built up to the last not
+    empty cell of each row, so rows come out with trailing empty cells
+    already removed."""
+
+    def __init__(self, file_name):
+        BaseReader.__init__(self)
+        self.file_name = file_name
+
+    def iter_rows(self):
+        """Yield every not empty row of the sheet as a list of cell values."""
+
+        archive = zipfile.ZipFile(self.file_name)
+        try:
+            sheet_path = self._get_sheet_path(archive)
+            strings = self._read_strings(archive)
+            date_styles = self._read_date_styles(archive)
+            date1904 = self._read_date1904(archive)
+
+            for row in self._iter_sheet(archive.open(sheet_path), strings,
+                                        date_styles, date1904):
+                yield row
+        finally:
+            archive.close()
+
+    # PRIVATE
+    def _iter_sheet(self, source, strings, date_styles, date1904):
+        """Stream rows of the sheet xml converting cell values."""
+
+        decode = self.decoder.decode
+        min_col = 1
+        max_col = None
+        sheet_data = None
+
+        for event, element in iterparse(source, events=("start", "end")):
+            tag = element.tag
+
+            # keep sheet data element to drop rows already parsed
+            if event == "start":
+                if tag == SHEET_DATA_TAG:
+                    sheet_data = element
+                continue
+
+            # range of columns read by openpyxl
+            if tag == DIMENSION_TAG:
+                min_col, max_col = self._get_columns_range(element.get("ref"))
+
+            elif tag == ROW_TAG:
+                cells_values = []
+
+                for cell in element.iter(CELL_TAG):
+                    column = column_index(cell.get("r"))
+                    if column < min_col or (max_col and column > max_col):
+                        continue
+
+                    value = self._get_value(cell, strings, date_styles,
+                                            date1904)
+                    if value is None:
+                        continue
+
+                    # pad row with empty cells up to this one
+                    missing = column - min_col - len(cells_values)
+                    if missing > 0:
+                        cells_values.extend([None] * missing)
+                    cells_values.append(decode(value))
+
+                # last cell added is never empty, so rows are already trimmed
+                if cells_values:
+                    yield cells_values
+
+                sheet_data.clear()
+
+    def _get_value(self, cell, strings, date_styles, date1904):
+        """Return the value of a cell element the same way openpyxl does."""
+
+        data_type = cell.get("t", "n")
+        formula = cell.findtext(FORMULA_TAG)
+        value = cell.findtext(VALUE_TAG)
+
+        if formula is not None:
+            return "=" + formula
+
+        if data_type == "inlineStr":
+            return self._get_string(cell.find(INLINE_STRING_TAG))
+
+        if not value:
+            return None
+
+        if data_type == "s":
+            return strings[int(value)]
+
+        if data_type == "b":
+            return value == "1"
+
+        if data_type == "n":
+            if cell.get("s") in date_styles:
+                return from_excel(float(value), date1904)
+            return float(value)
+
+        if data_type == "str":
+            return unicode(value)
+
+        return value
+
+    def _get_sheet_path(self, archive):
+        """Return the path in archive of the active sheet of the workbook (the
+        one read by openpyxl), taken from the activeTab of the workbook view.
+        The first sheet is active if there is no activeTab."""
+
+        workbook = archive.read(WORKBOOK_PATH)
+        sheets = re.findall(r"<(?:\w+:)?sheet\b[^>]*>", workbook)
+
+        view = re.search(r"<(?:\w+:)?workbookView\b[^>]*>", workbook)
+        active_tab = view and re.search(r"\bactiveTab=\"(\d+)\"", view.group())
+        active = int(active_tab.group(1)) if active_tab else 0
+        sheet = sheets[active] if active < len(sheets) else None
+
+        rel_id = sheet and re.search(r"\br:id=\"([^\"]+)\"", sheet)
+
+        if rel_id:
+            rels = archive.read(WORKBOOK_RELS_PATH)
+            for relationship in re.findall(r"<(?:\w+:)?Relationship\b[^>]*>",
+                                           rels):
+                if 'Id="%s"' % rel_id.group(1) in relationship:
+                    target = re.search(r"Target=\"([^\"]+)\"",
+                                       relationship).group(1)
+                    if target.startswith("/"):
+                        return target.lstrip("/")
+                    return posixpath.normpath(posixpath.join("xl", target))
+
+        return DEFAULT_SHEET_PATH
+
+    def _read_strings(self, archive):
+        """Return the list of shared strings of the workbook."""
+
+        RV = []
+        if SHARED_STRINGS_PATH not in archive.namelist():
+            return RV
+
+        for _event, element in iterparse(archive.open(SHARED_STRINGS_PATH)):
+            if element.tag == STRING_ITEM_TAG:
+                RV.append(self._get_string(element))
+                element.clear()
+
+        return RV
+
+    def _get_string(self, element):
+        """Return text of a shared string item, joining rich text runs."""
+
+        if element is None:
+            return None
+
+        runs = element.findall(RICH_TEXT_TAG)
+        if runs:
+            RV = u"".join([self._get_text(run) for run in runs])
+        else:
+            RV = self._get_text(element)
+
+        # fix XML escaping sequence for '_x'
+        return RV.replace(u"x005F_", u"")
+
+    def _get_text(self, element):
+        """Return text of an element, stripped unless space is preserved."""
+
+        text_element = element.find(TEXT_TAG)
+        RV = unicode(text_element.text or u"")
+
+        if text_element.get(XML_SPACE_ATTR) != "preserve":
+            RV = RV.strip()
+
+        return RV
+
+    def _read_date_styles(self, archive):
+        """Return the set of style ids (as strings) with a date format."""
+
+        RV = set()
+        if STYLES_PATH not in archive.namelist():
+            return RV
+
+        formats = dict(BUILTIN_DATE_FORMATS)
+        style_id = 0
+        in_cell_xfs = False
+        for event, element in iterparse(archive.open(STYLES_PATH),
+                                        events=("start", "end")):
+            tag = element.tag
+
+            if event == "start":
+                if tag == CELL_XFS_TAG:
+                    in_cell_xfs = True
+                continue
+
+            if tag == NUM_FMT_TAG:
+                formats[element.get("numFmtId")] = element.get("formatCode")
+
+            elif tag == CELL_XFS_TAG:
+                in_cell_xfs = False
+
+            elif tag == XF_TAG and in_cell_xfs:
+                if is_date_format(formats.get(element.get("numFmtId"))):
+                    RV.add(str(style_id))
+                style_id += 1
+
+        return RV
+
+    def _read_date1904(self, archive):
+        """True if workbook uses the 1904 date system."""
+
+        workbook = archive.read(WORKBOOK_PATH)
+        return re.search(r"date1904=\"(1|true)\"", workbook) is not None
+
+    def _get_columns_range(self, dimension):
+        """Return first and last column indexes of a dimension reference."""
+
+        start, _sep, stop = dimension.partition(":")
+
+        return column_index(start), column_index(stop or start)
+
+
+class PeekedReader(BaseReader):
+
+    """Wrap a reader keeping the first head_rows rows in head, to look at
+    them before parsing (like detecting the layout of the book), and yield
+    them again followed by the rest of the rows. The book is read only once,
+    so rows can only be iterated once."""
+
+    def __init__(self, reader, head_rows):
+        self.reader = reader
+        self.decoder = reader.decoder
+        self.rows = reader.iter_rows()
+        self.head = list(islice(self.rows, head_rows))
+
+    def iter_rows(self):
+        return chain(self.head, self.rows)
+
+
+# DATA
+SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+DIMENSION_TAG = "{%s}dimension" % SHEET_MAIN_NS
+SHEET_DATA_TAG = "{%s}sheetData" % SHEET_MAIN_NS
+ROW_TAG = "{%s}row" % SHEET_MAIN_NS
+CELL_TAG = "{%s}c" % SHEET_MAIN_NS
+VALUE_TAG = "{%s}v" % SHEET_MAIN_NS
+FORMULA_TAG = "{%s}f" % SHEET_MAIN_NS
+INLINE_STRING_TAG = "{%s}is" % SHEET_MAIN_NS
+STRING_ITEM_TAG = "{%s}si" % SHEET_MAIN_NS
+RICH_TEXT_TAG = "{%s}r" % SHEET_MAIN_NS
+TEXT_TAG = "{%s}t" % SHEET_MAIN_NS
+NUM_FMT_TAG = "{%s}numFmt" % SHEET_MAIN_NS
+CELL_XFS_TAG = "{%s}cellXfs" % SHEET_MAIN_NS
+XF_TAG = "{%s}xf" % SHEET_MAIN_NS
+XML_SPACE_ATTR = "{http://www.w3.org/XML/1998/namespace}space"
+
+WORKBOOK_PATH = "xl/workbook.xml"
+WORKBOOK_RELS_PATH = "xl/_rels/workbook.xml.rels"
+SHARED_STRINGS_PATH = "xl/sharedStrings.xml"
+STYLES_PATH = "xl/styles.xml"
+DEFAULT_SHEET_PATH = "xl/worksheets/sheet1.xml"
+
+BUILTIN_DATE_FORMATS = {"14": "mm-dd-yy",
+                        "15": "d-mmm-yy",
+                        "16": "d-mmm",
+                        "17": "mmm-yy",
+                        "18": "h:mm AM/PM",
+                        "19": "h:mm:ss AM/PM",
+                        "20": "h:mm",
+                        "21": "h:mm:ss",
+                        "22": "m/d/yy h:mm",
+                        "45": "mm:ss",
+                        "46": "[h]:mm:ss",
+                        "47": "mmss.0"}
+
+BAD_DATE_RE = re.compile(r'(\[|").*[dmhys].*(\]|")')
+
+COORDINATE_RE = re.compile(r"\$?([A-Z]+)")
+
+_COLUMNS_CACHE = {}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def column_index(coordinate):
+    """Return the 1 based column index of a cell coordinate like "AB12"."""
+
+    letters = COORDINATE_RE.match(coordinate.upper()).group(1)
+
+    try:
+        return _COLUMNS_CACHE[letters]
+    except KeyError:
+        RV = 0
+        for letter in letters:
+            RV = RV * 26 + ord(letter) - ord("A") + 1
+        _COLUMNS_CACHE[letters] = RV
+        return RV
+
+
+def is_date_format(number_format):
+    """Check if a number format represents a date (same check of openpyxl)."""
+
+    if number_format is None:
+        return False
+
+    if any([x in number_format for x in "dmyhs"]):
+        return not BAD_DATE_RE.search(number_format)
+
+    return False
+
+
+def from_excel(value, date1904=False):
+    """Convert an excel serial date into a datetime (or a time, if value is
+    only a fraction of a day)."""
+
+    if date1904:
+        base_date = 24107
+    else:
+        base_date = 25569
+        if value < 60:
+            base_date -= 1
+        elif value == 60:
+            raise ValueError("Error: Excel believes 1900 was a leap year")
+
+    if value >= 1:
+        return EPOCH + datetime.timedelta(days=value - base_date)
+
+    elif value >= 0:
+        hours = floor(value * 24)
+        mins = floor(value * 24 * 60) - floor(hours * 60)
+        secs = floor(value * 24 * 60 * 60) - floor(hours * 60 * 60) - \
+            floor(mins * 60)
+        return datetime.time(int(hours), int(mins), int(secs))
+
+    raise ValueError("Negative dates (%s) are not supported" % value)
+
+
+READERS = ["openpyxl", "xml", "rowstore"]
+
+
+def get_reader(file_name, reader=None):
+    """Build a reader of rows for an ABBY file. Reader can be "openpyxl" (the
+    default), "xml" for the fast streaming reader or "rowstore" for books
+    compiled in a row store (the default for files with ".rows" extension,
+    see rowstore module)."""
+
+    if not reader and file_name.lower().endswith(".rows"):
+        reader = "rowstore"
+    reader = reader or "openpyxl"
+
+    if reader == "openpyxl":
+        from openpyxl import load_workbook
+        RV = OpenpyxlReader(load_workbook(filename=file_name,
+                                          use_iterators=True))
+
+    elif reader == "xml":
+        RV = XmlReader(file_name)
+
+    elif reader == "rowstore":
+        from rowstore import RowStoreReader
+        RV = RowStoreReader(file_name)
+
+    else:
+        raise ValueError("Unknown reader: %r. Valid readers are %s" %
+                         (reader, ", ".join(READERS)))
+
+    return RV
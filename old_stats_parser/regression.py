@@ -0,0 +1,412 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import csv
+import sys
+import gzip
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from io import BufferedReader, BufferedWriter
+from collections import OrderedDict
+from itertools import izip_longest
+from operator import itemgetter
+from abby_file import scrape_abby_file
+from synthetic_book import generate_book
+from startup import check_startup, print_startup
+
+
+class RecordsDiff():
+
+    """Compare two streams of records, given as (key, hash) pairs in output
+    order, and keep the keys of records added, removed and changed.
+
+    Both streams are walked at the same time. While they are in step, records
+    are compared one by one and nothing is kept in memory; records that fall
+    out of step wait in a dict until a record with the same key turns up in
+    the other stream. Keys are only unique inside a product table, so records
+    waiting with the same key are kept in order and matched in that order.
+    Memory only grows with the differences, not with the size of the
+    outputs."""
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.records = 0
+        self.golden_records = 0
+
+    # PUBLIC
+    def compare(self, records, golden_records):
+        """Compare records with golden records. Returns self."""
+
+        pending = {}
+        pending_golden = {}
+
+        for record, golden in izip_longest(records, golden_records):
+            if record and golden and record[0] == golden[0]:
+                self._check(record[0], record[1], golden[1])
+                self.records += 1
+                self.golden_records += 1
+                continue
+
+            if record:
+                self.records += 1
+                self._match(record, pending_golden, pending, False)
+            if golden:
+                self.golden_records += 1
+                self._match(golden, pending, pending_golden, True)
+
+        # records without pair were added or removed
+        for keys, waiting in [(self.added, pending),
+                              (self.removed, pending_golden)]:
+            for key in sorted(waiting):
+                keys.extend([key] * len(waiting[key]))
+
+        return self
+
+    def is_equal(self):
+        return not (self.added or self.removed or self.changed)
+
+    # PRIVATE
+    def _match(self, record, others, own, is_golden):
+        """Compare record with the record of the same key in the other
+        stream, or leave it waiting for it in its own pending dict."""
+
+        key, record_hash = record
+        if key in others:
+            other_hashes = others[key]
+            other_hash = other_hashes.pop(0)
+            if not other_hashes:
+                del others[key]
+
+            if is_golden:
+                self._check(key, other_hash, record_hash)
+            else:
+                self._check(key, record_hash, other_hash)
+        else:
+            own.setdefault(key, []).append(record_hash)
+
+    def _check(self, key, record_hash, golden_hash):
+        if record_hash != golden_hash:
+            self.changed.append(key)
+
+
+# DATA
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "golden")
+GOLDEN_EXTENSION = ".golden.gz"
+
+# golden files are written twice as fast as with the default level, and are
+# hardly bigger
+GZIP_LEVEL = 6
+
+# fields identifying a record, besides its occurrence number among records
+# of its product table with the same values of them
+KEY_FIELDS = ["id_title", "id_subt1", "id_subt2", "id_product",
+              "desc_country", "year"]
+PRODUCT_FIELDS = KEY_FIELDS[:4]
+
+# books of the regression suite: the bundled book, or keyword arguments of
+# a synthetic book
+BOOKS = OrderedDict([
+    ("abby_file", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "abby_file.xlsx")),
+    ("synthetic", {"titles": 3, "seed": 0}),
+    ("synthetic_irregular", {"titles": 2, "products": 6, "split_heads": 0.5,
+                             "none_imports": 0.3, "conclusions": 0.3,
+                             "seed": 1})])
+
+ENGINES = ["sequential", "parallel", "pipelined", "incremental", "low_memory"]
+
+# rows of the chunks of the parallel engine: regression books are small, so
+# they are cut in many chunks to check records are stitched across them
+PARALLEL_CHUNK_ROWS = 50
+
+# keys shown for every kind of difference
+MAX_KEYS_SHOWN = 10
+
+
+# INTERNAL FUNCTIONS
+def iter_csv_records(file_name):
+    """Yield (key, hash) of every record of a csv output, in output order.
+    Key is a tuple of values of KEY_FIELDS and the occurrence number of the
+    record among the ones of its product table with the same values, hash is
+    taken from all values of the record.
+
+    Hashes only need to tell records with the same key apart, md5 is enough
+    and much faster than sha1 on short strings."""
+
+    with open(file_name, "rb") as f:
+        reader = csv.reader(f)
+        fields = next(reader)
+        get_key = itemgetter(*[fields.index(field) for field in KEY_FIELDS])
+        get_product = itemgetter(*[fields.index(field)
+                                   for field in PRODUCT_FIELDS])
+
+        # output fields are part of every hash, a new field changes them all
+        header = "\t".join(fields) + "\n"
+
+        # occurrences are only counted inside a product table, so memory
+        # doesn't grow with the output. A key can come again in a later table
+        # of the same product, RecordsDiff matches repeated keys in order
+        product = None
+        occurrences = {}
+
+        md5 = hashlib.md5
+        for row in reader:
+            if get_product(row) != product:
+                product = get_product(row)
+                occurrences = {}
+
+            key = get_key(row)
+            occurrence = occurrences.get(key, 0) + 1
+            occurrences[key] = occurrence
+
+            yield (key + (str(occurrence),),
+                   md5(header + "\t".join(row)).hexdigest())
+
+
+def iter_golden_records(file_name):
+    """Yield (key, hash) of every record of a golden file."""
+
+    # buffered reads are much faster than lines read straight from gzip
+    with BufferedReader(gzip.open(file_name, "rb")) as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            yield tuple(row[:-1]), row[-1]
+
+
+def write_golden(file_name, records):
+    """Write (key, hash) records in a golden file. Returns their number."""
+
+    RV = 0
+    with BufferedWriter(gzip.open(file_name, "wb", GZIP_LEVEL)) as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(KEY_FIELDS + ["occurrence", "hash"])
+        for key, record_hash in records:
+            writer.writerow(key + (record_hash,))
+            RV += 1
+
+    return RV
+
+
+def format_key(key):
+    """Return a readable version of a record key."""
+
+    return " ".join(["%s=%s" % (field, value) for field, value in
+                     zip(KEY_FIELDS + ["occurrence"], key)])
+
+
+def run_engine(engine, wb_abby_name, wb_abby_parsed_name, reader=None):
+    """Parse a book to a csv output with one of the ENGINES. Engines are
+    imported only when used, some of them need optional packages."""
+
+    if engine == "sequential":
+        scrape_abby_file(wb_abby_name, wb_abby_parsed_name, "csv", reader)
+
+    elif engine == "parallel":
+        from parallel import scrape_abby_file_parallel
+        scrape_abby_file_parallel(wb_abby_name, wb_abby_parsed_name, "csv",
+                                  reader, chunk_rows=PARALLEL_CHUNK_ROWS)
+
+    elif engine == "pipelined":
+        from pipeline import scrape_abby_file_pipelined
+        scrape_abby_file_pipelined(wb_abby_name, wb_abby_parsed_name, "csv",
+                                   reader)
+
+    elif engine == "incremental":
+        from incremental import scrape_abby_file_incremental
+
+        # sections cache must not be taken from another run. The book is
+        # parsed twice, the output checked is the one spliced from the cache
+        cache_name = wb_abby_parsed_name + ".sections"
+        for i in xrange(2):
+            results = scrape_abby_file_incremental(wb_abby_name,
+                                                   wb_abby_parsed_name, "csv",
+                                                   reader, cache_name)
+        if results["parsed_sections"]:
+            raise RuntimeError("%d sections parsed again from an unchanged "
+                               "book" % results["parsed_sections"])
+
+    elif engine == "low_memory":
+        from memory import scrape_abby_file_low_memory
+        scrape_abby_file_low_memory(wb_abby_name, wb_abby_parsed_name,
+                                    1024 * 1024, "csv", reader or "xml")
+
+    else:
+        raise ValueError("Unknown engine: %r. Valid engines are %s" %
+                         (engine, ", ".join(ENGINES)))
+
+
+def get_golden_name(book_name, golden_dir=None):
+    return os.path.join(golden_dir or GOLDEN_DIR,
+                        book_name + GOLDEN_EXTENSION)
+
+
+# USER FUNCTIONS
+def diff_output(output_name, golden_name):
+    """Compare a csv output with a golden file. Returns a RecordsDiff."""
+
+    return RecordsDiff().compare(iter_csv_records(output_name),
+                                 iter_golden_records(golden_name))
+
+
+def check_book(book_name, wb_abby_name, golden_dir=None, engine=None,
+               reader=None, update=False):
+    """Parse a book with engine ("sequential" by default) and compare its
+    records with its golden file, or write the golden file if update is True.
+    Returns a dict with results of the book."""
+
+    golden_name = get_golden_name(book_name, golden_dir)
+    if update:
+        if not os.path.isdir(os.path.dirname(golden_name)):
+            os.makedirs(os.path.dirname(golden_name))
+    elif not os.path.exists(golden_name):
+        raise IOError("No golden file for %s: %s (write it with update)" %
+                      (book_name, golden_name))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        output_name = os.path.join(temp_dir, book_name + ".csv")
+
+        start = time.time()
+        run_engine(engine or "sequential", wb_abby_name, output_name, reader)
+        parse_seconds = time.time() - start
+
+        start = time.time()
+        if update:
+            diff = None
+            records = write_golden(golden_name,
+                                   iter_csv_records(output_name))
+        else:
+            diff = diff_output(output_name, golden_name)
+            records = diff.records
+        diff_seconds = time.time() - start
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return {"book": book_name,
+            "records": records,
+            "diff": diff,
+            "parse_seconds": parse_seconds,
+            "diff_seconds": diff_seconds}
+
+
+def check_books(book_names=None, golden_dir=None, engine=None, reader=None,
+                update=False):
+    """Run check_book over books of the regression suite (all of BOOKS by
+    default), generating the synthetic ones. Returns a list of results."""
+
+    RV = []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for book_name in book_names or BOOKS:
+            book = BOOKS[book_name]
+            if isinstance(book, dict):
+                wb_abby_name = os.path.join(temp_dir, book_name + ".xlsx")
+                generate_book(wb_abby_name, **book)
+            else:
+                wb_abby_name = book
+
+            RV.append(check_book(book_name, wb_abby_name, golden_dir, engine,
+                                 reader, update))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return RV
+
+
+def print_results(results, max_keys=MAX_KEYS_SHOWN):
+    """Print differences found in every book."""
+
+    for result in results:
+        diff = result["diff"]
+        line = "%-20s %8d records  parse %.2f s  diff %.2f s" % (
+            result["book"], result["records"], result["parse_seconds"],
+            result["diff_seconds"])
+
+        if diff is None:
+            print line + "  golden file written"
+            continue
+        if diff.is_equal():
+            print line + "  OK"
+            continue
+
+        print line + "  %d added, %d removed, %d changed (golden has %d)" % (
+            len(diff.added), len(diff.removed), len(diff.changed),
+            diff.golden_records)
+        for kind, keys in [("added", diff.added), ("removed", diff.removed),
+                           ("changed", diff.changed)]:
+            for key in keys[:max_keys]:
+                print "    %-8s %s" % (kind, format_key(key))
+            if len(keys) > max_keys:
+                print "    %-8s ... %d more" % (kind, len(keys) - max_keys)
+
+
+def main(args=None):
+    """Command line entry point for the regression suite."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Compare records of the regression books with their "
+                    "golden files.")
+    arg_parser.add_argument("books", nargs="*",
+                            help="books to check (default: %s)" %
+                                 ", ".join(BOOKS))
+    arg_parser.add_argument("-e", "--engine", default="sequential",
+                            help="parsing engine: %s" % ", ".join(ENGINES))
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("-g", "--golden-dir", default=None,
+                            help="directory of golden files")
+    arg_parser.add_argument("-o", "--output", default=None,
+                            help="compare this csv output with the golden "
+                                 "file of the book, instead of parsing it")
+    arg_parser.add_argument("--update", action="store_true",
+                            help="write golden files from current output")
+    arg_parser.add_argument("--skip-startup", action="store_true",
+                            help="don't check import time of entry modules")
+    args = arg_parser.parse_args(args)
+
+    for book_name in args.books:
+        if book_name not in BOOKS:
+            arg_parser.error("unknown book: %s" % book_name)
+
+    if args.output:
+        if len(args.books) != 1:
+            arg_parser.error("--output needs exactly one book")
+        start = time.time()
+        diff = diff_output(args.output, get_golden_name(args.books[0],
+                                                        args.golden_dir))
+        results = [{"book": args.books[0], "records": diff.records,
+                    "diff": diff, "parse_seconds": 0.0,
+                    "diff_seconds": time.time() - start}]
+    else:
+        results = check_books(args.books, args.golden_dir, args.engine,
+                              args.reader, args.update)
+
+    print_results(results)
+
+    # startup regressions are checked with the parsing ones
+    startup_results = {}
+    if not (args.output or args.update or args.skip_startup):
+        startup_results = check_startup()
+        print_startup(startup_results)
+
+    if [result for result in results
+            if result["diff"] and not result["diff"].is_equal()]:
+        return 1
+    if [result for result in startup_results.itervalues()
+            if result["over_budget"] or result["eager"]]:
+        return 1
+
+    return 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
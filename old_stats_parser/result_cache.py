@@ -0,0 +1,379 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from abby_file import scrape_abby_file
+
+
+class ResultCache():
+
+    """Keep output files of parsed books in a cache directory, to be reused
+    when the same book is parsed again with the same code and settings.
+
+    Entries are keyed by the hash of the content of the input file, the
+    version of the code that parses it and the output settings, so renamed
+    or copied books are found too. Every entry is an output file and a json
+    file with its metadata. The modification time of the output file marks
+    its last use: when the cache grows over max_size_mb megabytes, least
+    recently used entries are removed first.
+
+    Entries are plain files, so many processes can share a cache directory:
+    they are written to a temporary name and renamed when complete."""
+
+    def __init__(self, cache_dir=None, max_size_mb=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size_mb = max_size_mb or MAX_SIZE_MB
+
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # another process may have just created it
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+    # PUBLIC
+    def get(self, key, output_name, link=False):
+        """Put the cached output of key in output_name, hard linking it if
+        link is True (copying it if the link can't be made). Returns the
+        metadata of the entry, or None if key is not cached."""
+
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+
+        entry_name = self._entry_name(key, meta["format"])
+        try:
+            self._place(entry_name, output_name, link)
+        except (IOError, OSError):
+            # entry removed by another process since metadata was read
+            return None
+
+        # mark entry as recently used
+        os.utime(entry_name, None)
+
+        return meta
+
+    def put(self, key, output_name, output_format, meta=None, link=False):
+        """Add output_name to the cache as the output of key, with meta dict
+        of extra metadata. Least recently used entries are evicted if the
+        cache grows too much. Returns the metadata of the entry."""
+
+        RV = dict(meta or {})
+        RV.update({"key": key,
+                   "format": output_format,
+                   "size": os.path.getsize(output_name),
+                   "created": time.time()})
+
+        # entry is complete before its metadata, both before renamed
+        entry_name = self._entry_name(key, output_format)
+        self._place(output_name, entry_name, link)
+        self._write_json(self._meta_name(key), RV)
+
+        self.evict()
+
+        return RV
+
+    def entries(self):
+        """Return metadata of all entries, most recently used first. Each one
+        has its last use time in "used"."""
+
+        RV = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(META_EXTENSION):
+                continue
+
+            key = file_name[:-len(META_EXTENSION)]
+            meta = self._read_meta(key)
+            if meta is None:
+                continue
+
+            try:
+                meta["used"] = os.path.getmtime(
+                    self._entry_name(key, meta["format"]))
+            except OSError:
+                continue
+            RV.append(meta)
+
+        RV.sort(key=lambda meta: meta["used"], reverse=True)
+
+        return RV
+
+    def size(self):
+        """Return the size in bytes of all cached outputs."""
+        return sum([meta["size"] for meta in self.entries()])
+
+    def evict(self, max_size_mb=None, max_age_days=None):
+        """Remove least recently used entries until cache size is under
+        max_size_mb megabytes (by default the size of the cache), and entries
+        not used in the last max_age_days days. Returns removed entries."""
+
+        max_size = (max_size_mb if max_size_mb is not None
+                    else self.max_size_mb) * 1024 * 1024
+        min_used = None
+        if max_age_days is not None:
+            min_used = time.time() - max_age_days * 24 * 3600
+
+        RV = []
+        size = 0
+        for meta in self.entries():
+            size += meta["size"]
+            if size > max_size or (min_used and meta["used"] < min_used):
+                self.remove(meta["key"], meta["format"])
+                size -= meta["size"]
+                RV.append(meta)
+
+        return RV
+
+    def remove(self, key, output_format):
+        """Remove the entry of key, if it still exists."""
+
+        for file_name in [self._meta_name(key),
+                          self._entry_name(key, output_format)]:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all entries. Returns removed entries."""
+
+        RV = self.entries()
+        for meta in RV:
+            self.remove(meta["key"], meta["format"])
+
+        return RV
+
+    # PRIVATE
+    def _entry_name(self, key, output_format):
+        return os.path.join(self.cache_dir, key + "." + output_format)
+
+    def _meta_name(self, key):
+        return os.path.join(self.cache_dir, key + META_EXTENSION)
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_name(key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _write_json(self, file_name, obj):
+        temp_name = self._temp_name(file_name)
+        with open(temp_name, "w") as f:
+            json.dump(obj, f, indent=4, sort_keys=True)
+        self._rename(temp_name, file_name)
+
+    def _place(self, source_name, target_name, link=False):
+        """Hard link or copy source file to target, replacing it."""
+
+        temp_name = self._temp_name(target_name)
+        try:
+            if link and hasattr(os, "link"):
+                try:
+                    os.link(source_name, temp_name)
+                except OSError:
+                    # other file system or no links support, copy it
+                    shutil.copyfile(source_name, temp_name)
+            else:
+                shutil.copyfile(source_name, temp_name)
+            self._rename(temp_name, target_name)
+
+        finally:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+
+    def _temp_name(self, file_name):
+        return "%s.%d.tmp" % (file_name, os.getpid())
+
+    def _rename(self, source_name, target_name):
+        # in windows rename fails if target exists
+        if sys.platform == "win32" and os.path.exists(target_name):
+            os.remove(target_name)
+        os.rename(source_name, target_name)
+
+
+# DATA
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"),
+                                 ".old_stats_parser", "results")
+MAX_SIZE_MB = 1024
+META_EXTENSION = ".json"
+
+# change it whenever cached outputs must not be used anymore
+CACHE_VERSION = 1
+
+# modules whose code decides the records of a book and how they are written
+CODE_MODULES = ["abby_file", "classifier", "parsers", "utils", "layouts",
+                "stats_book_1", "readers", "rowstore", "sinks",
+                "dictionaries"]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+code_version = None
+
+
+# INTERNAL FUNCTIONS
+def hash_file(file_name):
+    """Return a fingerprint of the content of a file."""
+
+    RV = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), ""):
+            RV.update(block)
+
+    return RV.hexdigest()
+
+
+def get_code_version():
+    """Return a fingerprint of the source of modules that parse books and
+    write their records. It is computed once per process."""
+
+    global code_version
+
+    if code_version is None:
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+        version = hashlib.sha1(str(CACHE_VERSION))
+        for module_name in CODE_MODULES:
+            with open(os.path.join(code_dir, module_name + ".py"), "rb") as f:
+                version.update(f.read())
+        code_version = version.hexdigest()
+
+    return code_version
+
+
+def get_output_format(wb_abby_parsed_name, output_format=None):
+    """Return output format, taken from the output file name if not passed."""
+
+    RV = output_format or \
+        os.path.splitext(wb_abby_parsed_name)[1].lstrip(".").lower()
+
+    return RV or "xlsx"
+
+
+def get_cache_key(wb_abby_name, output_format, layout=None):
+    """Return the cache key of the output of a book parsed with the current
+    code, in output_format and with layout (detected if not passed). Rows
+    readers give the same rows, so the reader is not part of the key."""
+
+    key = [hash_file(wb_abby_name), get_code_version(), output_format,
+           layout or ""]
+
+    return hashlib.sha1(repr(key)).hexdigest()
+
+
+# USER FUNCTIONS
+def scrape_abby_file_cached(wb_abby_name, wb_abby_parsed_name,
+                            output_format=None, reader=None, layout=None,
+                            cache_dir=None, max_size_mb=None, link=False):
+    """Parse an ABBY file like scrape_abby_file, unless the same book was
+    already parsed with the same code and settings: then its cached output
+    is copied (or hard linked, if link is True) to wb_abby_parsed_name
+    without parsing it. Outputs of parsed books are added to the cache.
+
+    Hard linked outputs share their content with the cache, so they must not
+    be modified in place. Returns a dict with the number of records, whether
+    the output was taken from the cache and the key of the book."""
+
+    output_format = get_output_format(wb_abby_parsed_name, output_format)
+    cache = ResultCache(cache_dir, max_size_mb)
+    key = get_cache_key(wb_abby_name, output_format, layout)
+
+    # never write a new output over a file linked to the cache
+    if os.path.exists(wb_abby_parsed_name):
+        os.remove(wb_abby_parsed_name)
+
+    meta = cache.get(key, wb_abby_parsed_name, link)
+    if meta:
+        return {"records": meta["records"], "cached": True, "key": key}
+
+    records = scrape_abby_file(wb_abby_name, wb_abby_parsed_name,
+                               output_format, reader, layout=layout)
+    cache.put(key, wb_abby_parsed_name, output_format,
+              {"input": os.path.abspath(wb_abby_name), "records": records},
+              link)
+
+    return {"records": records, "cached": False, "key": key}
+
+
+def main(args=None):
+    """Command line entry point to parse books through the results cache, and
+    to inspect or prune it."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse ABBY files reusing cached outputs of unchanged "
+                    "books, and inspect or prune the cache.")
+    arg_parser.add_argument("-d", "--cache-dir", default=None,
+                            help="cache directory (default: %s)" %
+                                 DEFAULT_CACHE_DIR)
+    subparsers = arg_parser.add_subparsers(dest="command")
+
+    parse_parser = subparsers.add_parser("parse", help="parse one book")
+    parse_parser.add_argument("input_file", help="ABBY file to parse")
+    parse_parser.add_argument("output_file", help="file for parsed records")
+    parse_parser.add_argument("-f", "--format", default=None,
+                              help="output format (default: from extension)")
+    parse_parser.add_argument("-r", "--reader", default=None,
+                              help="rows reader: openpyxl (default) or xml")
+    parse_parser.add_argument("-s", "--max-size", type=float, default=None,
+                              help="cache size in megabytes (default: %d)" %
+                                   MAX_SIZE_MB)
+    parse_parser.add_argument("-l", "--link", action="store_true",
+                              help="hard link cached outputs instead of "
+                                   "copying them")
+
+    subparsers.add_parser("list", help="list cached outputs")
+
+    prune_parser = subparsers.add_parser("prune", help="remove cached outputs")
+    prune_parser.add_argument("-s", "--max-size", type=float, default=None,
+                              help="remove least recently used outputs until "
+                                   "cache is under this size in megabytes")
+    prune_parser.add_argument("-a", "--max-age", type=float, default=None,
+                              help="remove outputs not used in this number "
+                                   "of days")
+    prune_parser.add_argument("--all", action="store_true",
+                              help="remove all outputs")
+    args = arg_parser.parse_args(args)
+
+    if args.command == "parse":
+        start = time.time()
+        results = scrape_abby_file_cached(args.input_file, args.output_file,
+                                          args.format, args.reader,
+                                          cache_dir=args.cache_dir,
+                                          max_size_mb=args.max_size,
+                                          link=args.link)
+        print "%d records written to %s (%s) in %.3f seconds" % (
+            results["records"], args.output_file,
+            "cached" if results["cached"] else "parsed", time.time() - start)
+
+    elif args.command == "list":
+        cache = ResultCache(args.cache_dir)
+        entries = cache.entries()
+        for meta in entries:
+            print "%s  %-7s %10d bytes %8d records  %s  %s" % (
+                meta["key"][:12], meta["format"], meta["size"],
+                meta["records"], time.strftime("%Y-%m-%d %H:%M",
+                                               time.localtime(meta["used"])),
+                meta["input"])
+        print "%d outputs, %.1f MB in %s" % (
+            len(entries), sum([meta["size"] for meta in entries]) /
+            (1024.0 * 1024), cache.cache_dir)
+
+    elif args.command == "prune":
+        cache = ResultCache(args.cache_dir)
+        if args.all:
+            removed = cache.clear()
+        else:
+            removed = cache.evict(args.max_size, args.max_age)
+        print "%d outputs removed, %.1f MB freed" % (
+            len(removed), sum([meta["size"] for meta in removed]) /
+            (1024.0 * 1024))
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
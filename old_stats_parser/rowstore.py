@@ -0,0 +1,309 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import mmap
+import struct
+import argparse
+from array import array
+from readers import BaseReader, get_reader
+from checkpoint import replace_file
+
+
+class RowStoreWriter():
+
+    """Write rows of a book in a row store: a binary file with the rows
+    already read and decoded, ready to be parsed again and again without
+    going through the xlsx file.
+
+    The file has a header and four sections: the UTF-8 blob with the text of
+    all cells one after another, the kind of every cell (text, empty or a
+    number kept as it was), the offsets of every cell in the blob (one more
+    than cells, a cell goes from its offset to the next one) and the number
+    of cells of every row. Arrays are written in the byte order of the
+    machine, which is kept in the header."""
+
+    def __init__(self, file_name, source_name=None):
+        self.file_name = file_name
+        self.source_name = source_name
+        self.temp_name = file_name + ".tmp"
+        self.f = open(self.temp_name, "wb")
+        self.f.write(" " * HEADER_SIZE)
+        self.blob_size = 0
+        self.kinds = array("B")
+        self.offsets = array("I", [0])
+        self.cell_counts = array("I")
+
+    # PUBLIC
+    def write(self, row):
+        """Add a row (a list of cell values) to the store. Raises ValueError
+        once the text of the book doesn't fit in the offsets of the store."""
+
+        for value in row:
+            kind, text = encode_value(value)
+            if self.blob_size + len(text) > MAX_BLOB_SIZE:
+                raise ValueError("Text of the book is too big for a row "
+                                 "store")
+
+            self.f.write(text)
+            self.blob_size += len(text)
+            self.kinds.append(kind)
+            self.offsets.append(self.blob_size)
+
+        self.cell_counts.append(len(row))
+
+    def close(self):
+        """Write the sections after the blob and the header, and move the
+        store to its name."""
+
+        sections = []
+        for section in [self.kinds, self.offsets, self.cell_counts]:
+            sections.append(self.f.tell())
+            section.tofile(self.f)
+
+        source_size, source_mtime = get_source_stamp(self.source_name)
+
+        self.f.seek(0)
+        self.f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                                 sys.byteorder == "little",
+                                 len(self.cell_counts), len(self.kinds),
+                                 self.blob_size, sections[0], sections[1],
+                                 sections[2], source_size, source_mtime))
+        self.f.close()
+
+        replace_file(self.temp_name, self.file_name)
+
+    def abort(self):
+        """Close and remove the temporary file, leaving any previous store
+        as it was."""
+
+        self.f.close()
+        if os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
+
+
+class RowStoreReader(BaseReader):
+
+    """Read rows from a row store written by RowStoreWriter.
+
+    The file is memory mapped: the blob with the text of the cells and the
+    kinds of the cells are read in place through buffers of the mapping, and
+    every cell is decoded to unicode straight from the mapped pages when its
+    row is yielded, without a str copy of its text. Only the offsets and the
+    cell counts are loaded in arrays (four bytes per cell and per row), to
+    fix their byte order. Rows are already decoded and trimmed, so they come
+    out exactly like the reader that compiled them gave them."""
+
+    def __init__(self, file_name):
+        BaseReader.__init__(self)
+        self.file_name = file_name
+
+    def iter_rows(self):
+        """Yield every row of the store as a list of cell values."""
+
+        with open(self.file_name, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header = read_header(mapped)
+            kinds = buffer(mapped, header["kinds"], header["cells"])
+            offsets = self._read_array(mapped, "I", header["offsets"],
+                                       header["cells"] + 1, header)
+            cell_counts = self._read_array(mapped, "I", header["cell_counts"],
+                                           header["rows"], header)
+
+            blob_start = HEADER_SIZE
+            start = 0
+            for count in cell_counts:
+                end = start + count
+                row = [unicode(buffer(mapped, blob_start + offsets[i],
+                                      offsets[i + 1] - offsets[i]), "utf-8")
+                       for i in xrange(start, end)]
+
+                # cells that are not text are rare, fix them only if any
+                if kinds[start:end].strip(TEXT_KIND_CHAR):
+                    for i in xrange(start, end):
+                        if kinds[i] != TEXT_KIND_CHAR:
+                            row[i - start] = decode_value(ord(kinds[i]),
+                                                          row[i - start])
+
+                yield row
+                start = end
+
+        finally:
+            mapped.close()
+
+    # PRIVATE
+    def _read_array(self, mapped, typecode, position, length, header):
+        RV = array(typecode)
+        RV.fromstring(mapped[position:position + length * RV.itemsize])
+
+        if header["little_endian"] != (sys.byteorder == "little"):
+            RV.byteswap()
+
+        return RV
+
+
+# DATA
+MAGIC = "OSPROWS\x00"
+VERSION = 1
+ROW_STORE_EXTENSION = ".rows"
+
+# magic, version, byte order, rows, cells, blob size, positions of kinds,
+# offsets and cell counts sections, size and modification time of the book
+HEADER_FORMAT = "<8sIBQQQQQQQd"
+HEADER_SIZE = 128
+
+# offsets are unsigned 32 bits integers
+MAX_BLOB_SIZE = 2 ** 32 - 1
+
+# kinds of cells
+TEXT_KIND = 0
+NONE_KIND = 1
+FLOAT_KIND = 2
+INT_KIND = 3
+BOOL_KIND = 4
+BYTES_KIND = 5
+
+TEXT_KIND_CHAR = chr(TEXT_KIND)
+
+
+def encode_value(value):
+    """Return kind and UTF-8 text of a cell value."""
+
+    if isinstance(value, unicode):
+        return TEXT_KIND, value.encode("utf-8")
+
+    if value is None:
+        return NONE_KIND, ""
+
+    # decoded rows only keep empty values (like 0.0) without converting them
+    if isinstance(value, bool):
+        return BOOL_KIND, str(int(value))
+    if isinstance(value, float):
+        return FLOAT_KIND, repr(value)
+    if isinstance(value, (int, long)):
+        return INT_KIND, str(value)
+    if isinstance(value, str):
+        return BYTES_KIND, value
+
+    raise TypeError("Cell value can't be stored: %r" % (value,))
+
+
+def decode_value(kind, text):
+    """Return a cell value from its kind and its decoded text."""
+
+    if kind == NONE_KIND:
+        return None
+    if kind == FLOAT_KIND:
+        return float(text)
+    if kind == INT_KIND:
+        return int(text)
+    if kind == BOOL_KIND:
+        return text == u"1"
+    if kind == BYTES_KIND:
+        return text.encode("utf-8")
+
+    return text
+
+
+def read_header(mapped):
+    """Return a dict with the values of the header of a row store."""
+
+    values = struct.unpack_from(HEADER_FORMAT, mapped)
+    if values[0] != MAGIC:
+        raise ValueError("Not a row store file")
+    if values[1] != VERSION:
+        raise ValueError("Row store version %d is not supported, compile the "
+                         "book again" % values[1])
+
+    return dict(zip(["magic", "version", "little_endian", "rows", "cells",
+                     "blob_size", "kinds", "offsets", "cell_counts",
+                     "source_size", "source_mtime"], values))
+
+
+def get_source_stamp(source_name):
+    """Return size and modification time of the compiled book."""
+
+    if not source_name or not os.path.exists(source_name):
+        return 0, 0.0
+
+    return os.path.getsize(source_name), os.path.getmtime(source_name)
+
+
+def is_compiled(wb_abby_name, row_store_name):
+    """True if row store exists and was compiled from the current version of
+    the book."""
+
+    if not os.path.exists(row_store_name):
+        return False
+
+    try:
+        with open(row_store_name, "rb") as f:
+            header = read_header(f.read(HEADER_SIZE))
+    except (ValueError, struct.error):
+        return False
+
+    return (header["source_size"], header["source_mtime"]) == \
+        get_source_stamp(wb_abby_name)
+
+
+def get_row_store_name(wb_abby_name):
+    return os.path.splitext(wb_abby_name)[0] + ROW_STORE_EXTENSION
+
+
+# USER FUNCTIONS
+def compile_book(wb_abby_name, row_store_name=None, reader=None,
+                 force=False):
+    """Read and decode rows of an ABBY file once, writing them in a row store
+    (by default next to the book, with ".rows" extension). The book is not
+    read again if the store is up to date, unless force is True.
+
+    Row stores are read like any other book, with reader "rowstore" (taken by
+    default for files with ".rows" extension). Returns the number of rows in
+    the store."""
+
+    row_store_name = row_store_name or get_row_store_name(wb_abby_name)
+
+    if not force and is_compiled(wb_abby_name, row_store_name):
+        with open(row_store_name, "rb") as f:
+            return read_header(f.read(HEADER_SIZE))["rows"]
+
+    writer = RowStoreWriter(row_store_name, wb_abby_name)
+    try:
+        for row in get_reader(wb_abby_name, reader).iter_rows():
+            writer.write(row)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    return len(writer.cell_counts)
+
+
+def main(args=None):
+    """Command line entry point to compile books in row stores."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Compile an ABBY file in a row store, to parse it again "
+                    "without reading the xlsx file.")
+    arg_parser.add_argument("input_file", help="ABBY file to compile")
+    arg_parser.add_argument("output_file", nargs="?", default=None,
+                            help="row store (default: input file with .rows "
+                                 "extension)")
+    arg_parser.add_argument("-r", "--reader", default=None,
+                            help="rows reader: openpyxl (default) or xml")
+    arg_parser.add_argument("--force", action="store_true",
+                            help="compile even if row store is up to date")
+    args = arg_parser.parse_args(args)
+
+    output_file = args.output_file or get_row_store_name(args.input_file)
+    rows = compile_book(args.input_file, output_file, args.reader, args.force)
+
+    print "%d rows in %s (%d bytes)" % (rows, output_file,
+                                        os.path.getsize(output_file))
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,621 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import httplib
+import argparse
+import threading
+import itertools
+import SocketServer
+from collections import OrderedDict, deque
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from batch import scrape_book, get_output_name
+
+
+class ServiceClosed(Exception):
+    """Raised when a job is submitted to a service that is shutting down."""
+
+
+class Job():
+
+    """A book sent to the service to be parsed, with its status: "queued"
+    while it waits for a worker, "running", and "done" or "failed" (with the
+    error) when the worker finishes it, or when the worker process dies.
+    "cancelled" jobs never ran."""
+
+    def __init__(self, job_id, input_name, output_name, output_format=None,
+                 reader=None):
+        self.id = job_id
+        self.input_name = input_name
+        self.output_name = output_name
+        self.output_format = output_format
+        self.reader = reader
+        self.future = None
+        self.cancelled = False
+        self.finished_event = threading.Event()
+        self.submitted = time.time()
+        self.finished = None
+
+    # PUBLIC
+    def status(self):
+        if self.cancelled:
+            return "cancelled"
+        if self.future is None:
+            return "queued"
+        if self.future.done():
+            return "failed" if self.results()["error"] else "done"
+        return "running"
+
+    def results(self):
+        """Return results of the book (see batch.scrape_book), or None if
+        the job didn't finish."""
+
+        if self.future and self.future.done():
+            try:
+                return self.future.result()
+
+            # a dead worker breaks the pool, the job is failed but its status
+            # can still be asked
+            except Exception as error:
+                return {"input": self.input_name,
+                        "output": self.output_name,
+                        "records": None,
+                        "cached": False,
+                        "seconds": None,
+                        "error": "Worker process failed: %r" % error}
+
+    def as_dict(self):
+        RV = OrderedDict([("id", self.id),
+                          ("status", self.status()),
+                          ("input", self.input_name),
+                          ("output", self.output_name),
+                          ("format", self.output_format),
+                          ("submitted", self.submitted),
+                          ("finished", self.finished)])
+
+        results = self.results()
+        if results:
+            for key in ["records", "cached", "seconds", "error"]:
+                RV[key] = results.get(key)
+
+        return RV
+
+
+class ParseService():
+
+    """Parse books sent as jobs with a pool of worker processes kept warm
+    between jobs: modules, layouts and dictionaries are loaded once by every
+    worker, not once per book.
+
+    Jobs wait in a queue of the service and are handed to the pool only
+    when a worker is free, so queued jobs can still be cancelled and running
+    ones are really running. Status of every job is kept until max_finished
+    newer jobs have finished.
+
+    If output_dir is passed, outputs can only be written inside it, and jobs
+    without an output name write it there instead of next to their input.
+    Outputs are replaced (and removed first, with a results cache), so a
+    service reachable by other users must always have an output_dir."""
+
+    def __init__(self, max_workers=None, output_format="xlsx", reader=None,
+                 cache_dir=None, max_finished=1000, output_dir=None):
+        # worker processes are only needed by the server, not by clients
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait
+
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.output_format = output_format
+        self.reader = reader
+        self.cache_dir = cache_dir
+        self.max_finished = max_finished
+        self.output_dir = output_dir and os.path.realpath(output_dir)
+        self.jobs = OrderedDict()
+        self.queue = deque()
+        self.running = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.started = time.time()
+        self.closing = False
+
+        # load parsing code in every worker before the first job arrives
+        wait([self.executor.submit(warm_up)
+              for i in xrange(self.max_workers)])
+
+    # PUBLIC
+    def submit(self, input_name, output_name=None, output_format=None,
+               reader=None):
+        """Queue a book to be parsed. Output name is taken from the input
+        name if not passed. Returns the job.
+
+        Raises ServiceClosed once the service is shutting down."""
+
+        input_name = os.path.abspath(input_name)
+        if not os.path.isfile(input_name):
+            raise ValueError("Input file not found: %s" % input_name)
+
+        output_format = output_format or self.output_format
+        if output_name:
+            output_name = os.path.abspath(output_name)
+        else:
+            output_name = get_output_name(
+                input_name, self.output_dir or os.path.dirname(input_name),
+                "." + output_format)
+
+        if self.output_dir and not os.path.realpath(output_name).startswith(
+                os.path.join(self.output_dir, "")):
+            raise ValueError("Outputs must be inside %s" % self.output_dir)
+
+        with self.lock:
+            # the pool can't take jobs once shutdown has started
+            if self.closing:
+                raise ServiceClosed("Service is shutting down")
+
+            job = Job(str(next(self.ids)), input_name, output_name,
+                      output_format, reader or self.reader)
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            self._dispatch()
+
+        return job
+
+    def get(self, job_id):
+        """Return the job with job_id, or None if it is unknown."""
+        return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        """Return all jobs kept by the service, oldest first."""
+
+        with self.lock:
+            return list(self.jobs.values())
+
+    def wait(self, job, timeout=None):
+        """Wait until job finishes, or timeout seconds."""
+        job.finished_event.wait(timeout)
+
+    def cancel(self, job):
+        """Cancel a job that is still queued. Returns True if cancelled."""
+
+        with self.lock:
+            if job not in self.queue:
+                return False
+
+            self.queue.remove(job)
+            job.cancelled = True
+            self._finish(job)
+
+        return True
+
+    def status(self):
+        """Return a dict with the number of jobs in every status."""
+
+        jobs = self.list_jobs()
+
+        RV = OrderedDict([("workers", self.max_workers),
+                          ("uptime", round(time.time() - self.started, 3)),
+                          ("jobs", len(jobs))])
+        for status in JOB_STATUSES:
+            RV[status] = 0
+        for job in jobs:
+            RV[job.status()] += 1
+
+        return RV
+
+    def shutdown(self):
+        """Refuse new jobs, cancel queued ones, wait for running ones and
+        stop the workers."""
+
+        with self.lock:
+            self.closing = True
+            while self.queue:
+                self.cancel(self.queue[0])
+        self.executor.shutdown(wait=True)
+
+    # PRIVATE
+    def _dispatch(self):
+        """Hand queued jobs to the pool while there are free workers."""
+
+        with self.lock:
+            while self.queue and self.running < self.max_workers:
+                job = self.queue.popleft()
+                job.future = self.executor.submit(scrape_book,
+                                                  job.input_name,
+                                                  job.output_name,
+                                                  job.output_format,
+                                                  job.reader, self.cache_dir)
+                self.running += 1
+                job.future.add_done_callback(
+                    lambda future, job=job: self._finish_running(job))
+
+    def _finish_running(self, job):
+        """Free the worker of a finished job and give it the next one."""
+
+        with self.lock:
+            self.running -= 1
+            self._finish(job)
+            self._dispatch()
+
+    def _finish(self, job):
+        """Mark a job as finished and forget the oldest finished jobs."""
+
+        with self.lock:
+            job.finished = time.time()
+            job.finished_event.set()
+
+            finished = [old_job for old_job in self.jobs.values()
+                        if old_job.finished]
+            for old_job in finished[:-self.max_finished]:
+                del self.jobs[old_job.id]
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    """HTTP interface of the service, exchanging json documents:
+
+        POST /jobs              queue a job: {"input": ..., "output": ...,
+                                "format": ..., "reader": ...}, only input
+                                is needed
+        GET /jobs               status of all jobs
+        GET /jobs/<id>          status of a job, ?wait=<seconds> waits for
+                                it to finish
+        DELETE /jobs/<id>       cancel a queued job
+        GET /status             number of jobs in every status
+
+    Requests sent by browsers (with an Origin header) are refused, and jobs
+    must be posted as application/json, which a web page can't send to
+    another site without asking first."""
+
+    def do_GET(self):
+        if not self._check_origin():
+            return
+
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts == ["status"]:
+            self._send(200, self.server.service.status())
+
+        elif parts == ["jobs"]:
+            self._send(200, [job.as_dict() for job in
+                             self.server.service.list_jobs()])
+
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self._get_job(parts[1])
+            if job:
+                wait_seconds = parse_qs(url.query).get("wait")
+                if wait_seconds:
+                    try:
+                        wait_seconds = float(wait_seconds[0])
+                    except ValueError:
+                        return self._send(400, {"error": "Wait must be a "
+                                                         "number of seconds"})
+                    self.server.service.wait(job, wait_seconds)
+                self._send(200, job.as_dict())
+
+        else:
+            self._send(404, {"error": "Unknown path: %s" % url.path})
+
+    def do_POST(self):
+        if not self._check_origin():
+            return
+        if urlparse(self.path).path.strip("/") != "jobs":
+            return self._send(404, {"error": "Unknown path: %s" % self.path})
+
+        content_type = self.headers.get("Content-Type") or ""
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            return self._send(415, {"error": "Jobs must be sent as "
+                                             "application/json"})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or "{}")
+            if not isinstance(request, dict):
+                raise ValueError("Job must be a json object")
+            if not request.get("input"):
+                raise ValueError("Job needs an input file")
+            for key in JOB_KEYS:
+                if not isinstance(request.get(key), (basestring, type(None))):
+                    raise ValueError("Job %s must be a string" % key)
+
+            job = self.server.service.submit(request["input"],
+                                             request.get("output"),
+                                             request.get("format"),
+                                             request.get("reader"))
+        except ValueError as error:
+            return self._send(400, {"error": str(error)})
+        except ServiceClosed as error:
+            return self._send(503, {"error": str(error)})
+
+        self._send(202, job.as_dict())
+
+    def do_DELETE(self):
+        if not self._check_origin():
+            return
+
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send(404, {"error": "Unknown path: %s" % self.path})
+
+        job = self._get_job(parts[1])
+        if job:
+            if self.server.service.cancel(job):
+                self._send(200, job.as_dict())
+            else:
+                self._send(409, {"error": "Job %s is already %s" %
+                                          (job.id, job.status())})
+
+    def address_string(self):
+        # clients of unix sockets have no address
+        if isinstance(self.client_address, tuple):
+            return BaseHTTPRequestHandler.address_string(self)
+        return "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    # PRIVATE
+    def _check_origin(self):
+        """Refuse requests sent by web pages. Returns True if allowed."""
+
+        if self.headers.get("Origin") is not None:
+            self._send(403, {"error": "Requests from browsers are not "
+                                      "allowed"})
+            return False
+
+        return True
+
+    def _get_job(self, job_id):
+        RV = self.server.service.get(job_id)
+        if RV is None:
+            self._send(404, {"error": "Unknown job: %s" % job_id})
+        return RV
+
+    def _send(self, code, obj):
+        body = json.dumps(obj, indent=4)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServiceServer(SocketServer.ThreadingMixIn, HTTPServer):
+    """HTTP server of a ParseService, one thread per request."""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        HTTPServer.__init__(self, address, ServiceHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class UnixServiceServer(SocketServer.ThreadingMixIn,
+                            SocketServer.UnixStreamServer):
+        """HTTP server of a ParseService listening in a local unix socket."""
+
+        daemon_threads = True
+
+        def __init__(self, socket_name, service, verbose=False):
+            if os.path.exists(socket_name):
+                os.remove(socket_name)
+            SocketServer.UnixStreamServer.__init__(self, socket_name,
+                                                   ServiceHandler)
+            self.service = service
+            self.verbose = verbose
+
+        def server_close(self):
+            SocketServer.UnixStreamServer.server_close(self)
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+
+    class UnixHTTPConnection(httplib.HTTPConnection):
+        """HTTP connection to a service listening in a unix socket."""
+
+        def __init__(self, socket_name, timeout=None):
+            httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+            self.socket_name = socket_name
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if self.timeout is not None:
+                self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socket_name)
+
+
+# DATA
+HOST = "127.0.0.1"
+PORT = 8046
+JOB_STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+JOB_KEYS = ["input", "output", "format", "reader"]
+
+
+# INTERNAL FUNCTIONS
+def warm_up():
+    """Load parsing code and data in a worker process."""
+
+    from layouts import get_layout
+    from dictionaries import get_countries, get_units
+
+    get_layout()
+    get_countries()
+    get_units()
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def request(method, path, obj=None, host=None, port=None, socket_name=None,
+            timeout=None):
+    """Send a request to a running service, by http or by its unix socket.
+    Returns the http status code and the json answer."""
+
+    if socket_name:
+        connection = UnixHTTPConnection(socket_name, timeout)
+    else:
+        connection = httplib.HTTPConnection(host or HOST, port or PORT,
+                                            timeout=timeout)
+
+    try:
+        body = json.dumps(obj) if obj is not None else None
+        connection.request(method, path, body,
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+# USER FUNCTIONS
+def serve(host=None, port=None, socket_name=None, max_workers=None,
+          output_format=None, reader=None, cache_dir=None, verbose=False,
+          output_dir=None):
+    """Run the parse service until interrupted, listening in a unix socket
+    if socket_name is passed, or in host and port otherwise.
+
+    Any local user or process can reach a tcp port, so serving in host and
+    port needs an output_dir where all outputs are written."""
+
+    if not socket_name and not output_dir:
+        raise ValueError("Serving in a tcp port needs an output directory, "
+                         "or use a unix socket")
+
+    service = ParseService(max_workers, output_format or "xlsx", reader,
+                           cache_dir, output_dir=output_dir)
+
+    if socket_name:
+        server = UnixServiceServer(socket_name, service, verbose)
+        where = socket_name
+    else:
+        server = ServiceServer((host or HOST, port or PORT), service, verbose)
+        where = "http://%s:%d" % server.server_address[:2]
+
+    print "Parse service with %d workers listening in %s" % (
+        service.max_workers, where)
+
+    # stop like with ctrl-c when the service is terminated
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+def submit_job(input_name, output_name=None, output_format=None, reader=None,
+               wait_seconds=None, host=None, port=None, socket_name=None):
+    """Send a book to a running service. If wait_seconds is passed, waits
+    for the job to finish up to that time. Returns the status of the job."""
+
+    if output_name:
+        output_name = os.path.abspath(output_name)
+
+    code, job = request("POST", "/jobs",
+                        {"input": os.path.abspath(input_name),
+                         "output": output_name,
+                         "format": output_format,
+                         "reader": reader},
+                        host, port, socket_name)
+    if code != 202:
+        raise ValueError(job["error"])
+
+    if wait_seconds:
+        code, job = request("GET", "/jobs/%s?wait=%s" % (job["id"],
+                                                         wait_seconds),
+                            None, host, port, socket_name)
+
+    return job
+
+
+def main(args=None):
+    """Command line entry point to run the service or send jobs to it."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Parse ABBY files sent as jobs to a service with a pool "
+                    "of warm worker processes.")
+    arg_parser.add_argument("--host", default=HOST)
+    arg_parser.add_argument("-p", "--port", type=int, default=PORT)
+    arg_parser.add_argument("-s", "--socket", default=None,
+                            help="local unix socket, instead of host and port")
+    subparsers = arg_parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="run the service")
+    serve_parser.add_argument("-j", "--jobs", type=int, default=None,
+                              help="number of worker processes (default: "
+                                   "cpus)")
+    serve_parser.add_argument("-f", "--format", default=None,
+                              help="default output format: xlsx (default), "
+                                   "csv, tsv, parquet, arrow or sqlite")
+    serve_parser.add_argument("-r", "--reader", default=None,
+                              help="default rows reader: openpyxl (default) "
+                                   "or xml")
+    serve_parser.add_argument("-c", "--cache-dir", default=None,
+                              help="results cache directory, to skip books "
+                                   "already parsed")
+    serve_parser.add_argument("-o", "--output-dir", default=None,
+                              help="directory where all outputs are written "
+                                   "(needed without a unix socket)")
+    serve_parser.add_argument("-v", "--verbose", action="store_true",
+                              help="log every request")
+
+    submit_parser = subparsers.add_parser("submit", help="send a job")
+    submit_parser.add_argument("input_file", help="ABBY file to parse")
+    submit_parser.add_argument("output_file", nargs="?", default=None,
+                               help="file for parsed records")
+    submit_parser.add_argument("-f", "--format", default=None)
+    submit_parser.add_argument("-r", "--reader", default=None)
+    submit_parser.add_argument("-w", "--wait", type=float, default=None,
+                               help="seconds to wait for the job to finish")
+
+    status_parser = subparsers.add_parser("status", help="show jobs")
+    status_parser.add_argument("job_id", nargs="?", default=None)
+    args = arg_parser.parse_args(args)
+
+    if args.socket and not hasattr(socket, "AF_UNIX"):
+        arg_parser.error("unix sockets are not available in this platform, "
+                         "use --port")
+
+    if args.command == "serve":
+        if not (args.socket or args.output_dir):
+            arg_parser.error("serving in a tcp port needs --output-dir, or "
+                             "use --socket")
+        serve(args.host, args.port, args.socket, args.jobs, args.format,
+              args.reader, args.cache_dir, args.verbose, args.output_dir)
+        return 0
+
+    try:
+        if args.command == "submit":
+            job = submit_job(args.input_file, args.output_file, args.format,
+                             args.reader, args.wait, args.host, args.port,
+                             args.socket)
+        else:
+            path = "/jobs/%s" % args.job_id if args.job_id else "/status"
+            code, job = request("GET", path, None, args.host, args.port,
+                                args.socket)
+    except ValueError as error:
+        print "Error: %s" % error
+        return 1
+    except socket.error as error:
+        print "Error: service not reachable (%s)" % error
+        return 1
+
+    print json.dumps(job, indent=4)
+
+    return 1 if job.get("status") == "failed" else 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,560 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import csv
+import itertools
+
+
+class BaseSink():
+
+    """Receives records built from an ABBY file and writes them to an output
+    file, as soon as they are built.
+
+    Derived sinks open the output file when they are built, write a header
+    with field names, write every record passed to write() and finish the
+    output file when close() is called. Records are sequences of values, in
+    the same order of fields.
+
+    Blocks of records in columns (a dict with a list of values for every
+    field, like those of AbbyFile.iter_batches) are written with
+    write_batch(). Derived sinks can write whole blocks at once.
+
+    If records can't be finished (parsing failed), abort() is called instead
+    of close(): it closes any open file and removes the unfinished output."""
+
+    def __init__(self, file_name, fields):
+        self.file_name = file_name
+        self.fields = fields
+
+    def write(self, record):
+        """Write a record to the output."""
+        raise NotImplementedError
+
+    def write_batch(self, columns):
+        """Write a block of records in columns to the output."""
+
+        for record in zip(*[columns[field] for field in self.fields]):
+            self.write(record)
+
+    def close(self):
+        """Finish writing output file."""
+        raise NotImplementedError
+
+    def abort(self):
+        """Stop writing output file, removing what was written of it. Sinks
+        that write nothing before close() have nothing to remove."""
+        pass
+
+
+class XlsxSink(BaseSink):
+    """Write records in an excel sheet, using openpyxl optimized writer. The
+    whole workbook is serialized when the sink is closed."""
+
+    def __init__(self, file_name, fields):
+        BaseSink.__init__(self, file_name, fields)
+
+        from openpyxl import Workbook
+
+        # creates new excel sheet to store new records
+        self.wb = Workbook(optimized_write=True)
+        self.ws = self.wb.create_sheet()
+
+        # write field names
+        self.ws.append(fields)
+
+    def write(self, record):
+        self.ws.append(list(record))
+
+    def close(self):
+        self.wb.save(self.file_name)
+
+
+class CsvSink(BaseSink):
+    """Stream records to a comma separated values file encoded in utf-8. Rows
+    are flushed to disk as they are written, so memory use is constant."""
+
+    delimiter = ","
+
+    def __init__(self, file_name, fields):
+        BaseSink.__init__(self, file_name, fields)
+
+        self.f = open(file_name, "wb")
+        self.writer = csv.writer(self.f, delimiter=self.delimiter,
+                                 lineterminator="\n")
+
+        # write field names
+        self.writer.writerow(fields)
+
+    def write(self, record):
+        self.writer.writerow([self._encode(value) for value in record])
+
+    def write_batch(self, columns):
+        encoded = [[self._encode(value) for value in columns[field]]
+                   for field in self.fields]
+        self.writer.writerows(zip(*encoded))
+
+    def close(self):
+        self.f.close()
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.file_name)
+
+    def _encode(self, value):
+        """Convert a value to a utf-8 string, keeping full float precision."""
+
+        if value is None:
+            RV = ""
+        elif isinstance(value, unicode):
+            RV = value.encode("utf-8")
+        elif isinstance(value, float):
+            RV = repr(value)
+        else:
+            RV = str(value)
+
+        return RV
+
+
+class TsvSink(CsvSink):
+    """Stream records to a tab separated values file encoded in utf-8."""
+
+    delimiter = "\t"
+
+
+class ColumnarSink(BaseSink):
+    """Collect records in columns and write them in typed record batches of
+    batch_size records, using pyarrow (an optional dependency).
+
+    Years and country ids are stored as integers, quantities and values as
+    floats (any non numeric value, like "NA", is stored as null) and every
+    other field as strings. Strings of dictionary_fields, which are heavily
+    repeated along the records, are dictionary encoded. Derived sinks write
+    the batches."""
+
+    batch_size = 50000
+    int_fields = ("year", "id_country")
+    float_fields = ("quantity", "value")
+    dictionary_fields = ("desc_title", "desc_subt1", "desc_subt2",
+                         "desc_product", "product_units", "desc_country")
+
+    def __init__(self, file_name, fields, batch_size=None):
+        BaseSink.__init__(self, file_name, fields)
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("pyarrow is needed to write %s files" %
+                              self.__class__.__name__[:-4].lower())
+        self.pa = pyarrow
+
+        self.batch_size = batch_size or self.batch_size
+        self.schema = self._build_schema()
+        self.batch_schema = self.schema
+        self.columns = [[] for field in fields]
+
+    def write(self, record):
+        for column, value in zip(self.columns, record):
+            column.append(value)
+
+        if len(self.columns[0]) >= self.batch_size:
+            self._write_columns()
+
+    def write_batch(self, columns):
+        for column, field in zip(self.columns, self.fields):
+            column.extend(columns[field])
+
+        if len(self.columns[0]) >= self.batch_size:
+            self._write_columns()
+
+    def close(self):
+        if self.columns[0]:
+            self._write_columns()
+        self._close_writer()
+
+    def abort(self):
+        self._abort_writer()
+
+    def _build_schema(self):
+        """Build arrow schema with the type of every field."""
+        pa = self.pa
+
+        pa_fields = []
+        for field in self.fields:
+            if field in self.int_fields:
+                pa_type = pa.int64()
+            elif field in self.float_fields:
+                pa_type = pa.float64()
+            elif field in self.dictionary_fields:
+                pa_type = pa.dictionary(pa.int32(), pa.string())
+            else:
+                pa_type = pa.string()
+            pa_fields.append(pa.field(field, pa_type))
+
+        return pa.schema(pa_fields)
+
+    def _write_columns(self):
+        """Convert buffered columns into a record batch, write it and start
+        new buffers."""
+        pa = self.pa
+
+        arrays = []
+        for column, field in zip(self.columns, self.fields):
+            if field in self.int_fields:
+                array = pa.array([self._to_int(value) for value in column],
+                                 type=pa.int64())
+            elif field in self.float_fields:
+                array = pa.array([self._to_float(value) for value in column],
+                                 type=pa.float64())
+            elif field in self.dictionary_fields:
+                array = self._encode_dictionary(
+                    field, [self._to_unicode(value) for value in column])
+            else:
+                array = pa.array([self._to_unicode(value) for value in column],
+                                 type=pa.string())
+            arrays.append(array)
+
+        self._write_batch(pa.RecordBatch.from_arrays(
+            arrays, schema=self.batch_schema))
+        self.columns = [[] for field in self.fields]
+
+    def _encode_dictionary(self, field, values):
+        """Return values of a dictionary field encoded in their batch."""
+        return self.pa.array(values, type=self.pa.string()).dictionary_encode()
+
+    def _write_batch(self, batch):
+        """Write a record batch to the output file."""
+        raise NotImplementedError
+
+    def _close_writer(self):
+        """Finish writing output file."""
+        raise NotImplementedError
+
+    def _abort_writer(self):
+        """Close output file without finishing it, and remove it."""
+        raise NotImplementedError
+
+    def _to_int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _to_float(self, value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _to_unicode(self, value):
+        if value is None or isinstance(value, unicode):
+            return value
+        return unicode(value)
+
+
+class ParquetSink(ColumnarSink):
+    """Write records to a parquet file, one row group per record batch."""
+
+    def __init__(self, file_name, fields, batch_size=None):
+        ColumnarSink.__init__(self, file_name, fields, batch_size)
+
+        import pyarrow.parquet
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+
+    def _write_batch(self, batch):
+        self.writer.write_table(self.pa.Table.from_batches([batch]))
+
+    def _close_writer(self):
+        self.writer.close()
+
+    def _abort_writer(self):
+        self.writer.close()
+        os.remove(self.file_name)
+
+
+class ArrowSink(ColumnarSink):
+    """Write records to an arrow IPC file.
+
+    Dictionaries of an IPC file can't change between record batches, so
+    dictionary fields are encoded with dictionaries shared by all batches,
+    which only grow as new values are found. Batches are written to a
+    temporary stream with the indices of those fields, and copied to the
+    output file with the complete dictionaries when the sink is closed."""
+
+    def __init__(self, file_name, fields, batch_size=None):
+        ColumnarSink.__init__(self, file_name, fields, batch_size)
+        pa = self.pa
+
+        self.indexes = dict([(field, {}) for field in fields
+                             if field in self.dictionary_fields])
+        self.batch_schema = pa.schema(
+            [pa.field(field.name, pa.int32()) if field.name in self.indexes
+             else field for field in self.schema])
+
+        self.temp_name = file_name + ".tmp"
+        self.temp_file = pa.OSFile(self.temp_name, "wb")
+        self.writer = pa.RecordBatchStreamWriter(self.temp_file,
+                                                 self.batch_schema)
+
+    def _encode_dictionary(self, field, values):
+        """Return indices of values in the shared dictionary of field, adding
+        the new ones at its end."""
+
+        index = self.indexes[field]
+        return self.pa.array([None if value is None else
+                              index.setdefault(value, len(index))
+                              for value in values], type=self.pa.int32())
+
+    def _write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+    def _close_writer(self):
+        pa = self.pa
+
+        self.writer.close()
+        self.temp_file.close()
+
+        dictionaries = {}
+        for field, index in self.indexes.iteritems():
+            values = [None] * len(index)
+            for value, i in index.iteritems():
+                values[i] = value
+            dictionaries[field] = pa.array(values, type=pa.string())
+
+        source = pa.OSFile(self.temp_name, "rb")
+        output = pa.OSFile(self.file_name, "wb")
+        try:
+            writer = pa.RecordBatchFileWriter(output, self.schema)
+            for batch in pa.ipc.open_stream(source):
+                arrays = []
+                for field, column in zip(self.fields, batch.columns):
+                    if field in dictionaries:
+                        column = pa.DictionaryArray.from_arrays(
+                            column, dictionaries[field])
+                    arrays.append(column)
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    arrays, schema=self.schema))
+            writer.close()
+
+        finally:
+            output.close()
+            source.close()
+            os.remove(self.temp_name)
+
+    def _abort_writer(self):
+        # output file is only written when the sink is closed
+        self.writer.close()
+        self.temp_file.close()
+        os.remove(self.temp_name)
+
+
+class SqliteSink(BaseSink):
+    """Load records in a sqlite database, with a table of facts and tables of
+    dimensions (titles, subtitles, products and countries).
+
+    Values of each dimension are stored once, and facts (year, quantity and
+    value) keep the id of their dimensions. Dimension ids are looked up only
+    when their values change from the last record. Facts are inserted in
+    transactions of batch_size records, with pragmas for bulk loading, and
+    indexes are created when the load is finished. A "records" view joins
+    all tables back in the layout of fields, in the order records were
+    written (facts keep it in their fact_id).
+
+    The database is loaded in a temporary file next to the output, which
+    replaces the output only when the sink is closed.
+
+    Years and country ids are stored as integers, quantities and values as
+    floats (any non numeric value, like "NA", is stored as null)."""
+
+    batch_size = 100000
+    int_fields = ("year", "id_country")
+    float_fields = ("quantity", "value")
+
+    # (table, id column, fields) of every dimension
+    dimensions = [("titles", "title_id", ("id_title", "desc_title")),
+                  ("subt1", "subt1_id", ("id_subt1", "desc_subt1")),
+                  ("subt2", "subt2_id", ("id_subt2", "desc_subt2")),
+                  ("products", "product_id", ("id_product", "tariff_number",
+                                              "desc_product",
+                                              "product_units")),
+                  ("countries", "country_id", ("id_country", "desc_country"))]
+
+    pragmas = ["journal_mode = OFF",
+               "synchronous = OFF",
+               "locking_mode = EXCLUSIVE",
+               "temp_store = MEMORY",
+               "cache_size = 100000"]
+
+    def __init__(self, file_name, fields, batch_size=None):
+        BaseSink.__init__(self, file_name, fields)
+
+        self.batch_size = batch_size or self.batch_size
+
+        # only dimensions with all their fields in output fields are used
+        self.dimensions = [dimension for dimension in self.dimensions if
+                           set(dimension[2]).issubset(fields)]
+        dimension_fields = set([field for dimension in self.dimensions
+                                for field in dimension[2]])
+        self.fact_fields = [field for field in fields
+                            if field not in dimension_fields]
+
+        # positions of values of each dimension and of facts in records
+        self.dimension_indexes = [[fields.index(field) for field in
+                                   dimension[2]] for dimension in
+                                  self.dimensions]
+        self.fact_indexes = [fields.index(field) for field in
+                             self.fact_fields]
+
+        # ids of dimensions values, and values of last record
+        self.dimension_ids = [{} for dimension in self.dimensions]
+        self.last_values = [None for dimension in self.dimensions]
+        self.last_ids = [None for dimension in self.dimensions]
+        self.facts = []
+        self.fact_ids = itertools.count(1)
+
+        import sqlite3
+
+        # start a new database, leaving the output alone until closed
+        self.temp_name = file_name + ".tmp"
+        if os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
+        self.connection = sqlite3.connect(self.temp_name)
+        for pragma in self.pragmas:
+            self.connection.execute("PRAGMA " + pragma)
+        self._create_tables()
+
+    def write(self, record):
+        fact = [next(self.fact_ids)]
+
+        # take dimension ids, looking them up only if values changed
+        for i, indexes in enumerate(self.dimension_indexes):
+            values = tuple([record[index] for index in indexes])
+            if values != self.last_values[i]:
+                self.last_values[i] = values
+                self.last_ids[i] = self._get_dimension_id(i, values)
+            fact.append(self.last_ids[i])
+
+        for index, field in zip(self.fact_indexes, self.fact_fields):
+            fact.append(self._convert(field, record[index]))
+
+        self.facts.append(fact)
+        if len(self.facts) >= self.batch_size:
+            self._write_facts()
+
+    def close(self):
+        self._write_facts()
+        self._create_indexes()
+        self.connection.commit()
+        self.connection.close()
+
+        from checkpoint import replace_file
+        replace_file(self.temp_name, self.file_name)
+
+    def abort(self):
+        self.connection.close()
+        os.remove(self.temp_name)
+
+    def _create_tables(self):
+        """Create dimension and fact tables, and the records view."""
+
+        for table, id_column, fields in self.dimensions:
+            self.connection.execute(
+                "CREATE TABLE %s (%s INTEGER PRIMARY KEY, %s)" %
+                (table, id_column, ", ".join([self._column(field)
+                                              for field in fields])))
+
+        columns = ["fact_id INTEGER PRIMARY KEY"]
+        columns.extend(["%s INTEGER" % dimension[1] for dimension in
+                        self.dimensions])
+        columns.extend([self._column(field) for field in self.fact_fields])
+        self.connection.execute("CREATE TABLE facts (%s)" % ", ".join(columns))
+
+        joins = ["JOIN %s USING (%s)" % (table, id_column) for
+                 table, id_column, fields in self.dimensions]
+        self.connection.execute("CREATE VIEW records AS SELECT %s FROM facts "
+                                "%s ORDER BY fact_id" %
+                                (", ".join(self.fields), " ".join(joins)))
+
+    def _create_indexes(self):
+        """Index foreign keys and years of facts, once facts are loaded."""
+
+        columns = [dimension[1] for dimension in self.dimensions]
+        columns.extend([field for field in self.int_fields
+                        if field in self.fact_fields])
+
+        for column in columns:
+            self.connection.execute("CREATE INDEX facts_%s ON facts (%s)" %
+                                    (column, column))
+
+    def _get_dimension_id(self, i, values):
+        """Return id of dimension values, inserting them if they are new."""
+
+        ids = self.dimension_ids[i]
+        RV = ids.get(values)
+
+        if RV is None:
+            RV = len(ids) + 1
+            ids[values] = RV
+            table, id_column, fields = self.dimensions[i]
+            self.connection.execute(
+                "INSERT INTO %s VALUES (?%s)" % (table, ", ?" * len(values)),
+                (RV,) + values)
+
+        return RV
+
+    def _write_facts(self):
+        """Insert buffered facts in one transaction."""
+
+        if self.facts:
+            self.connection.executemany(
+                "INSERT INTO facts VALUES (%s)" %
+                ", ".join(["?"] * len(self.facts[0])), self.facts)
+            self.connection.commit()
+            self.facts = []
+
+    def _column(self, field):
+        """Return the definition of the column of a field."""
+
+        if field in self.int_fields:
+            return field + " INTEGER"
+        if field in self.float_fields:
+            return field + " REAL"
+
+        return field
+
+    def _convert(self, field, value):
+        """Convert numeric facts to numbers, or None if they are not."""
+
+        try:
+            if field in self.int_fields:
+                return int(value)
+            if field in self.float_fields:
+                return float(value)
+        except (TypeError, ValueError):
+            return None
+
+        return value
+
+
+# DATA
+SINKS = {"xlsx": XlsxSink,
+         "csv": CsvSink,
+         "tsv": TsvSink,
+         "parquet": ParquetSink,
+         "arrow": ArrowSink,
+         "sqlite": SqliteSink,
+         "db": SqliteSink}
+
+
+def get_sink(file_name, fields, output_format=None):
+    """Build the sink for output_format, or for the extension of file_name if
+    no output format is passed."""
+
+    # take format from file extension if not passed
+    output_format = output_format or \
+        os.path.splitext(file_name)[1].lstrip(".").lower()
+
+    if output_format not in SINKS:
+        raise ValueError("Unknown output format: %r. Valid formats are %s" %
+                         (output_format, ", ".join(sorted(SINKS))))
+
+    return SINKS[output_format](file_name, fields)
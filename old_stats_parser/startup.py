@@ -0,0 +1,236 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import os
+import sys
+import argparse
+import subprocess
+from collections import OrderedDict
+
+
+class ImportTimes():
+
+    """Import times of a module, parsed from the lines that `python -X
+    importtime` writes in stderr:
+
+        import time: self [us] | cumulative | imported package
+        import time:       211 |        211 |   _json
+        import time:      1790 |       2001 | json
+
+    Nested imports come first and are indented two spaces per level. The
+    header line and any other lines are skipped."""
+
+    def __init__(self, lines, modules=None):
+        self.imports = []
+        self.modules = modules or []
+
+        for line in lines:
+            if not line.startswith(IMPORT_TIME_PREFIX):
+                continue
+
+            fields = line[len(IMPORT_TIME_PREFIX):].split("|")
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+
+            name = fields[2].rstrip()
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            self.imports.append({"name": name.strip(),
+                                 "self": int(fields[0]),
+                                 "cumulative": int(fields[1]),
+                                 "depth": depth})
+
+    # PUBLIC
+    def total(self):
+        """Return microseconds spent in imports, adding up top level ones."""
+        return sum([imported["cumulative"] for imported in self.imports
+                    if imported["depth"] == 0])
+
+    def slowest(self, count=10):
+        """Return the count imports with more self time."""
+
+        return sorted(self.imports, key=lambda imported: imported["self"],
+                      reverse=True)[:count]
+
+    def loaded(self, module_names):
+        """Return the module_names (or their submodules) that were
+        imported."""
+
+        RV = []
+        for module_name in module_names:
+            for module in self.modules:
+                if module == module_name or \
+                        module.startswith(module_name + "."):
+                    RV.append(module_name)
+                    break
+
+        return RV
+
+
+# DATA
+IMPORT_TIME_PREFIX = "import time:"
+
+# modules imported by the console scripts, checked by default
+ENTRY_MODULES = ["abby_file", "batch", "service", "result_cache", "rowstore"]
+
+# microseconds every entry module may take to import, best of the runs,
+# about 1.5 times what it takes now: a module that starts importing more
+# than it needs goes over its budget. Timed imports are a bit slower than
+# plain ones, and eager imports of LAZY_MODULES are caught apart
+IMPORT_BUDGETS_US = {"abby_file": 35000,
+                     "batch": 45000,
+                     "service": 65000,
+                     "result_cache": 45000,
+                     "rowstore": 30000}
+
+# budget of modules without their own one
+IMPORT_BUDGET_US = 80000
+
+# packages only needed by some runs, and modules of book layouts (imported
+# when a book is parsed), imported where they are used: none of them may be
+# imported when an entry module is
+LAZY_MODULES = ["openpyxl", "chardet", "kitchen", "pyarrow", "sqlite3",
+                "pkg_resources", "concurrent", "multiprocessing", "cProfile",
+                "stats_book_1", "parsers", "dictionaries"]
+
+RUNS = 5
+
+# python 2 has no -X importtime: this script imports a module through a
+# timed __import__ that writes the same lines, then prints loaded modules
+TIMED_IMPORT_SCRIPT = r"""
+import sys
+import __builtin__
+from timeit import default_timer
+
+real_import = __builtin__.__import__
+children = [0]
+
+
+def timed_import(name, *args):
+    modules = len(sys.modules)
+    children.append(0)
+    start = default_timer()
+    try:
+        return real_import(name, *args)
+    finally:
+        cumulative = int((default_timer() - start) * 1000000)
+        nested = children.pop()
+        if len(sys.modules) > modules:
+            children[-1] += cumulative
+            sys.stderr.write("import time: %9d | %10d | %s%s\n" % (
+                cumulative - nested, cumulative,
+                "  " * (len(children) - 1), name))
+
+sys.stderr.write("import time: self [us] | cumulative | imported package\n")
+__builtin__.__import__ = timed_import
+__import__(sys.argv[1])
+__builtin__.__import__ = real_import
+
+sys.stdout.write(" ".join(sorted([name for name, module
+                                  in sys.modules.items() if module])))
+"""
+
+
+# INTERNAL FUNCTIONS
+def measure_import(module_name, python=None, cwd=None):
+    """Import module_name in a new interpreter (this one by default) and
+    return its ImportTimes. Modules are looked up from cwd, the directory of
+    this module by default, like the scripts do."""
+
+    process = subprocess.Popen(
+        [python or sys.executable, "-c", TIMED_IMPORT_SCRIPT, module_name],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)))
+    output, errors = process.communicate()
+
+    if process.returncode:
+        raise RuntimeError("Importing %s failed:\n%s" %
+                           (module_name, errors.strip()))
+
+    return ImportTimes(errors.splitlines(), output.split())
+
+
+def get_budget_us(module_name, budget_us=None):
+    """Return import budget of a module in microseconds: budget_us if it is
+    passed, or the budget of the module."""
+
+    return budget_us or IMPORT_BUDGETS_US.get(module_name, IMPORT_BUDGET_US)
+
+
+# USER FUNCTIONS
+def check_startup(module_names=None, budget_us=None, runs=RUNS, python=None):
+    """Measure import of every entry module runs times, and check its best
+    time against budget_us microseconds (the budget of every module by
+    default) and that no LAZY_MODULES are imported with it. Returns a dict
+    with results of every module."""
+
+    RV = OrderedDict()
+    for module_name in module_names or ENTRY_MODULES:
+
+        # the best run is the one least disturbed by other processes
+        times = min([measure_import(module_name, python)
+                     for i in xrange(runs)], key=ImportTimes.total)
+
+        module_budget_us = get_budget_us(module_name, budget_us)
+        RV[module_name] = {"total": times.total(),
+                           "budget": module_budget_us,
+                           "over_budget": times.total() > module_budget_us,
+                           "eager": times.loaded(LAZY_MODULES),
+                           "slowest": times.slowest()}
+
+    return RV
+
+
+def print_startup(results, slowest=0):
+    """Print import time of every module, and its slowest imports."""
+
+    for module_name, result in results.iteritems():
+        line = "%-20s %8.1f ms (budget %.1f ms)" % (
+            module_name, result["total"] / 1000.0, result["budget"] / 1000.0)
+        problems = []
+        if result["over_budget"]:
+            problems.append("over budget")
+        if result["eager"]:
+            problems.append("imports %s" % ", ".join(result["eager"]))
+        print line + "  " + ("; ".join(problems) or "OK")
+
+        for imported in result["slowest"][:slowest]:
+            print "    %8.1f ms  %s" % (imported["self"] / 1000.0,
+                                        imported["name"])
+
+
+def main(args=None):
+    """Command line entry point to check import time of entry modules."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Check that entry modules import within the startup "
+                    "budget, without importing optional heavy packages.")
+    arg_parser.add_argument("modules", nargs="*",
+                            help="modules to check (default: %s)" %
+                                 ", ".join(ENTRY_MODULES))
+    arg_parser.add_argument("-b", "--budget", type=float, default=None,
+                            help="milliseconds every module may take to "
+                                 "import (default: the budget of each "
+                                 "module)")
+    arg_parser.add_argument("-n", "--runs", type=int, default=RUNS,
+                            help="imports of every module, the best one is "
+                                 "checked (default: %d)" % RUNS)
+    arg_parser.add_argument("-s", "--slowest", type=int, default=0,
+                            help="show this number of slowest imports of "
+                                 "every module")
+    arg_parser.add_argument("--python", default=None,
+                            help="interpreter to measure (default: this one)")
+    args = arg_parser.parse_args(args)
+
+    budget_us = args.budget and args.budget * 1000
+    results = check_startup(args.modules, budget_us, args.runs, args.python)
+    print_startup(results, args.slowest)
+
+    if [result for result in results.itervalues()
+            if result["over_budget"] or result["eager"]]:
+        return 1
+
+    return 0
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
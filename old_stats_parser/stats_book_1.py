@@ -1,5 +1,45 @@
 #!C:\Python27
 # -*- coding: utf-8 -*-
+import parsers
+
+
+# DATA
+# parsers are tried in this order, first one accepting a row parses it
+PARSERS = [parsers.IgnoreRow, parsers.NoneImportParser, parsers.Head1Parser,
+           parsers.Head1IniPart, parsers.AgValuesParser,
+           parsers.Head1FinalPart, parsers.TblRowParser, parsers.Head2Parser,
+           parsers.TitleParser, parsers.Subt1Parser, parsers.Subt2Parser]
+
+# rows where a book can be split in chunks parsed apart: titles and
+# subtitles, never in the middle of a product table
+BOUNDARY_PARSERS = [parsers.TitleParser, parsers.Subt1Parser,
+                    parsers.Subt2Parser]
+
+# rows starting a section of the book that can be cached apart: boundaries
+# and "Tarifa" heads of product tables
+SECTION_PARSERS = BOUNDARY_PARSERS + [parsers.Head1Parser,
+                                      parsers.Head1IniPart]
+
+FIELDS = ["id_title",
+          "desc_title",
+          "id_subt1",
+          "desc_subt1",
+          "id_subt2",
+          "desc_subt2",
+          "id_product",
+          "tariff_number",
+          "desc_product",
+          "product_units",
+          "id_country",
+          "desc_country",
+          "year",
+          "quantity",
+          "value"]
+
+# fields taken from title, subtitles and product table head
+HIERARCHY_FIELDS = FIELDS[:10]
+
+FIELDS_INDEX = dict([(field, i) for i, field in enumerate(FIELDS)])
 
 
 class Context():
@@ -38,6 +78,76 @@ class Context():
         self.type_last_row = ""
         self.last_row = ""
 
+        # hierarchy fields shared by records, kept by RecordsBuilder
+        self.hierarchy = None
+
+
+class Record(object):
+    """Record of the parsed database, with the values of FIELDS in order.
+
+    Hierarchy values (title, subtitles and product) are held in a tuple shared
+    by all records built under the same context, only the values of a table
+    row are stored in each record. Records are sequences of values in FIELDS
+    order, but values can also be accessed by field name like in a dict."""
+
+    __slots__ = ("hierarchy", "id_country", "desc_country", "year",
+                 "quantity", "value")
+
+    def __init__(self, hierarchy, id_country, desc_country, year, quantity,
+                 value):
+        self.hierarchy = hierarchy
+        self.id_country = id_country
+        self.desc_country = desc_country
+        self.year = year
+        self.quantity = quantity
+        self.value = value
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __getitem__(self, key):
+        """Return value by position or by field name."""
+
+        if isinstance(key, basestring):
+            i = FIELDS_INDEX[key]
+            if i < len(HIERARCHY_FIELDS):
+                return self.hierarchy[i]
+            return getattr(self, key)
+
+        return self.as_tuple()[key]
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    # records compare by value, like the lists they replace, and their values
+    # can be changed, so they are not hashable
+    __hash__ = None
+
+    def __repr__(self):
+        return "Record%r" % (self.as_tuple(),)
+
+    def __reduce__(self):
+        return (Record, (self.hierarchy, self.id_country, self.desc_country,
+                         self.year, self.quantity, self.value))
+
+    def keys(self):
+        return list(FIELDS)
+
+    def as_tuple(self):
+        """Return values of the record in FIELDS order."""
+        return self.hierarchy + (self.id_country, self.desc_country,
+                                 self.year, self.quantity, self.value)
+
+    def as_dict(self):
+        """Return a dict with field names as keys."""
+        return dict(zip(FIELDS, self.as_tuple()))
+
 
 class RecordsBuilder():
     """Build records from a StatsBook1Context instance."""
@@ -54,43 +164,85 @@ class RecordsBuilder():
         if self.context.row_type == "agg_values" or \
                 self.context.row_type == "tbl_row":
 
+            # all records built from the row share the hierarchy values
+            hierarchy = self._get_hierarchy()
+
             # each value has a year and quantity, the other variables are equal
             i = 0
             for value in self.context.value:
 
-                new_record = dict()
+                # adds new record
+                new_records.append(Record(hierarchy,
+                                          self.context.id_country,
+                                          self.context.desc_country,
+                                          self.context.year[i],
+                                          self.context.quantity[i],
+                                          value))
+                i += 1
 
-                # title
-                new_record["id_title"] = self.context.id_title
-                new_record["desc_title"] = self.context.desc_title
+        # update last row_type
+        self.context.row_type = str(self.context.row_type)
 
-                # first level subtitle
-                new_record["id_subt1"] = self.context.id_subt1
-                new_record["desc_subt1"] = self.context.desc_subt1
+        return new_records
 
-                # second level subtitle
-                new_record["id_subt2"] = self.context.id_subt2
-                new_record["desc_subt2"] = self.context.desc_subt2
+    def build_columns(self, columns, size):
+        """Build records like build_records does, but writing their values
+        straight in columns (lists of values in FIELDS order, preallocated by
+        the caller) from position size on. Columns are extended if they are
+        full. Returns the new number of values in columns."""
 
-                # head product table
-                new_record["id_product"] = self.context.id_product
-                new_record["tariff_number"] = self.context.tariff_number
-                new_record["desc_product"] = self.context.desc_product
-                new_record["product_units"] = self.context.product_units
+        # only if row_type is one with data, records can be built
+        if self.context.row_type == "agg_values" or \
+                self.context.row_type == "tbl_row":
 
-                # data inside product table
-                new_record["id_country"] = self.context.id_country
-                new_record["desc_country"] = self.context.desc_country
-                new_record["year"] = self.context.year[i]
-                new_record["quantity"] = self.context.quantity[i]
-                new_record["value"] = value
+            count = len(self.context.value)
+            end = size + count
 
-                # adds new record
-                new_records.append(new_record)
-                i += 1
+            # make room for new records if columns are full
+            if end > len(columns[0]):
+                for column in columns:
+                    column.extend([None] * (end - len(column)))
+
+            # hierarchy and country values are the same for all records
+            hierarchy = self._get_hierarchy()
+            for column, value in zip(columns, hierarchy):
+                column[size:end] = [value] * count
+
+            (id_country, desc_country, year, quantity,
+             value) = columns[len(hierarchy):]
+            id_country[size:end] = [self.context.id_country] * count
+            desc_country[size:end] = [self.context.desc_country] * count
+
+            # each value has a year and quantity
+            year[size:end] = [self.context.year[i] for i in xrange(count)]
+            quantity[size:end] = [self.context.quantity[i]
+                                  for i in xrange(count)]
+            value[size:end] = list(self.context.value)
+
+            size = end
 
         # update last row_type
         self.context.row_type = str(self.context.row_type)
 
-        return new_records
+        return size
+
+    def _get_hierarchy(self):
+        """Return a tuple with hierarchy values of context. The same tuple is
+        reused while hierarchy values in context don't change."""
+
+        hierarchy = (self.context.id_title,
+                     self.context.desc_title,
+                     self.context.id_subt1,
+                     self.context.desc_subt1,
+                     self.context.id_subt2,
+                     self.context.desc_subt2,
+                     self.context.id_product,
+                     self.context.tariff_number,
+                     self.context.desc_product,
+                     self.context.product_units)
+
+        # keep the new tuple in context only if hierarchy changed
+        if hierarchy != self.context.hierarchy:
+            self.context.hierarchy = hierarchy
 
+        return self.context.hierarchy
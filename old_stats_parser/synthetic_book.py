@@ -0,0 +1,237 @@
+#!C:\Python27
+# -*- coding: utf-8 -*-
+import sys
+import random
+import argparse
+
+
+class SyntheticBook():
+
+    """Generate rows shaped like ABBY output of Stats Book 1, to build books of
+    any size for benchmarks.
+
+    A book has titles, first level subtitles ("a)"), second level subtitles
+    ("1.") and product tables ("Tarifa" heads, some of them splitted in two
+    rows) with a "Totales" row and a 5 cells row per country. Aggregated values
+    ("Valor total:") follow titles and subtitles, some products have no
+    imports ("Sin importacion") and some tables continue in a new page,
+    repeating the title and the head with "(Conclusion)". Rows are separated
+    by empty rows, like in ABBY output."""
+
+    def __init__(self, titles=3, subts1=2, subts2=3, products=10, countries=6,
+                 split_heads=0.2, none_imports=0.1, conclusions=0.05, seed=0):
+        self.titles = titles
+        self.subts1 = subts1
+        self.subts2 = subts2
+        self.products = products
+        self.countries = countries
+        self.split_heads = split_heads
+        self.none_imports = none_imports
+        self.conclusions = conclusions
+        self.random = random.Random(seed)
+
+    # PUBLIC
+    def iter_rows(self):
+        """Yield all rows of the book as lists of cell values."""
+
+        id_product = 0
+        for i_title in xrange(self.titles):
+            title = self._choice(TITLES)
+            for row in self._title_rows(i_title, title):
+                yield row
+
+            for i_subt1 in xrange(self.subts1):
+                for row in self._subt1_rows(i_subt1):
+                    yield row
+
+                for i_subt2 in xrange(self.subts2):
+                    for row in self._subt2_rows(i_subt2):
+                        yield row
+
+                    for i_product in xrange(self.products):
+                        id_product += 1
+                        for row in self._product_rows(id_product, i_title,
+                                                      title):
+                            yield row
+
+    def save(self, file_name):
+        """Write the book in an excel file. Returns number of rows written."""
+
+        from openpyxl import Workbook
+
+        wb = Workbook(optimized_write=True)
+        ws = wb.create_sheet()
+
+        RV = 0
+        for row in self.iter_rows():
+            ws.append(row)
+            RV += 1
+
+        wb.save(file_name)
+
+        return RV
+
+    # PRIVATE
+    def _title_rows(self, i_title, title, continuation=False):
+        row = u"T\xcdTULO %s. \u2014 %s" % (ROMANS[i_title % len(ROMANS)],
+                                             title)
+        if continuation:
+            return [[row + u" (Continuaci\xf3n)"], []]
+
+        return [[row], [], [self._ag_values()], []]
+
+    def _subt1_rows(self, i_subt1):
+        row = u"%s) %s" % (LETTERS[i_subt1 % len(LETTERS)],
+                           self._choice(TITLES))
+
+        return [[row], [], [self._ag_values()], []]
+
+    def _subt2_rows(self, i_subt2):
+        # only one digit numbers are recognized as second level subtitles
+        row = u"%d.  %s " % (i_subt2 % 9 + 1, self._choice(SUBTITLES))
+
+        return [[row], [], [self._ag_values()], []]
+
+    def _product_rows(self, id_product, i_title, title):
+        tariff = self.random.randint(1, 4999)
+        desc_product = self._choice(PRODUCTS)
+        units = self._choice(UNITS)
+
+        # head of table, complete or splitted in two rows
+        if self.random.random() < self.split_heads:
+            rows = [[u"%d. (N\xb0 Tarifa %d). \u2014 %s," %
+                     (id_product, tariff, desc_product)],
+                    [u"%s:" % units], []]
+        else:
+            rows = [[u"%d. (N\xb0 Tarifa %d).\u2014%s, %s:" %
+                     (id_product, tariff, desc_product, units)], []]
+
+        if self.random.random() < self.none_imports:
+            return rows + [[u"Sin importaci\xf3n en los a\xf1os 1945 y 1946."],
+                           []]
+
+        # table rows, with totals if there are many countries
+        countries = self.random.sample(COUNTRIES,
+                                       min(self.countries, len(COUNTRIES)))
+        if len(countries) > 1:
+            rows.append(self._tbl_row(u"Totales %d" % id_product))
+
+        for i, country in enumerate(countries):
+
+            # table continues in a new page
+            if i and self.random.random() < self.conclusions:
+                rows.append([])
+                rows.extend(self._title_rows(i_title, title, True))
+                rows.append([u"%d. \u2014 %s, %s: (Conclusi\xf3n)" %
+                             (id_product, desc_product, units)])
+                rows.append([])
+
+            rows.append(self._tbl_row(country))
+
+        rows.append([])
+
+        return rows
+
+    def _tbl_row(self, desc_country):
+        """Build a 5 cells table row: country, quantities and values."""
+
+        row = [desc_country + u"." * self.random.randint(3, 20)]
+        for i in xrange(4):
+            if self.random.random() < 0.1:
+                row.append(u"\u2014")
+            else:
+                row.append(self._number())
+
+        # last cell can't be empty, or row would be shorter
+        if row[-1] == u"\u2014":
+            row[-1] = self._number()
+
+        return row
+
+    def _ag_values(self):
+        return u"(Valor total: 1945 m$n. %s; 1946 m$n. %s)" % (
+            self._number(10 ** 9), self._number(10 ** 9))
+
+    def _number(self, maximum=10 ** 6):
+        """Random number formatted like argentinian books: 1.234.567"""
+
+        number = self.random.randint(1, maximum)
+        return u"{:,}".format(number).replace(",", ".")
+
+    def _choice(self, values):
+        return self.random.choice(values)
+
+
+# DATA
+ROMANS = [u"I", u"II", u"III", u"IV", u"V", u"VI", u"VII", u"VIII", u"IX",
+          u"X", u"XI", u"XII", u"XIII", u"XIV", u"XV", u"XVI"]
+
+LETTERS = u"abcdefghijklmnopqrstuvwxyz"
+
+TITLES = [u"SUBSTANCIAS ALIMENTICIAS", u"TABACO Y SUS MANUFACTURAS",
+          u"BEBIDAS", u"TEXTILES Y SUS MANUFACTURAS", u"PRODUCTOS QUIMICOS",
+          u"PAPEL Y SUS APLICACIONES", u"MADERAS Y SUS MANUFACTURAS",
+          u"HIERRO Y SUS MANUFACTURAS", u"MAQUINARIAS Y VEHICULOS",
+          u"PIEDRAS Y TIERRAS", u"SUBSTANCIAS ALIMENTICIAS ANIMALES",
+          u"SUBSTANCIAS ALIMENTICIAS VEGETALES"]
+
+SUBTITLES = [u"Pescados", u"Carnes", u"Lacteos", u"Frutas", u"Hortalizas",
+             u"Cereales", u"Especias", u"Aceites", u"Conservas", u"Varios"]
+
+PRODUCTS = [u"Arenques ahumados en cajas", u"Arenques conservados",
+            u"Bacalao y otros pescados an\xe1logos, enteros",
+            u"Sardinas en aceite o salsa", u"Miel",
+            u"Leche condensada, evaporada o en polvo",
+            u"Aceites de coco y palma, comestibles",
+            u"Cacao en pasta o polvo", u"Arroz triturado",
+            u"Avena aplastada, en paquetes o latas",
+            u"Canela de Ceyl\xe1n, entera o en polvo",
+            u"Mostaza inglesa en tarros", u"Pimienta en grano",
+            u"Cocos llamados del Brasil o Paraguay",
+            u"D\xe1tiles en envases hasta 2 kilogramos",
+            u"Pasas de uva en envases hasta 2 kilogramos",
+            u"Frutas secas en general, en cajas"]
+
+UNITS = [u"kilogramos", u"Kg.", u"litros", u"docenas", u"unidades"]
+
+COUNTRIES = [u"Alemania", u"B\xe9lgica", u"Bolivia", u"Brasil", u"Canad\xe1",
+             u"Ceil\xe1n", u"Chile", u"China", u"Dinamarca", u"Ecuador",
+             u"Espa\xf1a", u"Estados Unidos", u"Francia", u"Grecia",
+             u"India", u"Indias orientales holand.", u"Italia", u"Jap\xf3n",
+             u"M\xe9xico", u"Noruega", u"Pa\xedses Bajos", u"Paraguay",
+             u"Per\xfa", u"Portugal", u"Reino Unido", u"Suecia", u"Suiza",
+             u"Turqu\xeda", u"Uni\xf3n Sudafricana", u"Uruguay"]
+
+
+def generate_book(file_name, **kwargs):
+    """Write a synthetic ABBY book in file_name. Keyword arguments are passed
+    to SyntheticBook. Returns number of rows written."""
+
+    return SyntheticBook(**kwargs).save(file_name)
+
+
+def main(args=None):
+    """Command line entry point to generate a synthetic book."""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Generate a synthetic ABBY book for benchmarks.")
+    arg_parser.add_argument("file_name", help="excel file to write")
+    arg_parser.add_argument("--titles", type=int, default=3)
+    arg_parser.add_argument("--subts1", type=int, default=2)
+    arg_parser.add_argument("--subts2", type=int, default=3)
+    arg_parser.add_argument("--products", type=int, default=10)
+    arg_parser.add_argument("--countries", type=int, default=6)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args(args)
+
+    rows = generate_book(args.file_name, titles=args.titles,
+                         subts1=args.subts1, subts2=args.subts2,
+                         products=args.products, countries=args.countries,
+                         seed=args.seed)
+
+    print "%d rows written to %s" % (rows, args.file_name)
+
+
+# executes main routine
+if __name__ == '__main__':
+    sys.exit(main())
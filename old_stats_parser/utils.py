@@ -1,8 +1,7 @@
 #!C:\Python27
 # -*- coding: utf-8 -*-
-import chardet
-from kitchen.text.converters import to_unicode
-from openpyxl import Workbook
+import re
+from collections import OrderedDict
 
 
 def write_ws(ws, record, fields):
@@ -23,6 +22,72 @@ def convert_to_float(strValue):
     return floatValue
 
 
+def convert_to_floats(values):
+    """Convert a batch of cells to floats like convert_to_float does, giving
+    None for cells that can't be converted instead of raising.
+
+    Text cells are joined in one buffer and classified by a single pass of
+    CELLS_RE over it. Plain numbers ("1.234,5") get their separators fixed
+    with one replace over all of them and are converted by map(float), empty
+    marks ("-", "...") give None, and only the other cells go through
+    convert_to_float and its exceptions."""
+
+    texts = [value for value in values if isinstance(value, basestring)]
+    if not texts:
+        return [None] * len(values)
+
+    # cells holding the separator, or byte strings that can't be joined with
+    # unicode ones, are converted one by one
+    try:
+        buffer = CELL_SEPARATOR.join(texts)
+    except UnicodeDecodeError:
+        return convert_each_to_float(values)
+    if buffer.count(CELL_SEPARATOR) != len(texts) - 1:
+        return convert_each_to_float(values)
+
+    cells = CELLS_RE.findall(buffer + CELL_SEPARATOR)
+    numbers = [number for number, other in cells if number]
+    if numbers:
+        numbers = iter(map(float, CELL_SEPARATOR.join(numbers).replace(
+            ".", "").replace(",", ".").split(CELL_SEPARATOR)))
+
+    RV = [next(numbers) if number else
+          convert_each_to_float([other])[0] if other else None
+          for number, other in cells]
+
+    # cells that are not text (rare) give None in their place
+    if len(texts) < len(values):
+        RV = iter(RV)
+        RV = [next(RV) if isinstance(value, basestring) else None
+              for value in values]
+
+    return RV
+
+
+def convert_each_to_float(values):
+    """Convert cells like convert_to_floats does, one cell at a time."""
+
+    RV = []
+    for value in values:
+
+        if not isinstance(value, basestring):
+            RV.append(None)
+
+        elif NUMBER_RE.match(value):
+            RV.append(float(value.strip().replace(".", "").replace(",", ".")))
+
+        elif NOT_NUMBER_RE.match(value):
+            RV.append(None)
+
+        else:
+            try:
+                RV.append(convert_to_float(value))
+            except Exception:
+                RV.append(None)
+
+    return RV
+
+
 def find_nth(s, x, n):
     i = -1
     for _ in range(n):
@@ -36,6 +101,8 @@ def dict_list_to_excel(dictList, xlName="Output.xlsx"):
     """toma una lista de diccionarios iguales y devuelve una tabla
     en excel con campos tomados de las claves del primer diccionario"""
 
+    from openpyxl import Workbook
+
     # creo el libro y tomo la hoja
     wb = Workbook()
     ws = wb.get_active_sheet()
@@ -72,15 +139,128 @@ def get_unicode(string, encoding='utf-8', errors='replace'):
 
     # si el valor no es None, intenta convertir a unicode
     if string:
-        try:
-            RV = to_unicode(string, encoding, errors)
 
-        except Exception:
-            encoding = chardet.detect(string)["encoding"]
-            RV = to_unicode(string, encoding, errors)
+        # unicode y numeros no necesitan pasar por kitchen
+        if isinstance(string, unicode):
+            RV = string
+
+        elif isinstance(string, NUMBER_TYPES):
+            RV = unicode(str(string))
+
+        else:
+            from kitchen.text.converters import to_unicode
+
+            try:
+                RV = to_unicode(string, encoding, errors)
+
+            except Exception:
+                import chardet
+                encoding = chardet.detect(string)["encoding"]
+                RV = to_unicode(string, encoding, errors)
 
     # si es None, no convierte a unicode
     else:
         RV = string
 
     return RV
+
+
+class TextDecoder():
+
+    """Convert cell values to unicode, like get_unicode does, for all the cells
+    of a workbook.
+
+    Unicode values are returned as they are and numbers are converted with
+    str, without going through kitchen. Byte strings are decoded with
+    encoding; if that fails the encoding is detected once with chardet and
+    reused for next failures, instead of detecting it again for every cell.
+    Decoded byte strings are kept in a LRU cache of cache_size strings, with
+    hits and misses counters."""
+
+    def __init__(self, encoding='utf-8', errors='replace', cache_size=4096):
+        self.encoding = encoding
+        self.errors = errors
+        self.cache_size = cache_size
+        self.detected_encoding = None
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, value):
+        """Convert a value to unicode. Empty values are returned as they
+        are."""
+
+        if not value or isinstance(value, unicode):
+            return value
+
+        if isinstance(value, NUMBER_TYPES):
+            return unicode(str(value))
+
+        # look for the value in cache, moving it to the end if found
+        try:
+            RV = self.cache.pop(value)
+            self.hits += 1
+
+        except KeyError:
+            RV = self._decode_bytes(value)
+            self.misses += 1
+
+            # drop least recently used value if cache is full
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+
+        self.cache[value] = RV
+
+        return RV
+
+    def stats(self):
+        """Return a dict with counters of the cache."""
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.cache),
+                "detected_encoding": self.detected_encoding}
+
+    def _decode_bytes(self, value):
+        """Decode a byte string, detecting its encoding only if the known
+        encodings fail. Kitchen and chardet are imported the first time a
+        byte string is found, most workbooks only have unicode values."""
+
+        from kitchen.text.converters import to_unicode
+
+        try:
+            return to_unicode(value, self.encoding, self.errors)
+        except Exception:
+            pass
+
+        # try the encoding detected before in the workbook
+        if self.detected_encoding:
+            try:
+                return to_unicode(value, self.detected_encoding, self.errors)
+            except Exception:
+                pass
+
+        import chardet
+        self.detected_encoding = chardet.detect(value)["encoding"]
+
+        return to_unicode(value, self.detected_encoding, self.errors)
+
+
+# DATA
+NUMBER_TYPES = (int, long, float)
+
+# numbers with dots between thousands and decimal comma, always convertible
+NUMBER_RE = re.compile(r"\s*[0-9][0-9.]*(,[0-9]+)?\s*$")
+
+# no digits or letters at all, never convertible
+NOT_NUMBER_RE = re.compile(r"[\W_]*$", re.U)
+
+# cells of a batch are joined with this character, not found in books
+CELL_SEPARATOR = u"\x00"
+
+# one match per cell of a joined batch, ending at its separator: the number
+# of a plain number cell, nothing for a cell without digits or letters, or
+# the whole text of any other cell
+CELLS_RE = re.compile(ur"\s*([0-9][0-9.]*(?:,[0-9]+)?)\s*\x00|"
+                      ur"(?:[^\w\x00]|_)*\x00|"
+                      ur"([^\x00]*)\x00", re.U)
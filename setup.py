@@ -1,6 +1,20 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='old_stats_parser',
       version='0.1',
       packages=['old_stats_parser'],
+      package_data={'old_stats_parser': ['abby_file.xlsx',
+                                         'golden/*.golden.gz']},
+      install_requires=['openpyxl>=1.8,<2.0', 'kitchen', 'chardet'],
+      extras_require={'parallel': ['futures'],
+                      'columnar': ['pyarrow']},
+      entry_points={
+          'console_scripts': [
+              'old-stats-parser = old_stats_parser.abby_file:main',
+              'old-stats-batch = old_stats_parser.batch:main',
+              'old-stats-service = old_stats_parser.service:main',
+              'old-stats-cache = old_stats_parser.result_cache:main',
+              'old-stats-compile = old_stats_parser.rowstore:main',
+          ],
+      },
       )
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from old_stats_parser import startup
+
+
+class StartupTestCase(unittest.TestCase):
+
+    """Entry modules must import within their budget, without importing any
+    of the packages and layout modules meant to be loaded lazily."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = startup.check_startup()
+
+    def test_entry_modules_within_budget(self):
+        for module_name, result in self.results.iteritems():
+            self.assertFalse(result["over_budget"],
+                             "%s imports in %.1f ms, over its budget of "
+                             "%.1f ms" % (module_name,
+                                          result["total"] / 1000.0,
+                                          result["budget"] / 1000.0))
+
+    def test_entry_modules_import_lazy_modules_lazily(self):
+        for module_name, result in self.results.iteritems():
+            self.assertEqual(result["eager"], [],
+                             "%s imports %s" % (module_name,
+                                                ", ".join(result["eager"])))
+
+    def test_import_times_parsing(self):
+        lines = ["import time: self [us] | cumulative | imported package",
+                 "import time:       211 |        211 |   _json",
+                 "import time:      1790 |       2001 | json",
+                 "import time:       300 |        300 | os",
+                 "something else"]
+        times = startup.ImportTimes(lines, ["json", "os", "os.path"])
+
+        self.assertEqual(times.total(), 2301)
+        self.assertEqual(times.slowest(1)[0]["name"], "json")
+        self.assertEqual(times.loaded(["os", "pyarrow"]), ["os"])
+
+
+if __name__ == '__main__':
+    unittest.main()